@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+
+from prodj.data.cachesim import policies, simulate
+from prodj.data.trace import read_trace
+
+# replays request traces recorded with monitor-qt.py --trace-requests against cache policies
+parser = argparse.ArgumentParser(description='Replay data request traces against cache policies and budgets')
+parser.add_argument('traces', nargs='+', help='Trace files')
+parser.add_argument('-p', '--policy', dest='policies', action='append', choices=sorted(policies), help='Cache policy to simulate, may be given multiple times (default: all)')
+parser.add_argument('-b', '--budget', dest='budgets', action='append', type=float, help='Cache budget in MiB, may be given multiple times (default: 8, 32 and 128)')
+parser.add_argument('-s', '--store', dest='stores', action='append', help='Only replay requests of this store, may be given multiple times (default: all)')
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)-7s %(module)s: %(message)s')
+
+records = [record for trace in args.traces for record in read_trace(trace)]
+records.sort(key=lambda record: record["time"])
+budgets = args.budgets if args.budgets is not None else [8, 32, 128]
+names = args.policies if args.policies is not None else sorted(policies)
+
+print("{:>10} {:>6} {:>9} {:>10} {:>14} {:>12}".format("budget MiB", "policy", "requests", "hit ratio", "bytes fetched", "latency ms"))
+for budget in budgets:
+  for name in names:
+    result = simulate(records, policies[name](int(budget*1024*1024)), args.stores)
+    print("{:>10} {:>6} {:>9} {:>10.3f} {:>14} {:>12.2f}".format(budget, name, result["requests"],
+      result["hit_ratio"], result["bytes_fetched"], result["expected_latency"]*1000))
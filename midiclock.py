@@ -39,6 +39,7 @@ c.open(args.device, args.port)
 p = ProDj()
 p.cl.log_played_tracks = False
 p.cl.auto_request_beatgrid = False
+p.data.prefetcher.enabled = False
 
 bpm = 128 # default bpm until reported from player
 beat = 0
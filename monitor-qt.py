@@ -21,10 +21,17 @@ def arg_layout(value):
     raise argparse.ArgumentTypeError("%s is not a value from the list xy, yx, xx, yy, row or column".format(value))
   return value
 
+def arg_address(value):
+  host, sep, port = value.rpartition(":")
+  if sep == "" or not port.isdigit():
+    return value # unix socket path
+  return (host, int(port))
+
 parser = argparse.ArgumentParser(description='Python ProDJ Link')
 provider_group = parser.add_mutually_exclusive_group()
 provider_group.add_argument('--disable-pdb', dest='enable_pdb', action='store_false', help='Disable PDB provider')
 provider_group.add_argument('--disable-dbc', dest='enable_dbc', action='store_false', help='Disable DBClient provider')
+parser.add_argument('--adaptive', action='store_true', help='Query PDB and DBClient concurrently if one of them answers slowly')
 parser.add_argument('--color-preview', action='store_true', help='Show NXS2 colored preview waveforms')
 parser.add_argument('--color-waveform', action='store_true', help='Show NXS2 colored big waveforms')
 parser.add_argument('-c', '--color', action='store_true', help='Shortcut for --color-preview and --color-waveform')
@@ -32,6 +39,11 @@ parser.add_argument('-q', '--quiet', action='store_const', dest='loglevel', cons
 parser.add_argument('-d', '--debug', action='store_const', dest='loglevel', const=logging.DEBUG, help='Display verbose debugging information')
 parser.add_argument('--dump-packets', action='store_const', dest='loglevel', const=0, help='Dump packet fields for debugging', default=logging.INFO)
 parser.add_argument('--chunk-size', dest='chunk_size', help='Chunk size of NFS downloads (high values may be faster but fail on some networks)', type=arg_size, default=None)
+parser.add_argument('--memory-budget', dest='memory_budget', help='Memory budget of cached data in MiB', type=int, default=None)
+parser.add_argument('--metrics-port', dest='metrics_port', help='Serve runtime metrics in prometheus format on this port', type=int, default=None)
+parser.add_argument('--cache-peer-port', dest='cache_peer_port', help='Share cached media data with other instances on this port', type=int, default=None)
+parser.add_argument('--trace-requests', dest='trace_requests', help='Append a record of every data request to this file for cache-simulator.py', default=None)
+parser.add_argument('--serve-data', dest='serve_data', help='Serve data requests to remote clients on host:port or a unix socket path', type=arg_address, default=None)
 parser.add_argument('-f', '--fullscreen', action='store_true', help='Start with fullscreen window')
 parser.add_argument('-l', '--layout', dest='layout', help='Display layout, values are xy (default), yx, xx, yy, row or column', type=arg_layout, default="xy")
 
@@ -42,8 +54,19 @@ logging.basicConfig(level=args.loglevel, format='%(levelname)-7s %(module)s: %(m
 prodj = ProDj()
 prodj.data.pdb_enabled = args.enable_pdb
 prodj.data.dbc_enabled = args.enable_dbc
+prodj.data.adaptive = args.adaptive
 if args.chunk_size is not None:
   prodj.nfs.setDownloadChunkSize(args.chunk_size)
+if args.memory_budget is not None:
+  prodj.data.governor.budget = args.memory_budget*1024*1024
+if args.metrics_port is not None:
+  prodj.data.start_metrics_server(args.metrics_port)
+if args.cache_peer_port is not None:
+  prodj.data.start_cache_peer(args.cache_peer_port)
+if args.trace_requests is not None:
+  prodj.data.start_trace(args.trace_requests)
+if args.serve_data is not None:
+  prodj.data.start_remote_server(args.serve_data)
 app = QApplication([])
 gui = Gui(prodj, show_color_waveform=args.color_waveform or args.color, show_color_preview=args.color_preview or args.color, arg_layout=args.layout)
 if args.fullscreen:
@@ -4,6 +4,7 @@ import logging
 import time
 
 from prodj.core.prodj import ProDj
+from prodj.data.dataprovider import gather
 
 default_loglevel=0
 default_loglevel=logging.DEBUG
@@ -48,8 +49,13 @@ try:
   p.vcdj_set_player_number(5)
   p.vcdj_enable()
   time.sleep(5)
-  p.data.get_root_menu(2, "usb", print_menu)
-  p.data.get_titles(2, "usb", "album", print_list)
+  # requests may also be issued without callbacks and awaited together
+  root_menu, titles = gather([
+    p.data.get_root_menu(2, "usb"),
+    p.data.get_titles(2, "usb", "album")
+  ], timeout=60, return_exceptions=True)
+  print_menu("root_menu", 2, "usb", root_menu if isinstance(root_menu, list) else [])
+  print_list("title", 2, "usb", None, titles if isinstance(titles, list) else [])
   #p.data.get_titles_by_album(2, "usb", 16, "bpm", print_list)
   #p.data.get_playlists(2, "usb", 0, print_list)
   #p.data.get_playlist(2, "usb", 0, 12, "default", print_list)
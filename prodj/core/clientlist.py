@@ -2,6 +2,8 @@ import time
 import logging
 from datetime import datetime
 
+from prodj.data.dataprovider import CancelToken
+
 class ClientList:
   def __init__(self, prodj):
     self.clients = []
@@ -11,6 +13,8 @@ class ClientList:
     self.log_played_tracks = True
     self.auto_request_beatgrid = True # to enable position detection
     self.auto_track_download = False
+    self.auto_load_media = True # load media databases as soon as they are mounted
+    self.track_cancel_tokens = {} # player_number -> CancelToken of requests for the loaded track
     self.prodj = prodj
 
   def __len__():
@@ -41,24 +45,36 @@ class ClientList:
           p.track_id == track_id):
         p.metadata = metadata
 
-  def mediaChanged(self, player_number, slot):
+  def mediaLoaded(self, player_number, slot):
+    c = self.getClient(player_number)
+    if c is None:
+      return False
+    if slot == "usb":
+      return c.usb_state == "loaded"
+    elif slot == "sd":
+      return c.sd_state == "loaded"
+    return False
+
+  def mediaChanged(self, player_number, slot, clear_caches=True):
     logging.debug("Media %s in player %d changed", slot, player_number)
-    self.prodj.data.cleanup_stores_from_changed_media(player_number, slot)
+    if clear_caches:
+      self.prodj.data.cleanup_stores_from_changed_media(player_number, slot)
+    if self.auto_load_media and self.mediaLoaded(player_number, slot):
+      self.prodj.data.preload_media(player_number, slot)
     if self.media_change_callback is not None:
       self.media_change_callback(self, player_number, slot)
 
   def updatePositionByBeat(self, player_number, new_beat_count, new_play_state):
     c = self.getClient(player_number)
     #logging.debug("Track position p %d abs %f actual_pitch %.6f play_state %s beat %d", player_number, c.position if c.position is not None else -1, c.actual_pitch, new_play_state, new_beat_count)
-    identifier = (c.loaded_player_number, c.loaded_slot, c.track_id)
-    if identifier in self.prodj.data.beatgrid_store:
+    beatgrid = self.prodj.data.stored_reply("beatgrid", c.loaded_player_number, c.loaded_slot, c.track_id)
+    if beatgrid is not None:
       if new_beat_count > 0:
         if (c.play_state == "cued" and new_play_state == "cueing") or (c.play_state == "playing" and new_play_state == "paused") or (c.play_state == "paused" and new_play_state == "playing"):
           return # ignore absolute position when switching from cued to cueing
         if new_play_state != "cued": # when releasing cue scratch, the beat count is still +1
           new_beat_count -= 1
-        beatgrid = self.prodj.data.beatgrid_store[identifier]
-        if beatgrid is not None and len(beatgrid) > new_beat_count:
+        if len(beatgrid) > new_beat_count:
           c.position = beatgrid[new_beat_count]["time"] / 1000
       else:
         c.position = 0
@@ -66,6 +82,13 @@ class ClientList:
       c.position = None
     c.position_timestamp = time.time()
 
+  # cancels outstanding requests for the previously loaded track of a player
+  def renewCancelToken(self, player_number):
+    if player_number in self.track_cancel_tokens:
+      self.track_cancel_tokens[player_number].cancel()
+    self.track_cancel_tokens[player_number] = CancelToken()
+    return self.track_cancel_tokens[player_number]
+
   def logPlayedTrackCallback(self, request, source_player_number, slot, item_id, reply):
     if request != "metadata" or reply is None or len(reply) == 0:
       return
@@ -149,15 +172,21 @@ class ClientList:
     if status_packet.type == "link_reply":
       link_info = { key: status_packet.content[key] for key in ["name", "track_count", "playlist_count", "bytes_total", "bytes_free", "date"] }
       if status_packet.content.slot == "usb":
+        old_link_info = c.usb_info
         c.usb_info = link_info
       elif status_packet.content.slot == "sd":
+        old_link_info = c.sd_info
         c.sd_info = link_info
       else:
         logging.warning("Received link info for %s not implemented", status_packet.content.slot)
+        old_link_info = {}
       logging.info("Player %d Link Info: %s \"%s\", %d tracks, %d playlists, %d/%dMB free",
         c.player_number, status_packet.content.slot, link_info["name"], link_info["track_count"], link_info["playlist_count"],
         link_info["bytes_free"]//1024//1024, link_info["bytes_total"]//1024//1024)
-      self.mediaChanged(c.player_number, status_packet.content.slot)
+      # without previous link info, the caches were already cleared when the slot state changed
+      # and the pdb may already be loading, so do not throw it away again
+      media_replaced = len(old_link_info) > 0 and old_link_info != link_info
+      self.mediaChanged(c.player_number, status_packet.content.slot, clear_caches=media_replaced)
       return
     c.type = status_packet.type # cdj or djm
 
@@ -236,11 +265,14 @@ class ClientList:
         client_changed = True
         c.metadata = None
         c.position = None
+        cancel_token = self.renewCancelToken(c.player_number)
+        self.prodj.data.pin_loaded_track(c.player_number, c.loaded_player_number, c.loaded_slot, c.track_id)
         if c.loaded_slot in ["usb", "sd"] and c.track_analyze_type == "rekordbox":
           if self.log_played_tracks:
-            self.prodj.data.get_metadata(c.loaded_player_number, c.loaded_slot, c.track_id, self.logPlayedTrackCallback)
+            self.prodj.data.get_metadata(c.loaded_player_number, c.loaded_slot, c.track_id, self.logPlayedTrackCallback, cancel_token=cancel_token)
           if self.auto_request_beatgrid and c.track_id != 0:
-            self.prodj.data.get_beatgrid(c.loaded_player_number, c.loaded_slot, c.track_id)
+            self.prodj.data.get_beatgrid(c.loaded_player_number, c.loaded_slot, c.track_id, cancel_token=cancel_token)
+          self.prodj.data.prefetcher.track_loaded(c.loaded_player_number, c.loaded_slot, c.track_id)
           if self.auto_track_download:
             logging.info("Automatic download of track in player %d", c.player_number)
             self.prodj.data.get_mount_info(c.loaded_player_number, c.loaded_slot,
@@ -259,6 +291,7 @@ class ClientList:
         self.clients += [client]
       else:
         logging.info("Player {} dropped due to timeout".format(client.player_number))
+        self.prodj.data.pin_loaded_track(client.player_number, 0, "empty", 0)
         if self.client_change_callback:
           self.client_change_callback(client.player_number)
 
@@ -24,6 +24,8 @@ class ProDj(Thread):
     self.data = DataProvider(self)
     self.vcdj = Vcdj(self)
     self.nfs = NfsClient(self)
+    self.nfs.metrics = self.data.metrics
+    self.nfs.pacer = self.data.pacer
     self.keepalive_ip = "0.0.0.0"
     self.keepalive_port = 50000
     self.beat_ip = "0.0.0.0"
@@ -149,3 +151,8 @@ class ProDj(Thread):
   # arguments of cb: this clientlist object, player_number, changed slot
   def set_media_change_callback(self, cb=None):
     self.cl.media_change_callback = cb
+
+  # called while the database of a newly mounted media is loaded
+  # arguments of cb: player_number, slot, stage ("download", "parse", "ready" or "failed"), progress in percent
+  def set_media_load_callback(self, cb=None):
+    self.data.pdb.load_progress_callback = cb
@@ -0,0 +1,154 @@
+import logging
+import os
+import socket
+import socketserver
+import time
+from threading import Event, Lock, Thread
+
+from . import remote
+from .diskcache import checksum
+
+cache_peer_port = 50117
+
+# fingerprints and names received from peers must be single path components of the DiskCache directory
+def valid_item_name(value):
+  return isinstance(value, str) and value not in ["", ".", ".."] and os.path.basename(value) == value
+
+# announce datagram: ["announce", instance id, tcp port, [fingerprints]]
+# request frame: ["get", fingerprint, name]
+# reply frame: ["ok", data, checksum] or ["missing", None, None]
+class CachePeerRequestHandler(socketserver.BaseRequestHandler):
+  def handle(self):
+    while True:
+      try:
+        frame = remote.receive_frame(self.request)
+      except (ValueError, OSError) as e:
+        logging.debug("cache peer %s: %s", str(self.client_address), e)
+        break
+      if frame is None:
+        break
+      if not isinstance(frame, list) or len(frame) != 3 or frame[0] != "get" or not all(valid_item_name(value) for value in frame[1:]):
+        logging.warning("invalid request from cache peer %s", str(self.client_address))
+        break
+      data = self.server.peer.cache.get(frame[1], frame[2])
+      try:
+        if data is None:
+          remote.send_frame(self.request, ["missing", None, None])
+        else:
+          self.server.peer.served += 1
+          remote.send_frame(self.request, ["ok", data, checksum(data)])
+      except OSError as e:
+        logging.debug("failed to reply to cache peer %s: %s", str(self.client_address), e)
+        break
+
+# shares a DiskCache with other prodj instances on the network
+# every announce_interval seconds the fingerprints of all media held are announced by udp
+# broadcast and to the static peers, items are requested from peers announcing their media by tcp
+# tcp and udp use the same port
+class CachePeer:
+  def __init__(self, cache, port=cache_peer_port, peers=None, broadcast=True, announce_interval=10):
+    self.cache = cache
+    self.port = port
+    self.static_peers = peers if peers is not None else [] # (host, port) tuples announced to in addition to the broadcast
+    self.broadcast = broadcast
+    self.announce_interval = announce_interval
+    self.request_timeout = 2 # seconds
+    self.instance_id = os.urandom(8)
+    self.peers = {} # (host, tcp port) -> (fingerprints, time of last announce)
+    self.lock = Lock()
+    self.event = Event()
+    self.fetched = 0 # items received from peers
+    self.served = 0 # items sent to peers
+
+    self.server = remote.ThreadingTCPServer(("0.0.0.0", port), CachePeerRequestHandler)
+    self.server.peer = self
+    self.udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    self.udp_sock.bind(("0.0.0.0", port))
+    self.udp_sock.settimeout(1)
+    self.threads = [Thread(target=self.server.serve_forever, daemon=True),
+      Thread(target=self.receive_announcements, daemon=True),
+      Thread(target=self.announce_periodically, daemon=True)]
+
+  def start(self):
+    logging.info("Sharing cached media data with peers on port %d", self.port)
+    for thread in self.threads:
+      thread.start()
+
+  def stop(self):
+    self.event.set()
+    self.server.shutdown()
+    self.server.server_close()
+    for thread in self.threads:
+      thread.join()
+    self.udp_sock.close()
+
+  def announce(self):
+    datagram = remote.encode(["announce", self.instance_id, self.port, sorted(self.cache.fingerprints())])
+    targets = list(self.static_peers)
+    if self.broadcast:
+      targets += [("<broadcast>", self.port)]
+    for target in targets:
+      try:
+        self.udp_sock.sendto(datagram, target)
+      except OSError as e:
+        logging.debug("failed to announce cache to %s: %s", str(target), e)
+
+  def announce_periodically(self):
+    while not self.event.is_set():
+      self.announce()
+      self.event.wait(self.announce_interval)
+
+  def receive_announcements(self):
+    while not self.event.is_set():
+      try:
+        data, address = self.udp_sock.recvfrom(65536)
+        announcement = remote.decode(data)
+        kind, instance_id, port, fingerprints = announcement
+        if not isinstance(port, int) or not 0 < port < 65536:
+          raise ValueError("invalid port {}".format(port))
+        if not isinstance(fingerprints, list) or not all(isinstance(fingerprint, str) for fingerprint in fingerprints):
+          raise ValueError("invalid fingerprints")
+      except socket.timeout:
+        continue
+      except OSError:
+        break
+      except (ValueError, TypeError) as e:
+        logging.debug("invalid cache announcement from %s: %s", str(address), e)
+        continue
+      if kind != "announce" or instance_id == self.instance_id:
+        continue
+      with self.lock:
+        if (address[0], port) not in self.peers:
+          logging.info("found cache peer %s:%d holding %d media", address[0], port, len(fingerprints))
+        self.peers[address[0], port] = (set(fingerprints), time.time())
+
+  # peers which recently announced holding media with fingerprint
+  def peers_holding(self, fingerprint):
+    expired_before = time.time()-3*self.announce_interval
+    with self.lock:
+      return [peer for peer, (fingerprints, seen_at) in self.peers.items() if seen_at >= expired_before and fingerprint in fingerprints]
+
+  # requests an item from the peers holding its media, adds it to the local cache
+  # returns None if no peer has it
+  def fetch(self, fingerprint, name):
+    for peer in self.peers_holding(fingerprint):
+      try:
+        with socket.create_connection(peer, timeout=self.request_timeout) as sock:
+          remote.send_frame(sock, ["get", fingerprint, name])
+          reply = remote.receive_frame(sock)
+      except (OSError, ValueError) as e:
+        logging.debug("cache peer %s failed: %s", str(peer), e)
+        continue
+      if not isinstance(reply, list) or len(reply) != 3 or reply[0] != "ok" or not isinstance(reply[1], bytes):
+        continue
+      status, data, data_checksum = reply
+      if checksum(data) != data_checksum:
+        logging.warning("cache peer %s sent corrupted %s", str(peer), name)
+        continue
+      logging.debug("received %s of %s from cache peer %s", name, fingerprint, str(peer))
+      self.fetched += 1
+      self.cache.put(fingerprint, name, data)
+      return data
+    return None
@@ -0,0 +1,197 @@
+import abc
+import heapq
+import itertools
+from collections import OrderedDict
+
+# cache policies for replaying request traces (see trace.RequestTracer)
+# access() returns True on a hit, otherwise the item is inserted, evicting others to stay within
+# budget bytes, items larger than the budget are never cached
+class CachePolicy(abc.ABC):
+  def __init__(self, budget):
+    self.budget = budget
+    self.bytes = 0
+
+  @abc.abstractmethod
+  def access(self, key, size, cost):
+    pass
+
+# least recently used first, like DataStore
+class LRUPolicy(CachePolicy):
+  def __init__(self, budget):
+    super().__init__(budget)
+    self.entries = OrderedDict() # key -> size, most recently used last
+
+  def access(self, key, size, cost):
+    if key in self.entries:
+      self.entries.move_to_end(key)
+      return True
+    if size > self.budget:
+      return False
+    self.entries[key] = size
+    self.bytes += size
+    while self.bytes > self.budget:
+      self.bytes -= self.entries.popitem(last=False)[1]
+    return False
+
+# least frequently used first, the least recently inserted of equally used entries
+class LFUPolicy(CachePolicy):
+  def __init__(self, budget):
+    super().__init__(budget)
+    self.entries = {} # key -> [count, size, sequence]
+    self.heap = [] # (count, sequence, key), outdated items are skipped
+    self.sequence = itertools.count()
+
+  # every hit leaves an outdated item behind, the heap is rebuilt once they outnumber the entries
+  def compact(self):
+    if len(self.heap) > 2*len(self.entries):
+      self.heap = [(entry[0], entry[2], key) for key, entry in self.entries.items()]
+      heapq.heapify(self.heap)
+
+  def access(self, key, size, cost):
+    entry = self.entries.get(key)
+    if entry is not None:
+      entry[0] += 1
+      heapq.heappush(self.heap, (entry[0], entry[2], key))
+      self.compact()
+      return True
+    if size > self.budget:
+      return False
+    entry = [1, size, next(self.sequence)]
+    self.entries[key] = entry
+    heapq.heappush(self.heap, (1, entry[2], key))
+    self.bytes += size
+    while self.bytes > self.budget:
+      count, sequence, victim = heapq.heappop(self.heap)
+      victim_entry = self.entries.get(victim)
+      if victim_entry is not None and victim_entry[0] == count and victim_entry[2] == sequence:
+        self.bytes -= self.entries.pop(victim)[1]
+    return False
+
+# adaptive replacement cache with sizes in bytes: t1 holds entries seen once, t2 entries seen
+# at least twice, b1 and b2 remember recently evicted keys to adapt the target size of t1
+class ARCPolicy(CachePolicy):
+  def __init__(self, budget):
+    super().__init__(budget)
+    self.lists = {name: OrderedDict() for name in ["t1", "t2", "b1", "b2"]} # key -> size
+    self.sizes = {name: 0 for name in self.lists}
+    self.target = 0 # target bytes of t1
+
+  def move(self, key, size, source, destination):
+    if source is not None:
+      del self.lists[source][key]
+      self.sizes[source] -= size
+    if destination is not None:
+      self.lists[destination][key] = size
+      self.sizes[destination] += size
+
+  def find(self, key):
+    return next((name for name, entries in self.lists.items() if key in entries), None)
+
+  def access(self, key, size, cost):
+    location = self.find(key)
+    if location in ["t1", "t2"]:
+      self.move(key, self.lists[location][key], location, "t2")
+      return True
+    if location == "b1":
+      self.target = min(self.budget, self.target+max(self.sizes["b2"]/max(self.sizes["b1"], 1), 1)*size)
+    elif location == "b2":
+      self.target = max(0, self.target-max(self.sizes["b1"]/max(self.sizes["b2"], 1), 1)*size)
+    if location is not None:
+      self.move(key, self.lists[location][key], location, None)
+    if size > self.budget:
+      return False
+    self.move(key, size, None, "t1" if location is None else "t2")
+    while self.sizes["t1"]+self.sizes["t2"] > self.budget:
+      if self.sizes["t1"] > 0 and (self.sizes["t1"] > self.target or self.sizes["t2"] == 0):
+        victim, victim_size = next(iter(self.lists["t1"].items()))
+        self.move(victim, victim_size, "t1", "b1")
+      else:
+        victim, victim_size = next(iter(self.lists["t2"].items()))
+        self.move(victim, victim_size, "t2", "b2")
+    for ghost in ["b1", "b2"]:
+      while self.sizes[ghost] > self.budget:
+        victim, victim_size = next(iter(self.lists[ghost].items()))
+        self.move(victim, victim_size, ghost, None)
+    self.bytes = self.sizes["t1"]+self.sizes["t2"]
+    return False
+
+# greedy dual size frequency: entries which are small, often used and slow to fetch are kept,
+# cost is the latency of fetching the entry
+class SizeAwarePolicy(CachePolicy):
+  def __init__(self, budget):
+    super().__init__(budget)
+    self.entries = {} # key -> [priority, count, size, cost]
+    self.heap = [] # (priority, sequence, key), outdated items are skipped
+    self.sequence = itertools.count()
+    self.inflation = 0
+
+  def update(self, key, entry):
+    entry[0] = self.inflation + entry[1]*max(entry[3], 1e-6)/max(entry[2], 1)
+    heapq.heappush(self.heap, (entry[0], next(self.sequence), key))
+    self.compact()
+
+  # like LFUPolicy.compact, outdated items are dropped once they outnumber the entries
+  def compact(self):
+    if len(self.heap) > 2*len(self.entries):
+      self.heap = [item for item in self.heap if item[2] in self.entries and self.entries[item[2]][0] == item[0]]
+      heapq.heapify(self.heap)
+
+  def access(self, key, size, cost):
+    entry = self.entries.get(key)
+    if entry is not None:
+      entry[1] += 1
+      self.update(key, entry)
+      return True
+    if size > self.budget:
+      return False
+    entry = [0, 1, size, cost]
+    self.entries[key] = entry
+    self.update(key, entry)
+    self.bytes += size
+    while self.bytes > self.budget:
+      priority, sequence, victim = heapq.heappop(self.heap)
+      victim_entry = self.entries.get(victim)
+      if victim_entry is not None and victim_entry[0] == priority:
+        self.inflation = priority
+        self.bytes -= self.entries.pop(victim)[2]
+    return False
+
+policies = {"lru": LRUPolicy, "lfu": LFUPolicy, "arc": ARCPolicy, "size": SizeAwarePolicy}
+
+def mean(values, default=0):
+  return sum(values)/len(values) if len(values) > 0 else default
+
+# replays the records of cached requests against policy, optionally only those of some stores
+# misses cost the latency recorded for the request, or the mean latency of its request type if
+# the store answered it while tracing, hits cost the mean latency of store replies
+def simulate(records, policy, stores=None):
+  records = [record for record in records if record["store"] is not None and (stores is None or record["store"] in stores)]
+  fetched = {}
+  for record in records:
+    if record["source"] != "store":
+      fetched.setdefault(record["request"], []).append(record["latency"])
+  fetch_latency = {request: mean(latencies) for request, latencies in fetched.items()}
+  default_fetch_latency = mean([latency for latencies in fetched.values() for latency in latencies])
+  hit_latency = mean([record["latency"] for record in records if record["source"] == "store"])
+
+  hits = 0
+  bytes_fetched = 0
+  total_latency = 0
+  for record in records:
+    if record["source"] != "store":
+      cost = record["latency"]
+    else:
+      cost = fetch_latency.get(record["request"], default_fetch_latency)
+    if policy.access((record["store"], record["key"]), record["size"], cost):
+      hits += 1
+      total_latency += hit_latency
+    else:
+      bytes_fetched += record["size"]
+      total_latency += cost
+  return {
+    "requests": len(records),
+    "hits": hits,
+    "hit_ratio": hits/len(records) if len(records) > 0 else 0,
+    "bytes_fetched": bytes_fetched,
+    "expected_latency": total_latency/len(records) if len(records) > 0 else 0
+  }
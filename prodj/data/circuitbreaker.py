@@ -0,0 +1,43 @@
+import logging
+import time
+
+# tracks failures per (player_number, slot, source) key
+# after failure_threshold consecutive failures the circuit opens and the source is skipped,
+# every probe_interval seconds a single request is let through to probe whether it recovered
+class CircuitBreaker:
+  def __init__(self, failure_threshold=3, probe_interval=30):
+    self.failure_threshold = failure_threshold
+    self.probe_interval = probe_interval
+    self.failures = {} # key -> number of consecutive failures
+    self.opened_at = {} # key -> time of opening or last probe
+
+  def allow(self, key):
+    if key not in self.opened_at:
+      return True
+    if time.time()-self.opened_at[key] >= self.probe_interval:
+      logging.debug("circuit %s half open, probing", str(key))
+      self.opened_at[key] = time.time()
+      return True
+    return False
+
+  def is_open(self, key):
+    return key in self.opened_at
+
+  def record_success(self, key):
+    if key in self.opened_at:
+      logging.info("circuit %s closed again", str(key))
+    self.failures.pop(key, None)
+    self.opened_at.pop(key, None)
+
+  def record_failure(self, key):
+    self.failures[key] = self.failures.get(key, 0)+1
+    if self.failures[key] >= self.failure_threshold:
+      if key not in self.opened_at:
+        logging.warning("circuit %s opened after %d failures", str(key), self.failures[key])
+      self.opened_at[key] = time.time()
+
+  def reset(self, player_number, slot):
+    for key in list(self.failures):
+      if key[0] == player_number and key[1] == slot:
+        self.failures.pop(key, None)
+        self.opened_at.pop(key, None)
@@ -1,11 +1,39 @@
+import asyncio
+import hashlib
+import itertools
 import logging
 import time
-from threading import Thread
-from queue import Empty, Queue
+from concurrent.futures import FIRST_COMPLETED, CancelledError, Future, InvalidStateError, ThreadPoolExecutor, wait
+from threading import Lock, Thread
+from queue import Empty
 
+from . import cachepeer, remote
+from .circuitbreaker import CircuitBreaker
 from .datastore import DataStore
 from .dbclient import DBClient
+from .governor import MemoryGovernor
+from .metrics import LatencyTracker, Metrics, MetricsServer
 from .pdbprovider import PDBProvider
+from .prefetcher import Prefetcher
+from .requestqueue import RequestQueue
+from .trace import RequestTracer
+from prodj.network.pacer import BACKGROUND, REALTIME, Pacer
+
+# request priorities, lower values are handled first
+PRIORITY_DEFAULT = 10
+PRIORITY_PRELOAD = 15
+PRIORITY_PREFETCH = 20
+
+# parts of a track bundle in the order they are delivered, see get_track_bundle
+track_bundle_parts = ["metadata", "beatgrid", "preview_waveform", "waveform", "artwork"]
+
+# requests answered by both pdb and dbc, only these are hedged in adaptive mode
+hedged_requests = ["metadata", "root_menu", "title", "title_by_album", "title_by_artist_album",
+  "title_by_genre_artist_album", "artist", "artist_by_genre", "album", "album_by_artist",
+  "album_by_genre_artist", "genre", "playlist_folder", "playlist", "artwork", "waveform",
+  "preview_waveform", "color_waveform", "color_preview_waveform", "beatgrid", "mount_info"]
+# requests the dbserver can answer, others like preload or track_playlists are pdb only
+dbc_requests = hedged_requests + ["track_info"]
 
 class TemporaryQueryError(Exception):
   pass
@@ -13,32 +41,166 @@ class TemporaryQueryError(Exception):
 class FatalQueryError(Exception):
   pass
 
+class CancelledQueryError(Exception):
+  pass
+
+# the requested data does not exist on the media, these errors are cached for negative_cache_ttl
+class NotFoundQueryError(FatalQueryError):
+  pass
+
+# handed to requests as cancel_token option, usually shared by all requests for the track loaded on a deck
+# cancelled requests are dropped from the queue and running nfs downloads stop issuing reads
+# a token with a parent is also cancelled when its parent is cancelled
+class CancelToken:
+  def __init__(self, parent=None):
+    self.parent = parent
+    self.is_cancelled = False
+
+  def cancel(self):
+    self.is_cancelled = True
+
+  def cancelled(self):
+    return self.is_cancelled or (self.parent is not None and self.parent.cancelled())
+
+# consumers may cancel a future at any time, even while its request is answered
+# replies and errors of cancelled futures are dropped
+def resolve_future(future, reply):
+  try:
+    future.set_result(reply)
+  except InvalidStateError:
+    pass
+
+def fail_future(future, error):
+  try:
+    future.set_exception(error)
+  except InvalidStateError:
+    pass
+
+# unlike Future.cancel() this also wakes up threads waiting for the future
+def cancel_future(future):
+  if future.cancel():
+    try:
+      future.set_running_or_notify_cancel()
+    except RuntimeError: # waiters have already been notified
+      pass
+
+# normalizes request params to a hashable (player_number, slot, request, sort_mode, ids) key
+def request_key(request, params):
+  sort_mode = None
+  ids = []
+  for param in params[2:]:
+    if isinstance(param, str):
+      sort_mode = param
+    elif isinstance(param, list):
+      ids += param
+    else:
+      ids += [param]
+  return (*params[:2], request, sort_mode, tuple(ids))
+
+# waits for all futures returned by the DataProvider.get_* calls and returns their replies in order
+# if return_exceptions is true, failed requests return their exception instead of raising it
+def gather(futures, timeout=None, return_exceptions=False):
+  futures = list(futures)
+  done, not_done = wait([future for future in futures if not future.cancelled()], timeout=timeout)
+  if not_done:
+    raise TimeoutError("{} of {} requests not finished after {} seconds".format(len(not_done), len(futures), timeout))
+  results = []
+  for future in futures:
+    if future.cancelled() and return_exceptions:
+      results += [CancelledError()]
+    elif return_exceptions and future.exception() is not None:
+      results += [future.exception()]
+    else:
+      results += [future.result()]
+  return results
+
+# asyncio variant of gather, to be awaited from inside an event loop
+async def gather_async(futures, return_exceptions=False):
+  return await asyncio.gather(*[asyncio.wrap_future(f) for f in futures], return_exceptions=return_exceptions)
+
 class DataProvider(Thread):
   def __init__(self, prodj):
     super().__init__()
     self.prodj = prodj
-    self.queue = Queue()
+    self.queue = RequestQueue(max_size=200) # sheds low priority and expired requests when full
+    self.queue_sequence = itertools.count() # keeps requests of equal priority in order
     self.keep_running = True
+    self.metrics = Metrics()
+    self.metrics_server = None
+    self.remote_server = None
+    self.cache_peer = None
+    self.tracer = None # set by start_trace
+    # reply callbacks run on a single separate thread, in order of the replies,
+    # so slow consumers do not hold up request processing
+    self.callback_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="DataProviderCallback")
+    self.slow_callback_warning = 0.1 # seconds
 
     self.pdb_enabled = True
     self.pdb = PDBProvider(prodj)
+    # stores are keyed by media identity instead of player number and slot where it is known,
+    # so all players holding the same media share their entries
+    self.media = self.pdb.media
 
     self.dbc_enabled = True
     self.dbc = DBClient(prodj)
+    self.dbc.metrics = self.metrics
+
+    # limits dbserver queries and nfs reads per player, requests of lower priority than
+    # PRIORITY_DEFAULT (preloading, prefetching) use the smaller background budget while no realtime request waits
+    self.pacer = Pacer()
+    self.pacer.metrics = self.metrics
+    self.pacer.realtime_waiting = self._realtime_waiting
+    self.dbc.pacer = self.pacer
+
+    # adaptive mode queries the source expected to be faster first and sends a hedged request
+    # to the other source if no reply arrived within the usual (90th percentile) latency
+    self.adaptive = False
+    self.hedge_delay = 0.5 # seconds, used until enough latency samples are available
+    self.source_latency = LatencyTracker() # (player_number, request, source) -> durations
+    self.source_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="DataProviderSource")
+    self.source_locks = {"pdb": Lock(), "dbc": Lock()} # a losing request may still be running
+
+    # sources failing repeatedly for a media are skipped until a periodic probe succeeds
+    self.breaker = CircuitBreaker() # keys are (player_number, slot, source)
 
     # db queries seem to work if we submit player number 0 everywhere (NOTE: this seems to work only if less than 4 players are on the network)
     # however, this messes up rendering on the players sometimes (i.e. when querying metadata and player has browser opened)
     # alternatively, we can use a player number from 1 to 4 without rendering issues, but then only max. 3 real players can be used
     self.own_player_number = 0
     self.request_retry_count = 3
-
-    self.metadata_store = DataStore() # map of player_number,slot,track_id: metadata
-    self.artwork_store = DataStore() # map of player_number,slot,artwork_id: artwork_data
-    self.waveform_store = DataStore() # map of player_number,slot,track_id: waveform_data
-    self.preview_waveform_store = DataStore() # map of player_number,slot,track_id: preview_waveform_data
-    self.color_waveform_store = DataStore() # map of player_number,slot,track_id: color_waveform_data
-    self.color_preview_waveform_store = DataStore() # map of player_number,slot,track_id: color_preview_waveform_data
-    self.beatgrid_store = DataStore() # map of player_number,slot,track_id: beatgrid_data
+    # seconds after enqueueing (including retries) after which a request is dropped unexecuted
+    self.request_deadlines = {PRIORITY_DEFAULT: 30, PRIORITY_PRELOAD: 300, PRIORITY_PREFETCH: 20}
+
+    # stores are limited by entries and estimated bytes, whichever is reached first
+    MiB = 1024*1024
+    self.metadata_store = DataStore(size_limit=200, byte_limit=2*MiB) # map of player_number,slot,track_id: metadata
+    self.artwork_store = DataStore(size_limit=50, byte_limit=8*MiB) # map of player_number,slot,artwork_id: artwork_data
+    self.waveform_store = DataStore(size_limit=30, byte_limit=16*MiB) # map of player_number,slot,track_id: waveform_data
+    self.preview_waveform_store = DataStore(size_limit=50, byte_limit=4*MiB) # map of player_number,slot,track_id: preview_waveform_data
+    self.color_waveform_store = DataStore(size_limit=15, byte_limit=32*MiB) # map of player_number,slot,track_id: color_waveform_data
+    self.color_preview_waveform_store = DataStore(size_limit=30, byte_limit=8*MiB) # map of player_number,slot,track_id: color_preview_waveform_data
+    self.beatgrid_store = DataStore(size_limit=50, byte_limit=8*MiB) # map of player_number,slot,track_id: beatgrid_data
+    self.list_store = DataStore(size_limit=30, byte_limit=16*MiB) # map of player_number,slot,request,sort_mode,ids: list, menu and track_info replies
+    self.artwork_content = DataStore(size_limit=50) # map of content hash: artwork_store key, identical artwork is kept once
+    self.negative_cache_ttl = 60 # seconds
+    self.negative_cache = DataStore(size_limit=200, max_age=self.negative_cache_ttl) # map of request_key: (expiry time, NotFoundQueryError)
+
+    # bounds the total size of the stores and the parsed databases, data of tracks loaded on
+    # any deck is pinned, weights reflect how expensive an entry is to get again
+    self.governor = MemoryGovernor()
+    self.governor.metrics = self.metrics
+    self.loaded_tracks = {} # deck player_number -> (player_number, slot, track_id) of the loaded track
+    self.loaded_anlz_keys = {} # deck player_number -> usbanlz key of the loaded track
+    for name, store, weight in [
+        ("metadata", self.metadata_store, 2), ("artwork", self.artwork_store, 1),
+        ("waveform", self.waveform_store, 1), ("preview_waveform", self.preview_waveform_store, 1),
+        ("color_waveform", self.color_waveform_store, 1), ("color_preview_waveform", self.color_preview_waveform_store, 1),
+        ("beatgrid", self.beatgrid_store, 4), ("list", self.list_store, 1),
+        ("pdb", self.pdb.dbs, 8), ("usbanlz", self.pdb.usbanlz, 2)]:
+      self.governor.register(name, store, weight)
+      store.pinned = self.pinned_keys
+
+    self.prefetcher = Prefetcher(self)
 
   def start(self):
     self.keep_running = True
@@ -46,6 +208,10 @@ class DataProvider(Thread):
 
   def stop(self):
     self.keep_running = False
+    self.stop_metrics_server()
+    self.stop_remote_server()
+    self.stop_cache_peer()
+    self.stop_trace()
     self.pdb.stop()
     self.metadata_store.stop()
     self.artwork_store.stop()
@@ -54,9 +220,17 @@ class DataProvider(Thread):
     self.color_waveform_store.stop()
     self.color_preview_waveform_store.stop()
     self.beatgrid_store.stop()
+    self.list_store.stop()
+    self.artwork_content.stop()
+    self.negative_cache.stop()
     self.join()
+    self.callback_executor.shutdown()
+    self.source_executor.shutdown()
 
+  # entries keyed by media identity stay valid for the media and are only evicted by the store limits
+  # except for lists and the database, which are reloaded as rekordbox may have exported to the media since
   def cleanup_stores_from_changed_media(self, player_number, slot):
+    media = self.media.remove(player_number, slot)
     self.metadata_store.removeByPlayerSlot(player_number, slot)
     self.artwork_store.removeByPlayerSlot(player_number, slot)
     self.waveform_store.removeByPlayerSlot(player_number, slot)
@@ -64,134 +238,439 @@ class DataProvider(Thread):
     self.color_waveform_store.removeByPlayerSlot(player_number, slot)
     self.color_preview_waveform_store.removeByPlayerSlot(player_number, slot)
     self.beatgrid_store.removeByPlayerSlot(player_number, slot)
-    self.pdb.cleanup_stores_from_changed_media(player_number, slot)
+    self.list_store.removeByPlayerSlot(player_number, slot)
+    if media is not None:
+      self.list_store.removeByMedia(media)
+    self.negative_cache.removeByPlayerSlot(player_number, slot)
+    self.breaker.reset(player_number, slot)
+    self.pdb.cleanup_stores_from_changed_media(player_number, slot, media)
+    self.prefetcher.cleanup_hints_from_changed_media(player_number, slot)
 
   # called from outside, enqueues request
-  def get_metadata(self, player_number, slot, track_id, callback=None):
-    self._enqueue_request("metadata", self.metadata_store, (player_number, slot, track_id), callback)
+  # every get_* call returns a concurrent.futures.Future resolving to the reply
+  # options: priority (one of the PRIORITY_* values), cancel_token (a CancelToken),
+  # deadline (seconds until the request is dropped, defaults to request_deadlines[priority])
+  def get_metadata(self, player_number, slot, track_id, callback=None, **options):
+    return self._enqueue_request("metadata", self.metadata_store, (player_number, slot, track_id), callback, **options)
 
-  def get_root_menu(self, player_number, slot, callback=None):
-    self._enqueue_request("root_menu", None, (player_number, slot), callback)
+  def get_root_menu(self, player_number, slot, callback=None, **options):
+    return self._enqueue_request("root_menu", self.list_store, (player_number, slot), callback, **options)
 
-  def get_titles(self, player_number, slot, sort_mode="default", callback=None):
-    self._enqueue_request("title", None, (player_number, slot, sort_mode), callback)
+  def get_titles(self, player_number, slot, sort_mode="default", callback=None, **options):
+    return self._enqueue_request("title", self.list_store, (player_number, slot, sort_mode), callback, **options)
 
-  def get_titles_by_album(self, player_number, slot, album_id, sort_mode="default", callback=None):
-    self._enqueue_request("title_by_album", None, (player_number, slot, sort_mode, [album_id]), callback)
+  def get_titles_by_album(self, player_number, slot, album_id, sort_mode="default", callback=None, **options):
+    return self._enqueue_request("title_by_album", self.list_store, (player_number, slot, sort_mode, [album_id]), callback, **options)
 
-  def get_titles_by_artist_album(self, player_number, slot, artist_id, album_id, sort_mode="default", callback=None):
-    self._enqueue_request("title_by_artist_album", None, (player_number, slot, sort_mode, [artist_id, album_id]), callback)
+  def get_titles_by_artist_album(self, player_number, slot, artist_id, album_id, sort_mode="default", callback=None, **options):
+    return self._enqueue_request("title_by_artist_album", self.list_store, (player_number, slot, sort_mode, [artist_id, album_id]), callback, **options)
 
-  def get_titles_by_genre_artist_album(self, player_number, slot, genre_id, artist_id, album_id, sort_mode="default", callback=None):
-    self._enqueue_request("title_by_genre_artist_album", None, (player_number, slot, sort_mode, [genre_id, artist_id, album_id]), callback)
+  def get_titles_by_genre_artist_album(self, player_number, slot, genre_id, artist_id, album_id, sort_mode="default", callback=None, **options):
+    return self._enqueue_request("title_by_genre_artist_album", self.list_store, (player_number, slot, sort_mode, [genre_id, artist_id, album_id]), callback, **options)
 
-  def get_artists(self, player_number, slot, callback=None):
-    self._enqueue_request("artist", None, (player_number, slot), callback)
+  def get_artists(self, player_number, slot, callback=None, **options):
+    return self._enqueue_request("artist", self.list_store, (player_number, slot), callback, **options)
 
-  def get_artists_by_genre(self, player_number, slot, genre_id, callback=None):
-    self._enqueue_request("artist_by_genre", None, (player_number, slot, [genre_id]), callback)
+  def get_artists_by_genre(self, player_number, slot, genre_id, callback=None, **options):
+    return self._enqueue_request("artist_by_genre", self.list_store, (player_number, slot, [genre_id]), callback, **options)
 
-  def get_albums(self, player_number, slot, callback=None):
-    self._enqueue_request("album", None, (player_number, slot), callback)
+  def get_albums(self, player_number, slot, callback=None, **options):
+    return self._enqueue_request("album", self.list_store, (player_number, slot), callback, **options)
 
-  def get_albums_by_artist(self, player_number, slot, artist_id, callback=None):
-    self._enqueue_request("album_by_artist", None, (player_number, slot, [artist_id]), callback)
+  def get_albums_by_artist(self, player_number, slot, artist_id, callback=None, **options):
+    return self._enqueue_request("album_by_artist", self.list_store, (player_number, slot, [artist_id]), callback, **options)
 
-  def get_albums_by_genre_artist(self, player_number, slot, genre_id, artist_id, callback=None):
-    self._enqueue_request("album_by_genre_artist", None, (player_number, slot, [genre_id, artist_id]), callback)
+  def get_albums_by_genre_artist(self, player_number, slot, genre_id, artist_id, callback=None, **options):
+    return self._enqueue_request("album_by_genre_artist", self.list_store, (player_number, slot, [genre_id, artist_id]), callback, **options)
 
-  def get_genres(self, player_number, slot, callback=None):
-    self._enqueue_request("genre", None, (player_number, slot), callback)
+  def get_genres(self, player_number, slot, callback=None, **options):
+    return self._enqueue_request("genre", self.list_store, (player_number, slot), callback, **options)
 
-  def get_playlist_folder(self, player_number, slot, folder_id=0, callback=None):
-    self._enqueue_request("playlist_folder", None, (player_number, slot, folder_id), callback)
+  def get_playlist_folder(self, player_number, slot, folder_id=0, callback=None, **options):
+    return self._enqueue_request("playlist_folder", self.list_store, (player_number, slot, folder_id), callback, **options)
 
-  def get_playlist(self, player_number, slot, playlist_id, sort_mode="default", callback=None):
-    self._enqueue_request("playlist", None, (player_number, slot, sort_mode, playlist_id), callback)
+  def get_playlist(self, player_number, slot, playlist_id, sort_mode="default", callback=None, **options):
+    return self._enqueue_request("playlist", self.list_store, (player_number, slot, sort_mode, playlist_id), callback, **options)
 
-  def get_artwork(self, player_number, slot, artwork_id, callback=None):
-    self._enqueue_request("artwork", self.artwork_store, (player_number, slot, artwork_id), callback)
+  def get_artwork(self, player_number, slot, artwork_id, callback=None, **options):
+    return self._enqueue_request("artwork", self.artwork_store, (player_number, slot, artwork_id), callback, **options)
 
-  def get_waveform(self, player_number, slot, track_id, callback=None):
-    self._enqueue_request("waveform", self.waveform_store, (player_number, slot, track_id), callback)
+  def get_waveform(self, player_number, slot, track_id, callback=None, **options):
+    return self._enqueue_request("waveform", self.waveform_store, (player_number, slot, track_id), callback, **options)
 
-  def get_preview_waveform(self, player_number, slot, track_id, callback=None):
-    self._enqueue_request("preview_waveform", self.preview_waveform_store, (player_number, slot, track_id), callback)
+  def get_preview_waveform(self, player_number, slot, track_id, callback=None, **options):
+    return self._enqueue_request("preview_waveform", self.preview_waveform_store, (player_number, slot, track_id), callback, **options)
 
-  def get_color_waveform(self, player_number, slot, track_id, callback=None):
-    self._enqueue_request("color_waveform", self.color_waveform_store, (player_number, slot, track_id), callback)
+  def get_color_waveform(self, player_number, slot, track_id, callback=None, **options):
+    return self._enqueue_request("color_waveform", self.color_waveform_store, (player_number, slot, track_id), callback, **options)
 
-  def get_color_preview_waveform(self, player_number, slot, track_id, callback=None):
-    self._enqueue_request("color_preview_waveform", self.color_preview_waveform_store, (player_number, slot, track_id), callback)
+  def get_color_preview_waveform(self, player_number, slot, track_id, callback=None, **options):
+    return self._enqueue_request("color_preview_waveform", self.color_preview_waveform_store, (player_number, slot, track_id), callback, **options)
 
-  def get_beatgrid(self, player_number, slot, track_id, callback=None):
-    self._enqueue_request("beatgrid", self.beatgrid_store, (player_number, slot, track_id), callback)
+  def get_beatgrid(self, player_number, slot, track_id, callback=None, **options):
+    return self._enqueue_request("beatgrid", self.beatgrid_store, (player_number, slot, track_id), callback, **options)
 
-  def get_mount_info(self, player_number, slot, track_id, callback=None):
-    self._enqueue_request("mount_info", None, (player_number, slot, track_id), callback)
+  def get_mount_info(self, player_number, slot, track_id, callback=None, **options):
+    return self._enqueue_request("mount_info", None, (player_number, slot, track_id), callback, **options)
 
-  def get_track_info(self, player_number, slot, track_id, callback=None):
-    self._enqueue_request("track_info", None, (player_number, slot, track_id), callback)
+  def get_track_info(self, player_number, slot, track_id, callback=None, **options):
+    return self._enqueue_request("track_info", self.list_store, (player_number, slot, track_id), callback, **options)
 
-  def _enqueue_request(self, request, store, params, callback):
+  # ids of all playlists containing track_id, only available from pdb
+  def get_track_playlists(self, player_number, slot, track_id, callback=None, **options):
+    return self._enqueue_request("track_playlists", self.list_store, (player_number, slot, track_id), callback, **options)
+
+  # requests everything a deck needs for a track at once, parts is a list of requests from
+  # metadata, beatgrid, (color_)preview_waveform, (color_)waveform and artwork.
+  # callback is called once per part as soon as it is ready, with the same arguments as for the
+  # separate get_* calls. the future resolves to a dict of part -> reply (None if not available).
+  def get_track_bundle(self, player_number, slot, track_id, callback=None, parts=track_bundle_parts, **options):
+    return self._enqueue_request("track_bundle", None, (player_number, slot, track_id, tuple(parts)), callback, **options)
+
+  # download and parse the database of newly mounted media before anyone asks for it
+  def preload_media(self, player_number, slot, callback=None, **options):
+    if not self.pdb_enabled:
+      logging.debug("pdb disabled, not preloading media of player %d %s", player_number, slot)
+      return None
+    options.setdefault("priority", PRIORITY_PRELOAD)
+    return self._enqueue_request("preload", None, (player_number, slot), callback, **options)
+
+  def _enqueue_request(self, request, store, params, callback, priority=PRIORITY_DEFAULT, cancel_token=None, deadline=None):
+    future = Future()
     player_number = params[0]
     if player_number == 0 or player_number > 4:
       logging.warning("invalid %s request parameters", request)
-      return
+      future.set_exception(FatalQueryError("invalid {} request parameters".format(request)))
+      return future
     logging.debug("enqueueing %s request with params %s", request, str(params))
-    self.queue.put((request, store, params, callback, self.request_retry_count))
-
-  def _handle_request_from_store(self, store, params):
-    if len(params) != 3:
-      logging.error("unable to handle request from store with != 3 arguments")
-      return None
-    if params in store:
-      return store[params]
-    return None
-
-  def _handle_request_from_pdb(self, request, params):
-    return self.pdb.handle_request(request, params)
+    if deadline is None:
+      deadline = self.request_deadlines.get(priority, self.request_deadlines[PRIORITY_DEFAULT])
+    self._put_request(priority, time.time()+deadline, (request, store, params, callback, cancel_token, future, self.request_retry_count))
+    return future
+
+  def _put_request(self, priority, deadline, request):
+    for (_, _, _, shed_request), reason in self.queue.put((priority, next(self.queue_sequence), deadline, request)):
+      self._shed_request(shed_request, reason)
+
+  # requests are handled one at a time, so a long background download holds up all requests queued behind it
+  def _realtime_waiting(self):
+    priority = self.queue.min_priority()
+    return priority is not None and priority <= PRIORITY_DEFAULT
+
+  def _shed_request(self, request, reason):
+    logging.warning("dropping %s request %s (%s)", request[0], str(request[2]), reason.replace("_", " "))
+    self.metrics.inc("requests_shed_total", request=request[0], reason=reason)
+    fail_future(request[-2], TemporaryQueryError("{} request dropped: {}".format(request[0], reason.replace("_", " "))))
+
+  # list requests have a variable number of params, their keys include the request type
+  def _store_key(self, request, store, params):
+    return self.media.key(request_key(request, params) if store is self.list_store else params)
+
+  def _store_reply(self, request, store, params, reply):
+    key = self._store_key(request, store, params)
+    if request == "artwork" and isinstance(reply, bytes):
+      digest = hashlib.blake2b(reply, digest_size=16).digest()
+      existing = self.artwork_store.peek(self.artwork_content.peek(digest))
+      if existing == reply:
+        reply = existing
+      self.artwork_content[digest] = key
+    store[key] = reply
+
+  # called by ClientList when the track loaded on deck changed, track_id 0 if it is empty
+  def pin_loaded_track(self, deck, player_number, slot, track_id):
+    self.loaded_anlz_keys.pop(deck, None)
+    if track_id == 0 or slot not in ["usb", "sd"]:
+      self.loaded_tracks.pop(deck, None)
+    else:
+      self.loaded_tracks[deck] = (player_number, slot, track_id)
+
+  # keys of the data of all tracks loaded on any deck, in all stores
+  def pinned_keys(self):
+    keys = set()
+    for deck, (player_number, slot, track_id) in list(self.loaded_tracks.items()):
+      track_key = self.media.key((player_number, slot, track_id))
+      keys.add(track_key)
+      keys.add(self.media.key((player_number, slot)))
+      metadata = self.metadata_store.peek(track_key)
+      if metadata is not None and metadata.get("artwork_id", 0) != 0:
+        keys.add(self.media.key((player_number, slot, metadata["artwork_id"])))
+      if deck not in self.loaded_anlz_keys:
+        db = self.pdb.dbs.peek(self.media.key((player_number, slot)))
+        try:
+          if db is not None:
+            self.loaded_anlz_keys[deck] = self.pdb.anlz_key(player_number, slot, db.get_track(track_id))
+        except KeyError:
+          pass
+      keys.add(self.loaded_anlz_keys.get(deck))
+    return keys
+
+  # estimated memory use of the stores in bytes
+  def memory_usage(self):
+    return {"budget": self.governor.budget, "used": self.governor.used(), "stores": self.governor.usage()}
+
+  # returns the stored reply of request or None, without querying any source
+  def stored_reply(self, request, player_number, slot, item_id):
+    store = getattr(self, request+"_store")
+    return self._handle_request_from_store(store, self._store_key(request, store, (player_number, slot, item_id)))
+
+  # replies are never None, so None means not stored
+  def _handle_request_from_store(self, store, key):
+    return store.get(key)
+
+  def _check_negative_cache(self, request, params):
+    key = request_key(request, params)
+    entry = self.negative_cache.get(key)
+    if entry is None:
+      return
+    expires_at, error = entry
+    if time.time() < expires_at:
+      raise error
+    self.negative_cache.discard(key)
+
+  def _add_to_negative_cache(self, request, params, error):
+    key = request_key(request, params)
+    if key in self.negative_cache:
+      return
+    logging.debug("caching missing %s %s for %ds", request, str(params), self.negative_cache_ttl)
+    self.negative_cache[key] = (time.time()+self.negative_cache_ttl, error)
+
+  def _source_available(self, source, params):
+    if self.breaker.allow((*params[:2], source)):
+      return True
+    logging.debug("skipping %s for player %d %s, circuit open", source, *params[:2])
+    return False
+
+  # missing data does not count as a failure of the source
+  def _call_source(self, source, params, handler, *args):
+    key = (*params[:2], source)
+    try:
+      reply = handler(*args)
+    except NotFoundQueryError:
+      raise
+    except FatalQueryError:
+      self.breaker.record_failure(key)
+      raise
+    self.breaker.record_success(key)
+    return reply
+
+  def _handle_request_from_pdb(self, request, params, cancel_token):
+    with self.source_locks["pdb"]:
+      return self._call_source("pdb", params, self.pdb.handle_request, request, params, cancel_token)
 
   def _handle_request_from_dbclient(self, request, params):
-    return self.dbc.handle_request(request, params)
-
-  def _handle_request(self, request, store, params, callback):
+    with self.source_locks["dbc"]:
+      return self._call_source("dbc", params, self.dbc.handle_request, request, params)
+
+  # runs on the source executor in adaptive mode
+  def _query_source(self, source, request, params, cancel_token):
+    if cancel_token.cancelled():
+      raise CancelledQueryError("cancelled before querying {}".format(source))
+    started_at = time.time()
+    if source == "pdb":
+      reply = self._handle_request_from_pdb(request, params, cancel_token)
+    else:
+      reply = self._handle_request_from_dbclient(request, params)
+    if reply is None:
+      raise NotFoundQueryError("{} returned no reply".format(source))
+    self.source_latency.add((params[0], request, source), time.time()-started_at)
+    return reply
+
+  def _query_source_with_traffic_class(self, traffic_class, *args):
+    with self.pacer.traffic(traffic_class):
+      return self._query_source(*args)
+
+  def _hedging_possible(self, request):
+    return self.adaptive and self.pdb_enabled and self.dbc_enabled and request in hedged_requests
+
+  # the first successful reply wins, the other source is cancelled
+  # cold requests (database not loaded yet) go to dbc first
+  def _handle_request_hedged(self, request, params, cancel_token):
+    player_number, slot = params[:2]
+    sources = ["pdb", "dbc"] if self.pdb.is_loaded(player_number, slot) else ["dbc", "pdb"]
+    sources = [source for source in sources if self._source_available(source, params)]
+    if len(sources) == 0:
+      raise FatalQueryError("no source available for player {} {}".format(player_number, slot))
+    tokens = {source: CancelToken(cancel_token) for source in sources}
+    traffic_class = self.pacer.traffic_class()
+    pending = {} # future -> source
+    errors = []
+    started = []
+    def start(source):
+      started.append(source)
+      pending[self.source_executor.submit(self._query_source_with_traffic_class, traffic_class, source, request, params, tokens[source])] = source
+
+    start(sources[0])
+    delay = self.source_latency.percentile((player_number, request, sources[0]), 0.9)
+    if delay is None:
+      delay = self.hedge_delay
+    done, _ = wait(pending, timeout=delay)
+    if not done and len(sources) > 1:
+      logging.debug("%s did not answer %s request within %.3fs, hedging with %s", sources[0], request, delay, sources[1])
+      self.metrics.inc("hedged_requests_total", request=request)
+      start(sources[1])
+    while pending:
+      done, _ = wait(pending, return_when=FIRST_COMPLETED)
+      for future in done:
+        source = pending.pop(future)
+        try:
+          reply = future.result()
+        except (TemporaryQueryError, FatalQueryError, CancelledQueryError) as e:
+          logging.warning("%s failed [%s]", source, str(e))
+          self.metrics.inc("source_failures_total", request=request, source=source)
+          errors += [e]
+          if len(started) < len(sources) and not (cancel_token is not None and cancel_token.cancelled()):
+            start(sources[len(started)])
+          continue
+        for loser in pending.values():
+          logging.debug("%s answered %s request first, cancelling %s", source, request, loser)
+          tokens[loser].cancel()
+        return reply, source
+    # retrying is worth it if any of the sources failed temporarily
+    raise next((e for e in errors if isinstance(e, TemporaryQueryError)), errors[-1])
+
+  def _request_cancelled(self, cancel_token, future):
+    return future.cancelled() or (cancel_token is not None and cancel_token.cancelled())
+
+  def _handle_request(self, request, store, params, callback, cancel_token, future):
     #logging.debug("handling %s request params %s", request, str(params))
+    if request == "track_bundle":
+      return self._handle_track_bundle(params, callback, cancel_token, future)
+    started_at = time.time()
     reply = None
+    source = None
     answered_by_store = False
     if store is not None:
       logging.debug("trying request %s %s from store", request, str(params))
-      reply = self._handle_request_from_store(store, params)
+      reply = self._handle_request_from_store(store, self._store_key(request, store, params))
       if reply is not None:
         answered_by_store = True
-    if self.pdb_enabled and reply is None:
+        source = "store"
+    if reply is None and store is not None:
+      self._check_negative_cache(request, params)
+    if reply is None and self._hedging_possible(request):
+      reply, source = self._handle_request_hedged(request, params, cancel_token)
+    pdb_error = None
+    if self.pdb_enabled and reply is None and self._source_available("pdb", params):
       try:
         logging.debug("trying request %s %s from pdb", request, str(params))
-        reply = self._handle_request_from_pdb(request, params)
+        reply = self._handle_request_from_pdb(request, params, cancel_token)
+        source = "pdb"
       except FatalQueryError as e: # on a fatal error, continue with dbc
         logging.warning("pdb failed [%s]", str(e))
-        if not self.dbc_enabled:
+        self.metrics.inc("source_failures_total", request=request, source="pdb")
+        if not self.dbc_enabled or request not in dbc_requests:
           raise
-    if self.dbc_enabled and reply is None:
+        pdb_error = e
+    if self.dbc_enabled and reply is None and request in dbc_requests and self._source_available("dbc", params):
+      if self._request_cancelled(cancel_token, future):
+        raise CancelledQueryError("cancelled before querying dbc")
       logging.debug("trying request %s %s from dbc", request, str(params))
       reply = self._handle_request_from_dbclient(request, params)
+      source = "dbc"
 
     if reply is None:
-      raise FatalQueryError("DataStore: request returned none, see log for details")
+      if pdb_error is not None and source is None:
+        raise pdb_error
+      if source is None and (self.pdb_enabled or self.dbc_enabled):
+        raise FatalQueryError("no source available for player {} {}".format(*params[:2]))
+      raise NotFoundQueryError("DataStore: request returned none, see log for details")
+    self.metrics.inc("requests_answered_total", request=request, source=source)
+    self._trace(request, store, params, reply, source, started_at)
 
     # special call for metadata since it is expected to be part of the client status
     if request == "metadata":
       self.prodj.cl.storeMetadataByLoadedTrack(*params, reply)
 
     if store is not None and answered_by_store == False:
-      store[params] = reply
+      self._store_reply(request, store, params, reply)
 
-    # TODO: synchronous mode
+    resolve_future(future, reply)
     if callback is not None:
+      self.callback_executor.submit(self._run_callback, callback, request, params, reply)
+
+  def _handle_track_bundle(self, params, callback, cancel_token, future):
+    player_number, slot, track_id, parts = params
+    replies = {}
+    started_at = time.time()
+    def deliver(request, item_id, reply, source):
+      if reply is None or request in replies:
+        return
+      if request == "metadata":
+        self.prodj.cl.storeMetadataByLoadedTrack(player_number, slot, track_id, reply)
+      if source != "store":
+        self._store_reply(request, getattr(self, request+"_store"), (player_number, slot, item_id), reply)
+      self.metrics.inc("requests_answered_total", request=request, source=source)
+      self._trace(request, getattr(self, request+"_store"), (player_number, slot, item_id), reply, source, started_at)
+      replies[request] = reply
+      if callback is not None:
+        self.callback_executor.submit(self._run_callback, callback, request, (player_number, slot, item_id), reply)
+    def artwork_id():
+      return replies["metadata"].get("artwork_id", 0) if "metadata" in replies else 0
+
+    for part in parts:
+      item_id = artwork_id() if part == "artwork" else track_id
+      if item_id != 0:
+        deliver(part, item_id, self.stored_reply(part, player_number, slot, item_id), "store")
+
+    missing = [part for part in parts if part not in replies]
+    if missing and self.pdb_enabled and self._source_available("pdb", params):
+      try:
+        with self.source_locks["pdb"]:
+          self._call_source("pdb", params, self.pdb.get_track_bundle, player_number, slot, track_id, missing,
+            lambda request, item_id, reply: deliver(request, item_id, reply, "pdb"), cancel_token)
+      except TemporaryQueryError as e: # keep the parts delivered so far, only the missing ones are retried below
+        logging.warning("pdb failed to load track bundle, retrying missing parts [%s]", str(e))
+      except FatalQueryError as e:
+        logging.warning("pdb failed to load track bundle [%s]", str(e))
+        self.metrics.inc("source_failures_total", request="track_bundle", source="pdb")
+
+    # anything still missing is requested separately, parts failing temporarily are queued for retrying
+    retries = {}
+    for part in parts:
+      item_id = artwork_id() if part == "artwork" else track_id
+      if part in replies or item_id == 0:
+        continue
+      if self._request_cancelled(cancel_token, future):
+        raise CancelledQueryError("track bundle cancelled")
+      part_params = (player_number, slot, item_id)
+      part_future = Future()
+      try:
+        self._handle_request(part, getattr(self, part+"_store"), part_params, callback, cancel_token, part_future)
+        replies[part] = part_future.result()
+      except TemporaryQueryError as e:
+        logging.warning("%s part of track bundle failed, retrying: %s", part, e)
+        retries[part] = self._enqueue_request(part, getattr(self, part+"_store"), part_params, callback, cancel_token=cancel_token)
+      except FatalQueryError as e:
+        logging.warning("%s part of track bundle failed: %s", part, e)
+        if isinstance(e, NotFoundQueryError):
+          self._add_to_negative_cache(part, part_params, e)
+
+    lock = Lock()
+    def resolve(_=None):
+      with lock:
+        if future.done() or not all(f.done() for f in retries.values()):
+          return
+        for part, part_future in retries.items():
+          if not part_future.cancelled() and part_future.exception() is None:
+            replies[part] = part_future.result()
+        resolve_future(future, {part: replies.get(part) for part in parts})
+    for part_future in retries.values():
+      part_future.add_done_callback(resolve)
+    resolve()
+
+  def _run_callback(self, callback, request, params, reply):
+    started_at = time.time()
+    try:
       callback(request, *params, reply)
-
-  def _retry_request(self, request):
-    self.queue.task_done()
+    except Exception as e:
+      logging.exception("%s callback failed: %s", request, e)
+    duration = time.time()-started_at
+    self.metrics.observe("callback_duration_seconds", duration, request=request)
+    if duration > self.slow_callback_warning:
+      logging.warning("%s callback %s took %.3fs, blocking later callbacks", request,
+        getattr(callback, "__qualname__", repr(callback)), duration)
+
+  def _retry_request(self, priority, deadline, request, error):
     if request[-1] > 0:
       if request[0] == "color_waveform":
         logging.info("Color waveform request failed, trying normal waveform instead")
@@ -201,29 +680,163 @@ class DataProvider(Thread):
         request = ("preview_waveform", *request[1:])
       else:
         logging.info("retrying %s request", request[0])
-      self.queue.put((*request[:-1], request[-1]-1))
+      self.metrics.inc("request_retries_total", request=request[0])
+      self._put_request(priority, deadline, (*request[:-1], request[-1]-1))
       time.sleep(1) # yes, this is dirty, but effective to work around timing problems on failed request
     else:
       logging.info("%s request failed %d times, giving up", request[0], self.request_retry_count)
+      fail_future(request[-2], error)
 
   def gc(self):
     self.dbc.gc()
 
+  # serves prometheus metrics on http://127.0.0.1:port/metrics
+  def start_metrics_server(self, port, host="127.0.0.1"):
+    self.stop_metrics_server()
+    self.metrics_server = MetricsServer(self.prometheus_metrics, port, host)
+    self.metrics_server.start()
+
+  def stop_metrics_server(self):
+    if self.metrics_server is not None:
+      self.metrics_server.stop()
+      self.metrics_server = None
+
+  # serves the request api to RemoteDataProvider clients on a (host, port) tuple or unix socket path
+  def start_remote_server(self, address):
+    self.stop_remote_server()
+    self.remote_server = remote.DataProviderServer(self, address)
+    self.remote_server.start()
+
+  def stop_remote_server(self):
+    if self.remote_server is not None:
+      self.remote_server.stop()
+      self.remote_server = None
+
+  # appends a record of every answered request to the file at path, see trace.RequestTracer
+  def start_trace(self, path):
+    self.stop_trace()
+    self.tracer = RequestTracer(path)
+
+  def stop_trace(self):
+    if self.tracer is not None:
+      self.tracer.close()
+      self.tracer = None
+
+  def _trace(self, request, store, params, reply, source, started_at):
+    tracer = self.tracer
+    if tracer is None:
+      return
+    store_name = None
+    key = params
+    if store is not None:
+      store_name = "list" if store is self.list_store else request
+      key = self._store_key(request, store, params)
+    tracer.record(request, store_name, key, reply, source, time.time()-started_at)
+
+  # shares the disk cache of pdb with other instances, peers are (host, port) tuples
+  # announced to in addition to the broadcast, port defaults to cachepeer.cache_peer_port
+  def start_cache_peer(self, port=None, peers=None, broadcast=True):
+    self.stop_cache_peer()
+    port = port if port is not None else cachepeer.cache_peer_port
+    self.cache_peer = cachepeer.CachePeer(self.pdb.disk_cache, port, peers, broadcast)
+    self.cache_peer.start()
+    self.pdb.cache_peer = self.cache_peer
+
+  def stop_cache_peer(self):
+    if self.cache_peer is not None:
+      self.pdb.cache_peer = None
+      self.cache_peer.stop()
+      self.cache_peer = None
+
+  def prometheus_metrics(self):
+    self.metrics.set("queue_depth", self.queue.qsize())
+    self.metrics.set("memory_budget_bytes", self.governor.budget)
+    for name, used in self.governor.usage().items():
+      self.metrics.set("memory_bytes", used, store=name)
+    return self.metrics.prometheus()
+
+  # returns a snapshot of the data path metrics
+  def stats(self):
+    self.metrics.set("queue_depth", self.queue.qsize())
+    snapshot = self.metrics.snapshot()
+    stats = {
+      "queue_depth": self.queue.qsize(),
+      "memory": self.memory_usage(),
+      "requests": {},
+      "nfs": {},
+      "dbserver_round_trips": {}
+    }
+    counter_fields = {
+      "request_retries_total": "retries",
+      "requests_failed_total": "fatal",
+      "requests_cancelled_total": "cancelled",
+      "requests_shed_total": "shed" # summed over all reasons
+    }
+    nfs_fields = {
+      "nfs_bytes_total": "bytes",
+      "nfs_download_seconds_total": "seconds",
+      "nfs_downloads_total": "downloads"
+    }
+    request_entry = lambda request: stats["requests"].setdefault(request,
+      {"answered": {}, "retries": 0, "fatal": 0, "cancelled": 0, "shed": 0, "source_failures": {}})
+    for (name, labels), value in snapshot["counters"].items():
+      labels = dict(labels)
+      if name == "requests_answered_total":
+        request_entry(labels["request"])["answered"][labels["source"]] = value
+      elif name == "source_failures_total":
+        request_entry(labels["request"])["source_failures"][labels["source"]] = value
+      elif name in counter_fields:
+        request_entry(labels["request"])[counter_fields[name]] += value
+      elif name in nfs_fields:
+        stats["nfs"].setdefault(labels["player"], {"bytes": 0, "seconds": 0, "downloads": 0})[nfs_fields[name]] = value
+      elif name == "dbserver_round_trips_total":
+        stats["dbserver_round_trips"][labels["player"]] = value
+    for (name, labels), histogram in snapshot["histograms"].items():
+      if name == "request_duration_seconds":
+        request_entry(dict(labels)["request"])["latency"] = histogram
+    for entry in stats["requests"].values():
+      answered = sum(entry["answered"].values())
+      entry["hit_ratio"] = {source: count/answered for source, count in entry["answered"].items()} if answered > 0 else {}
+    for entry in stats["nfs"].values():
+      entry["throughput"] = entry["bytes"]/entry["seconds"] if entry["seconds"] > 0 else 0
+    return stats
+
   def run(self):
     logging.debug("DataProvider starting")
     while self.keep_running:
       try:
-        request = self.queue.get(timeout=1)
+        priority, _, deadline, request = self.queue.get(timeout=1)
       except Empty:
         self.gc()
         continue
+      if time.time() > deadline:
+        self._shed_request(request, "deadline")
+        continue
+      if self._request_cancelled(*request[-3:-1]):
+        logging.debug("dropping cancelled %s request %s", request[0], str(request[2]))
+        self.metrics.inc("requests_cancelled_total", request=request[0])
+        cancel_future(request[-2])
+        continue
+      started_at = time.time()
       try:
-        self._handle_request(*request[:-1])
-        self.queue.task_done()
+        with self.pacer.traffic(REALTIME if priority <= PRIORITY_DEFAULT else BACKGROUND):
+          self._handle_request(*request[:-1])
       except TemporaryQueryError as e:
         logging.warning("%s request failed: %s", request[0], e)
-        self._retry_request(request)
+        self._retry_request(priority, deadline, request, e)
       except FatalQueryError as e:
         logging.error("%s request failed: %s", request[0], e)
-        self.queue.task_done()
+        self.metrics.inc("requests_failed_total", request=request[0])
+        if isinstance(e, NotFoundQueryError) and request[1] is not None:
+          self._add_to_negative_cache(request[0], request[2], e)
+        fail_future(request[-2], e)
+      except CancelledQueryError as e:
+        logging.debug("%s request cancelled: %s", request[0], e)
+        self.metrics.inc("requests_cancelled_total", request=request[0])
+        cancel_future(request[-2])
+      except Exception as e: # a bug in a source must not stop the worker thread
+        logging.exception("%s request failed unexpectedly: %s", request[0], e)
+        self.metrics.inc("requests_failed_total", request=request[0])
+        fail_future(request[-2], FatalQueryError("{} request failed: {}".format(request[0], e)))
+      self.metrics.observe("request_duration_seconds", time.time()-started_at, request=request[0])
     logging.debug("DataProvider shutting down")
@@ -1,58 +1,189 @@
-from threading import Event, Thread
+from collections import OrderedDict
+from collections.abc import Mapping
+from threading import Event, Lock, RLock, Thread
+from weakref import WeakSet
 import logging
+import sys
 import time
 
-# this implements a least recently used cache
-# stores key -> (timestamp, val) and updates timestamp on every access
-class DataStore(Thread, dict):
-  def __init__(self, size_limit=15, gc_interval=30):
-    super().__init__()
-    self.gc_interval = gc_interval
-    self.size_limit = size_limit
-    self.event = Event()
-    self.start()
+# rough estimate of the memory used by value in bytes
+# long sequences are extrapolated from their first sample_size items
+def estimate_size(value, sample_size=64):
+  size = sys.getsizeof(value)
+  if isinstance(value, (str, bytes, bytearray)):
+    return size
+  if isinstance(value, Mapping):
+    return size + sum(estimate_size(v, sample_size) for k, v in value.items() if not (isinstance(k, str) and k.startswith("_")))
+  if isinstance(value, (list, tuple)):
+    if len(value) == 0:
+      return size
+    sample = value[:sample_size]
+    return size + sum(estimate_size(v, sample_size) for v in sample)*len(value)//len(sample)
+  return size
+
+# calls gc() of all registered stores every interval seconds
+# the thread runs as long as at least one store is registered
+class DataStoreJanitor:
+  def __init__(self, interval=30):
+    self.interval = interval
+    self.stores = WeakSet()
+    self.lock = Lock()
+    self.event = None
+
+  def register(self, store):
+    with self.lock:
+      self.stores.add(store)
+      if self.event is None:
+        self.event = Event()
+        Thread(target=self.run, args=(self.event,), name="DataStoreJanitor", daemon=True).start()
 
-  # make this class hashable
-  def __eq__(self, other):
-    return self is other
+  def unregister(self, store):
+    with self.lock:
+      self.stores.discard(store)
+      if len(self.stores) == 0 and self.event is not None:
+        self.event.set()
+        self.event = None
 
-  def __hash__(self):
-    return hash(id(self))
+  def run(self, event):
+    logging.debug("datastore janitor started")
+    while not event.wait(self.interval):
+      with self.lock:
+        stores = list(self.stores)
+      for store in stores:
+        store.gc()
+    logging.debug("datastore janitor stopped")
+
+janitor = DataStoreJanitor()
+
+# this implements a thread safe least recently used cache
+# the least recently used entries are evicted as soon as the store holds more than size_limit
+# entries or their estimated size exceeds byte_limit, entries older than max_age seconds are
+# removed by the shared janitor
+# keys returned by pinned() are never evicted, a MemoryGovernor may additionally evict entries
+# to keep the total size of all its stores within a budget
+class DataStore:
+  def __init__(self, size_limit=15, byte_limit=None, max_age=None, sizeof=estimate_size):
+    self.size_limit = size_limit
+    self.byte_limit = byte_limit
+    self.max_age = max_age
+    self.sizeof = sizeof
+    self.pinned = None # returns a collection of keys which must not be evicted
+    self.governor = None # set by MemoryGovernor.register
+    self.entries = OrderedDict() # key -> [size, insertion time, access time, val], most recently used last
+    self.bytes = 0
+    self.lock = RLock()
+    janitor.register(self)
 
   def __getitem__(self, key):
-    val = dict.__getitem__(self, key)[1]
-    #logging.debug("get %s = %s, update timestamp", str(key), str(val))
-    self.__setitem__(key, val) # update timestamp
-    return val
+    with self.lock:
+      entry = self.entries[key]
+      entry[2] = time.time()
+      self.entries.move_to_end(key)
+      return entry[3]
 
   def __setitem__(self, key, val):
-    #logging.debug("set %s = %s", str(key), str(val))
-    dict.__setitem__(self, key, (time.time(), val))
+    size = self.sizeof(val) if self.byte_limit is not None or self.governor is not None else 0
+    with self.lock:
+      if key in self.entries:
+        self.bytes -= self.entries[key][0]
+      now = time.time()
+      self.entries[key] = [size, now, now, val]
+      self.entries.move_to_end(key)
+      self.bytes += size
+      self.evict()
+    if self.governor is not None:
+      self.governor.enforce()
+
+  # estimates the size of the entries holding val again, for values which grow after being stored
+  def update_size(self, val):
+    if self.byte_limit is None and self.governor is None:
+      return
+    size = self.sizeof(val)
+    with self.lock:
+      for entry in self.entries.values():
+        if entry[3] is val:
+          self.bytes += size-entry[0]
+          entry[0] = size
+      self.evict()
+    if self.governor is not None:
+      self.governor.enforce()
 
-  def start(self):
-    self.event.clear()
-    super().start()
+  def __delitem__(self, key):
+    with self.lock:
+      self.bytes -= self.entries.pop(key)[0]
 
-  def stop(self):
-    self.event.set()
+  def __contains__(self, key):
+    with self.lock:
+      return key in self.entries
 
-  def run(self):
-    logging.debug("%s initialized", hex(id(self)))
-    while not self.event.wait(self.gc_interval):
-      self.gc()
-    logging.debug("%s stopped", hex(id(self)))
+  def __len__(self):
+    return len(self.entries)
+
+  def __iter__(self):
+    with self.lock:
+      return iter(list(self.entries))
+
+  # a single lookup, unlike checking "key in store" first it can not race with evictions
+  def get(self, key, default=None):
+    try:
+      return self[key]
+    except KeyError:
+      return default
+
+  # returns the value of key without updating its access time, does not block
+  def peek(self, key, default=None):
+    entry = self.entries.get(key)
+    return entry[3] if entry is not None else default
+
+  def discard(self, key):
+    with self.lock:
+      if key in self.entries:
+        del self[key]
+
+  # returns (key, size, access time) of the least recently used entry which is not pinned, or None
+  def eviction_candidate(self, pinned=None):
+    if pinned is None:
+      pinned = self.pinned() if self.pinned is not None else ()
+    with self.lock:
+      key = next((key for key in self.entries if key not in pinned), None)
+      if key is None:
+        return None
+      return key, self.entries[key][0], self.entries[key][2]
+
+  def evict(self):
+    with self.lock:
+      pinned = None
+      while len(self.entries) > self.size_limit or (self.byte_limit is not None and self.bytes > self.byte_limit and len(self.entries) > 1):
+        if pinned is None:
+          pinned = self.pinned() if self.pinned is not None else ()
+        candidate = self.eviction_candidate(pinned)
+        if candidate is None:
+          break
+        logging.debug("delete %s due to store limits", str(candidate[0]))
+        del self[candidate[0]]
+
+  def stop(self):
+    janitor.unregister(self)
 
   def gc(self):
-    if len(self) <= self.size_limit:
+    if self.max_age is None:
       return
-    logging.debug("garbage collection (max %d, cur %d)", self.size_limit, len(self))
-    oldest_items = sorted(self.items(), key=lambda x: x[1][0])
-    for delete_item in oldest_items[0:len(self)-self.size_limit]:
-      logging.debug("delete %s due to age", str(delete_item[0]))
-      del self[delete_item[0]]
+    expired_before = time.time()-self.max_age
+    with self.lock:
+      for key in [key for key, entry in self.entries.items() if entry[1] < expired_before]:
+        logging.debug("delete %s due to max age", str(key))
+        del self[key]
+
+  def removeByMedia(self, media):
+    with self.lock:
+      for keys in list(self.entries):
+        if keys[0] == media:
+          logging.debug("delete %s due to media change", str(keys))
+          del self[keys]
 
   def removeByPlayerSlot(self, player_number, slot):
-    for keys in list(self):
-      if keys[0] == player_number and keys[1] == slot:
-        logging.debug("delete %s due to media change on player %d slot %s", str(keys), player_number, slot)
-        del self[keys]
+    with self.lock:
+      for keys in list(self.entries):
+        if keys[0] == player_number and keys[1] == slot:
+          logging.debug("delete %s due to media change on player %d slot %s", str(keys), player_number, slot)
+          del self[keys]
@@ -1,10 +1,12 @@
 import socket
 import logging
+import time
 from select import select
 from construct import MappingError, StreamError, RangeError, byte2int
 
 from prodj.network import packets
 from prodj.data import dataprovider
+from prodj.data.records import ListEntry, Metadata, MountInfo
 from prodj.pdblib.usbanlz import AnlzTag
 
 metadata_type = {
@@ -116,10 +118,11 @@ class DBClient:
     self.own_player_number = 0
     self.parse_error_count = 40
     self.receive_timeout_count = 3
+    self.metrics = None # set by DataProvider
+    self.pacer = None # set by DataProvider
 
-  def parse_metadata_payload(self, payload):
-    entry = {}
-
+  # writes the fields of a menu item into entry (a Record), returns None if the item type is not handled
+  def parse_metadata_payload(self, payload, entry):
     # we may test payload[n]["type"] here to verify the argument types, but it
     # seems constant on every db query, so let's just assume this fixed mapping
     entry_id1 = payload[0]["value"]
@@ -172,13 +175,11 @@ class DBClient:
       if entry_type2 is None:
         logging.warning("second column %s of %s not parseable", entry_label2, entry_type)
       else:
-        entry2 = self.parse_metadata_payload([
+        self.parse_metadata_payload([
           {"value": entry_id1}, {"value": entry_id1}, None, # duplicate entry1, as entry2 unused and swapped
           {"value": entry_string2}, None,
           {"value": ""}, {"value": entry_type2}, None,
-          {"value": entry_id3}])
-        if entry2 is not None:
-          entry = {**entry, **entry2}
+          {"value": entry_id3}], entry)
     else:
       logging.warning("unhandled metadata type %s", entry_label)
       return None
@@ -201,8 +202,8 @@ class DBClient:
         continue
 
       # extract metadata from packet
-      entry = self.parse_metadata_payload(packet["args"])
-      if entry is None:
+      entry = ListEntry()
+      if self.parse_metadata_payload(packet["args"], entry) is None:
         continue
       entries += [entry]
 
@@ -210,8 +211,8 @@ class DBClient:
       logging.warning("list entries not ending with menu_footer")
     return entries
 
-  def parse_metadata(self, data):
-    md = {}
+  def parse_metadata(self, data, record_type=Metadata):
+    md = record_type()
     for packet in data:
       # check packet types
       if packet["type"] == "menu_header":
@@ -225,15 +226,25 @@ class DBClient:
         continue
 
       # extract metadata from packet
-      entry = self.parse_metadata_payload(packet["args"])
-      if entry is None:
-        continue
-      md = {**md, **entry}
+      self.parse_metadata_payload(packet["args"], md)
 
     if data[-1]["type"] != "menu_footer":
       logging.warning("metadata packet not ending with menu_footer, buffer too small?")
     return md
 
+  def count_round_trip(self, player_number):
+    if self.metrics is not None:
+      self.metrics.inc("dbserver_round_trips_total", player=player_number)
+
+  # waits until the pacer allows another query to the player
+  def pace(self, player_number):
+    if self.pacer is not None:
+      self.pacer.pace_query(player_number)
+
+  def record_response(self, player_number, sent_at):
+    if self.pacer is not None:
+      self.pacer.record_response(player_number, time.time()-sent_at)
+
   def receive_dbmessage(self, sock):
     parse_errors = 0
     receive_timeouts = 0
@@ -286,13 +297,17 @@ class DBClient:
         query["args"].append({"type": "int32", "value": item_id})
     data = packets.DBMessage.build(query)
     logging.debug("query_list request: {}".format(query))
+    self.pace(player_number)
     self.socksnd(sock, data)
+    self.count_round_trip(player_number)
+    sent_at = time.time()
 
     try:
       reply = self.receive_dbmessage(sock)
     except (RangeError, MappingError, KeyError) as e:
       logging.error("parsing %s query failed on player %d failed: %s", query["type"], player_number, str(e))
       return None
+    self.record_response(player_number, sent_at)
     if reply is None or reply["type"] != "success":
       logging.error("%s failed on player %d (got %s)", query["type"], player_number, "NONE" if reply is None else reply["type"])
       return None
@@ -318,7 +333,9 @@ class DBClient:
     }
     data = packets.DBMessage.build(query)
     logging.debug("render query {}".format(query))
+    self.pace(player_number)
     self.socksnd(sock, data)
+    self.count_round_trip(player_number)
     parse_errors = 0
     receive_timeouts = 0
     data = b""
@@ -342,8 +359,10 @@ class DBClient:
     if parse_errors >= self.parse_error_count or receive_timeouts >= self.receive_timeout_count:
       raise dataprovider.FatalQueryError("Failed to receive {} render reply after {} timeouts, {} parse errors".format(request_type, receive_timeouts, parse_errors))
 
-    # basically, parse_metadata returns a single dict whereas parse_list returns a list of dicts
-    if request_type in ["metadata_request", "mount_info_request", "track_info_request"]:
+    # basically, parse_metadata returns a single record whereas parse_list returns a list of records
+    if request_type == "mount_info_request":
+      parsed = self.parse_metadata(reply, MountInfo)
+    elif request_type in ["metadata_request", "track_info_request"]:
       parsed = self.parse_metadata(reply)
     else:
       parsed = self.parse_list(reply)
@@ -376,12 +395,16 @@ class DBClient:
       query["args"].append({"type": "int32", "value": packets.Nxs2RequestIds["TXE"]})
     logging.debug("{} query {}".format(request_type, query))
     data = packets.DBMessage.build(query)
+    self.pace(player_number)
     self.socksnd(sock, data)
+    self.count_round_trip(player_number)
+    sent_at = time.time()
     try:
       reply = self.receive_dbmessage(sock)
     except (RangeError, MappingError, KeyError, TypeError) as e:
       logging.error("%s query parse error: %s", request_type, str(e))
       return None
+    self.record_response(player_number, sent_at)
     if reply is None:
       return None
     if reply["type"] == "invalid_request" or len(reply["args"])<3 or reply["args"][2]["value"] == 0:
@@ -550,4 +573,4 @@ class DBClient:
     elif request == "track_info":
       return self.query_list(*params[:2], None, [params[2]], "track_info_request")
     else:
-      raise dataprovider.FatalQueryError("invalid request type {}".format(request))
+      raise dataprovider.NotFoundQueryError("invalid request type {}".format(request))
@@ -0,0 +1,119 @@
+import hashlib
+import logging
+import os
+import struct
+from collections import OrderedDict
+from threading import Lock
+
+from .media import stable_link_info
+
+def default_cache_directory():
+  return os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "prodj")
+
+# identifies the contents of a media independently of the player it is inserted in
+# link_info is the media info of the link_reply (see Client.usb_info), sequence the one of export.pdb
+def media_fingerprint(link_info, sequence):
+  media = stable_link_info(link_info)
+  if media is None:
+    return None
+  identity = "{}|{}".format(media, sequence)
+  return hashlib.blake2b(identity.encode("utf-8"), digest_size=12).hexdigest()
+
+# files are stored as header + data, the header contains a checksum of the data
+file_magic = b"PDJC"
+file_header = struct.Struct(">4s16sQ") # magic, blake2b digest, data length
+
+def checksum(data):
+  return hashlib.blake2b(data, digest_size=16).digest()
+
+# persistent cache of downloaded media files like analysis files and artwork
+# entries are stored in directory/<fingerprint>/<name> and evicted least recently used first
+# once their total size exceeds size_limit, the modification time is the last access time
+class DiskCache:
+  def __init__(self, directory=None, size_limit=512*1024*1024):
+    self.directory = directory if directory is not None else default_cache_directory()
+    self.size_limit = size_limit
+    self.lock = Lock()
+    self.entries = None # path -> size, least recently used first, scanned on first access
+    self.bytes = 0
+    self.hits = 0
+    self.misses = 0
+
+  def scan(self):
+    if self.entries is not None:
+      return
+    files = []
+    if os.path.isdir(self.directory):
+      for media in os.scandir(self.directory):
+        if not media.is_dir():
+          continue
+        for entry in os.scandir(media.path):
+          if entry.is_file() and not entry.name.endswith(".tmp"):
+            stat = entry.stat()
+            files += [(stat.st_mtime, entry.path, stat.st_size)]
+    self.entries = OrderedDict((path, size) for mtime, path, size in sorted(files))
+    self.bytes = sum(self.entries.values())
+    logging.debug("disk cache %s: %d files, %d bytes", self.directory, len(self.entries), self.bytes)
+
+  # fingerprints of all media with cached entries
+  def fingerprints(self):
+    with self.lock:
+      self.scan()
+      return set(os.path.basename(os.path.dirname(path)) for path in self.entries)
+
+  def path(self, fingerprint, name):
+    return os.path.join(self.directory, fingerprint, name)
+
+  def remove(self, path):
+    self.bytes -= self.entries.pop(path, 0)
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+
+  # returns the data of the entry or None if it is missing or corrupted
+  def get(self, fingerprint, name):
+    path = self.path(fingerprint, name)
+    with self.lock:
+      self.scan()
+      if path not in self.entries:
+        self.misses += 1
+        return None
+      try:
+        with open(path, "rb") as f:
+          content = f.read()
+        os.utime(path)
+      except OSError as e:
+        logging.warning("failed to read cached %s: %s", path, e)
+        self.remove(path)
+        self.misses += 1
+        return None
+      data = content[file_header.size:]
+      if len(content) < file_header.size or file_header.unpack_from(content) != (file_magic, checksum(data), len(data)):
+        logging.warning("removing corrupted cache file %s", path)
+        self.remove(path)
+        self.misses += 1
+        return None
+      self.entries.move_to_end(path)
+      self.hits += 1
+      return data
+
+  def put(self, fingerprint, name, data):
+    path = self.path(fingerprint, name)
+    content = file_header.pack(file_magic, checksum(data), len(data)) + data
+    with self.lock:
+      self.scan()
+      try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path+".tmp", "wb") as f:
+          f.write(content)
+        os.replace(path+".tmp", path)
+      except OSError as e:
+        logging.warning("failed to write cache file %s: %s", path, e)
+        return
+      self.bytes += len(content) - self.entries.pop(path, 0)
+      self.entries[path] = len(content)
+      while self.bytes > self.size_limit and len(self.entries) > 1:
+        oldest = next(iter(self.entries))
+        logging.debug("removing %s from disk cache", oldest)
+        self.remove(oldest)
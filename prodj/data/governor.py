@@ -0,0 +1,47 @@
+import logging
+import time
+from threading import Lock
+
+# process wide memory budget over the estimated sizes of all registered DataStores
+# once the total exceeds the budget, unpinned entries are evicted across all stores, the
+# one of least value first: large entries idle for a long time in stores which are cheap
+# to refill (low weight) are evicted before small, recently used or expensive ones
+class MemoryGovernor:
+  def __init__(self, budget=160*1024*1024):
+    self.budget = budget
+    self.stores = {} # name -> (DataStore, weight)
+    self.lock = Lock()
+    self.metrics = None # set by DataProvider
+
+  def register(self, name, store, weight=1):
+    self.stores[name] = (store, weight)
+    store.governor = self
+
+  # estimated bytes per store
+  def usage(self):
+    return {name: store.bytes for name, (store, weight) in self.stores.items()}
+
+  def used(self):
+    return sum(store.bytes for store, weight in self.stores.values())
+
+  def enforce(self):
+    if self.used() <= self.budget:
+      return
+    with self.lock:
+      now = time.time()
+      pinned = {name: store.pinned() if store.pinned is not None else () for name, (store, weight) in self.stores.items()}
+      while self.used() > self.budget:
+        candidates = []
+        for name, (store, weight) in self.stores.items():
+          candidate = store.eviction_candidate(pinned[name])
+          if candidate is not None:
+            key, size, accessed_at = candidate
+            candidates += [(size*(now-accessed_at+1)/weight, name, key)]
+        if len(candidates) == 0:
+          logging.warning("memory budget of %d bytes exceeded by pinned entries (%d bytes)", self.budget, self.used())
+          return
+        score, name, key = max(candidates, key=lambda candidate: candidate[0])
+        logging.debug("evicting %s from %s store to stay within memory budget", str(key), name)
+        self.stores[name][0].discard(key)
+        if self.metrics is not None:
+          self.metrics.inc("memory_evictions_total", store=name)
@@ -0,0 +1,53 @@
+import hashlib
+import logging
+from threading import Lock
+
+# fields of the link info (see Client.usb_info) which do not change while files are written to the media
+identity_fields = ["name", "date", "bytes_total"]
+
+# the identity fields of link_info joined into a string, None if any of them is unknown
+def stable_link_info(link_info):
+  if not isinstance(link_info, dict) or not all(key in link_info for key in identity_fields):
+    return None
+  return "|".join(str(link_info[key]) for key in identity_fields)
+
+def digest(value):
+  return hashlib.blake2b(value.encode("utf-8"), digest_size=8).hexdigest()
+
+# identity of the media described by the link info of a link_reply
+def media_identity(link_info):
+  identity = stable_link_info(link_info)
+  return None if identity is None else "media-"+digest(identity)
+
+# alias table from (player_number, slot) to the identity of the inserted media
+# caches keyed by media identity are shared by all players the media is inserted in and survive
+# moving a media to another player or a player rejoining with another number
+class MediaAliases:
+  def __init__(self, prodj):
+    self.prodj = prodj
+    self.aliases = {} # (player_number, slot) -> media identity
+    self.lock = Lock()
+
+  # returns None as long as the link info of the media is unknown
+  def get(self, player_number, slot):
+    with self.lock:
+      if (player_number, slot) in self.aliases:
+        return self.aliases[player_number, slot]
+    client = self.prodj.cl.getClient(player_number) if self.prodj is not None else None
+    media = media_identity(getattr(client, str(slot)+"_info", None))
+    if media is not None:
+      with self.lock:
+        if media not in self.aliases.values():
+          logging.debug("player %d %s holds %s", player_number, slot, media)
+        self.aliases[player_number, slot] = media
+    return media
+
+  def remove(self, player_number, slot):
+    with self.lock:
+      return self.aliases.pop((player_number, slot), None)
+
+  # cache key of (player_number, slot, *rest): the media identity replaces player_number and slot
+  # if it is known, otherwise the key is kept as it is
+  def key(self, key):
+    media = self.get(*key[:2])
+    return key if media is None else (media, *key[2:])
@@ -0,0 +1,146 @@
+import logging
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Lock, Thread
+
+# upper bounds in seconds, everything slower ends up in the implicit +Inf bucket
+default_latency_buckets = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+def format_labels(labels):
+  if not labels:
+    return ""
+  return "{" + ",".join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in labels) + "}"
+
+class Histogram:
+  def __init__(self, buckets=default_latency_buckets):
+    self.buckets = buckets
+    self.counts = [0]*(len(buckets)+1)
+    self.sum = 0
+    self.count = 0
+
+  def observe(self, value):
+    index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+    self.counts[index] += 1
+    self.sum += value
+    self.count += 1
+
+  def cumulative_counts(self):
+    total = 0
+    for bound, count in zip(self.buckets+["+Inf"], self.counts):
+      total += count
+      yield bound, total
+
+  def stats(self):
+    return {
+      "count": self.count,
+      "sum": self.sum,
+      "mean": self.sum/self.count if self.count > 0 else 0,
+      "buckets": dict(self.cumulative_counts())
+    }
+
+# thread safe collection of counters, gauges and histograms, each identified by name and labels
+class Metrics:
+  def __init__(self):
+    self.lock = Lock()
+    self.counters = {} # (name, labels) -> value
+    self.gauges = {} # (name, labels) -> value
+    self.histograms = {} # (name, labels) -> Histogram
+
+  def inc(self, name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with self.lock:
+      self.counters[key] = self.counters.get(key, 0) + value
+
+  def set(self, name, value, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with self.lock:
+      self.gauges[key] = value
+
+  def observe(self, name, value, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with self.lock:
+      if key not in self.histograms:
+        self.histograms[key] = Histogram()
+      self.histograms[key].observe(value)
+
+  def snapshot(self):
+    with self.lock:
+      return {
+        "counters": {(name, labels): value for (name, labels), value in self.counters.items()},
+        "gauges": dict(self.gauges),
+        "histograms": {key: histogram.stats() for key, histogram in self.histograms.items()}
+      }
+
+  # renders all metrics in the prometheus text exposition format
+  def prometheus(self, prefix="prodj_"):
+    lines = []
+    with self.lock:
+      for metric_type, metrics in [("counter", self.counters), ("gauge", self.gauges)]:
+        for name in sorted(set(name for name, _ in metrics)):
+          lines += ["# TYPE {}{} {}".format(prefix, name, metric_type)]
+          for (metric_name, labels), value in sorted(metrics.items(), key=lambda x: str(x[0])):
+            if metric_name == name:
+              lines += ["{}{}{} {}".format(prefix, name, format_labels(labels), value)]
+      for name in sorted(set(name for name, _ in self.histograms)):
+        lines += ["# TYPE {}{} histogram".format(prefix, name)]
+        for (metric_name, labels), histogram in sorted(self.histograms.items(), key=lambda x: str(x[0])):
+          if metric_name != name:
+            continue
+          for bound, count in histogram.cumulative_counts():
+            lines += ["{}{}_bucket{} {}".format(prefix, name, format_labels(labels+(("le", bound),)), count)]
+          lines += ["{}{}_sum{} {}".format(prefix, name, format_labels(labels), histogram.sum)]
+          lines += ["{}{}_count{} {}".format(prefix, name, format_labels(labels), histogram.count)]
+    return "\n".join(lines)+"\n"
+
+# keeps the last window durations per key to estimate current latency percentiles
+class LatencyTracker:
+  def __init__(self, window=50, min_samples=5):
+    self.window = window
+    self.min_samples = min_samples
+    self.lock = Lock()
+    self.samples = {} # key -> deque of durations
+
+  def add(self, key, duration):
+    with self.lock:
+      if key not in self.samples:
+        self.samples[key] = deque(maxlen=self.window)
+      self.samples[key].append(duration)
+
+  # returns None until enough samples have been collected
+  def percentile(self, key, q):
+    with self.lock:
+      samples = sorted(self.samples.get(key, []))
+    if len(samples) < self.min_samples:
+      return None
+    return samples[min(int(len(samples)*q), len(samples)-1)]
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path not in ["/", "/metrics"]:
+      self.send_error(404)
+      return
+    data = self.server.render().encode("utf-8")
+    self.send_response(200)
+    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+    self.send_header("Content-Length", str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def log_message(self, format, *args):
+    logging.debug("metrics server: "+format, *args)
+
+# serves the output of render() in prometheus text format on http://host:port/metrics
+class MetricsServer(Thread):
+  def __init__(self, render, port, host="127.0.0.1"):
+    super().__init__()
+    self.httpd = HTTPServer((host, port), MetricsRequestHandler)
+    self.httpd.render = render
+
+  def run(self):
+    logging.info("Serving metrics on http://%s:%d/metrics", *self.httpd.server_address)
+    self.httpd.serve_forever()
+
+  def stop(self):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+    self.join()
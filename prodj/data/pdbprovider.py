@@ -1,23 +1,46 @@
 import logging
 import os
+import time
+from concurrent.futures import Future
 
 from . import dataprovider
 from .datastore import DataStore
+from .diskcache import DiskCache, media_fingerprint
+from .media import MediaAliases
+from .records import ListEntry, Metadata, MountInfo
 from prodj.pdblib.pdbdatabase import PDBDatabase
 from prodj.pdblib.usbanlzdatabase import UsbAnlzDatabase
 from prodj.network.rpcreceiver import ReceiveTimeout
 
 colors = ["none", "pink", "red", "orange", "yellow", "green", "aqua", "blue", "purple"]
 
+# requests answered from the DAT and EXT analysis files
+dat_requests = ["beatgrid", "preview_waveform"]
+ext_requests = ["waveform", "color_preview_waveform", "color_waveform"]
+# requests answered by each analysis file, in download order
+anlz_requests = {"DAT": dat_requests, "EXT": ext_requests}
+
 class PDBProvider:
   def __init__(self, prodj):
     self.prodj = prodj
-    self.dbs = DataStore() # (player_number,slot) -> PDBDatabase
-    self.usbanlz = DataStore() # (player_number, slot, track_id) -> UsbAnlzDatabase
+    self.media = MediaAliases(prodj) # (player_number, slot) -> media identity
+    self.dbs = DataStore(sizeof=PDBDatabase.estimate_size) # media identity or (player_number, slot) -> PDBDatabase
+    self.usbanlz = DataStore() # media identity or (player_number, slot), analyze_path -> UsbAnlzDatabase
+    self.db_failures = {} # (player_number, slot) -> (time, error) of the last failed database load
+    self.db_failure_ttl = 60 # seconds until a failed database load is attempted again
+    # called with player_number, slot, stage ("download", "parse", "ready" or "failed") and progress in percent
+    self.load_progress_callback = None
+    # analysis files and artwork survive restarts and media changes, set to None to disable
+    self.disk_cache = DiskCache()
+    self.cache_peer = None # set by DataProvider.start_cache_peer, asked before downloading from the player
 
-  def cleanup_stores_from_changed_media(self, player_number, slot):
+  # media is the identity of the removed media, its database is reloaded as it may have been exported to
+  def cleanup_stores_from_changed_media(self, player_number, slot, media=None):
     self.dbs.removeByPlayerSlot(player_number, slot)
+    if media is not None:
+      self.dbs.removeByMedia(media)
     self.usbanlz.removeByPlayerSlot(player_number, slot)
+    self.db_failures.pop((player_number, slot), None)
 
   def stop(self):
     self.dbs.stop()
@@ -29,63 +52,164 @@ class PDBProvider:
     except OSError:
       pass
 
+  def report_load_progress(self, player_number, slot, stage, progress):
+    if self.load_progress_callback is not None:
+      self.load_progress_callback(player_number, slot, stage, progress)
+
   def download_pdb(self, player_number, slot):
     player = self.prodj.cl.getClient(player_number)
     if player is None:
       raise dataprovider.FatalQueryError("player {} not found in clientlist".format(player_number))
     filename = "databases/player-{}-{}.pdb".format(player_number, slot)
     self.delete_pdb(filename)
+    progress_callback = lambda progress, done, size: self.report_load_progress(player_number, slot, "download", progress)
     try:
       try:
-        self.prodj.nfs.enqueue_download(player.ip_addr, slot, "/PIONEER/rekordbox/export.pdb", filename, sync=True)
+        self.prodj.nfs.enqueue_download(player.ip_addr, slot, "/PIONEER/rekordbox/export.pdb", filename, sync=True, progress_callback=progress_callback)
       except FileNotFoundError as e:
         logging.debug("default pdb path not found on player %d, trying MacOS path", player_number)
-        self.prodj.nfs.enqueue_download(player.ip_addr, slot, "/.PIONEER/rekordbox/export.pdb", filename, sync=True)
+        self.prodj.nfs.enqueue_download(player.ip_addr, slot, "/.PIONEER/rekordbox/export.pdb", filename, sync=True, progress_callback=progress_callback)
     except (RuntimeError, ReceiveTimeout) as e:
+      self.report_load_progress(player_number, slot, "failed", 0)
       raise dataprovider.FatalQueryError("database download from player {} failed: {}".format(player_number, e))
     return filename
 
   def download_and_parse_pdb(self, player_number, slot):
     filename = self.download_pdb(player_number, slot)
+    self.report_load_progress(player_number, slot, "parse", 0)
     db = PDBDatabase()
     try:
       db.load_file(filename)
     except RuntimeError as e:
+      self.report_load_progress(player_number, slot, "failed", 0)
       raise dataprovider.FatalQueryError("PDBFile: failed to parse \"{}\": {}".format(filename, e))
+    self.report_load_progress(player_number, slot, "ready", 100)
     return db
 
+  def is_loaded(self, player_number, slot):
+    return self.media.key((player_number, slot)) in self.dbs
+
+  # databases loaded before the link info of their media was known are moved to the media identity
   def get_db(self, player_number, slot):
-    if (player_number, slot) not in self.dbs:
-      db = self.download_and_parse_pdb(player_number, slot)
-      self.dbs[player_number, slot] = db
-    else:
-      db = self.dbs[player_number, slot]
+    key = self.media.key((player_number, slot))
+    db = self.dbs.get(key)
+    if db is None and key != (player_number, slot):
+      db = self.dbs.get((player_number, slot))
+      if db is not None:
+        self.dbs[key] = db
+        self.dbs.discard((player_number, slot))
+    if db is None:
+      if (player_number, slot) in self.db_failures:
+        failed_at, error = self.db_failures[player_number, slot]
+        if time.time()-failed_at < self.db_failure_ttl:
+          raise error
+      try:
+        db = self.download_and_parse_pdb(player_number, slot)
+      except dataprovider.FatalQueryError as e:
+        self.db_failures[player_number, slot] = (time.time(), e)
+        raise
+      self.db_failures.pop((player_number, slot), None)
+      db.load_callback = self.dbs.update_size
+      self.dbs[key] = db
     return db
 
-  def download_and_parse_usbanlz(self, player_number, slot, anlz_path):
+  # loads the database of a freshly mounted media in advance, so the first track load is answered from memory
+  def preload(self, player_number, slot):
+    db = self.get_db(player_number, slot)
+    db.load_tables()
+    return {"tracks": len(db["tracks"]), "playlists": len(db["playlists"])}
+
+  def ensure_not_cancelled(self, cancel_token):
+    if cancel_token is not None and cancel_token.cancelled():
+      raise dataprovider.CancelledQueryError("request cancelled while downloading")
+
+  # waits for a download started by enqueue_download, returns None if it failed
+  # there is no fixed timeout, downloads fail by themselves once their reads time out
+  # while background downloads are paced to a fraction of the bandwidth
+  def wait_for_download(self, future, cancel_token=None):
+    try:
+      data = future.result()
+    except RuntimeError as e:
+      logging.warning("returning empty buffer because: %s", e)
+      data = None
+    self.ensure_not_cancelled(cancel_token)
+    return data
+
+  # fingerprint of the media the database was loaded from, None if its link info is unknown
+  def media_fingerprint(self, player_number, slot, db):
+    player = self.prodj.cl.getClient(player_number)
+    link_info = getattr(player, slot+"_info", None)
+    if not isinstance(link_info, dict) or db.parsed is None:
+      return None
+    return media_fingerprint(link_info, db.parsed["sequence"])
+
+  # returns an item from the disk cache or from a cache peer, None if neither has it
+  def get_cached(self, fingerprint, name):
+    data = self.disk_cache.get(fingerprint, name)
+    if data is None and self.cache_peer is not None:
+      data = self.cache_peer.fetch(fingerprint, name)
+    return data
+
+  # downloads path into a buffer like nfs.enqueue_download, files already in the disk cache
+  # or held by a cache peer are returned from there and new ones are added
+  def enqueue_cached_download(self, player_number, slot, db, name, path, cancel_token=None):
     player = self.prodj.cl.getClient(player_number)
     if player is None:
       raise dataprovider.FatalQueryError("player {} not found in clientlist".format(player_number))
-    dat = self.prodj.nfs.enqueue_buffer_download(player.ip_addr, slot, anlz_path)
-    ext = self.prodj.nfs.enqueue_buffer_download(player.ip_addr, slot, anlz_path.replace("DAT", "EXT"))
+    fingerprint = self.media_fingerprint(player_number, slot, db) if self.disk_cache is not None else None
+    if fingerprint is not None:
+      data = self.get_cached(fingerprint, name)
+      if data is not None:
+        logging.debug("%s of player %d %s loaded from cache", name, player_number, slot)
+        future = Future()
+        future.set_result(data)
+        return future
+    future = self.prodj.nfs.enqueue_download(player.ip_addr, slot, path, cancel_token=cancel_token)
+    if fingerprint is not None:
+      future.add_done_callback(lambda f: self.cache_download(fingerprint, name, f))
+    return future
+
+  def cache_download(self, fingerprint, name, future):
+    if not future.cancelled() and future.exception() is None and future.result() is not None:
+      self.disk_cache.put(fingerprint, name, future.result())
+
+  def enqueue_usbanlz_downloads(self, player_number, slot, db, track, cancel_token=None, extensions=anlz_requests):
+    return [self.enqueue_cached_download(player_number, slot, db, "track-{}.{}".format(track.id, ext), track.analyze_path.replace("DAT", ext), cancel_token)
+      for ext in extensions]
+
+  # DAT and EXT are downloaded concurrently
+  def download_and_parse_usbanlz(self, player_number, slot, db, track, cancel_token=None):
+    dat_future, ext_future = self.enqueue_usbanlz_downloads(player_number, slot, db, track, cancel_token)
+    dat = self.wait_for_download(dat_future, cancel_token)
+    ext = self.wait_for_download(ext_future, cancel_token)
     db = UsbAnlzDatabase()
-    if dat is not None and ext is not None:
+    if dat is not None:
       db.load_dat_buffer(dat)
+    if ext is not None:
       db.load_ext_buffer(ext)
-    else:
-      logging.warning("missing DAT or EXT data, returning empty UsbAnlzDatabase")
+    if dat is None or ext is None:
+      logging.warning("missing DAT or EXT data, returning incomplete UsbAnlzDatabase")
     return db
 
-  def get_anlz(self, player_number, slot, track_id):
-    if (player_number, slot, track_id) not in self.usbanlz:
-      db = self.get_db(player_number, slot)
-      track = db.get_track(track_id)
-      self.usbanlz[player_number, slot, track_id] = self.download_and_parse_usbanlz(player_number, slot, track.analyze_path)
-    return self.usbanlz[player_number, slot, track_id]
+  # analysis files are keyed by their path on the media, which is unique for the audio file
+  def anlz_key(self, player_number, slot, track):
+    return self.media.key((player_number, slot, track.analyze_path))
 
-  def get_metadata(self, player_number, slot, track_id):
+  def get_anlz(self, player_number, slot, track_id, cancel_token=None):
     db = self.get_db(player_number, slot)
     track = db.get_track(track_id)
+    key = self.anlz_key(player_number, slot, track)
+    anlz = self.usbanlz.get(key)
+    if anlz is None:
+      anlz = self.download_and_parse_usbanlz(player_number, slot, db, track, cancel_token)
+      self.usbanlz[key] = anlz
+    return anlz
+
+  def get_metadata(self, player_number, slot, track_id):
+    db = self.get_db(player_number, slot)
+    return self.track_metadata(db, db.get_track(track_id))
+
+  def track_metadata(self, db, track):
     artist = db.get_artist(track.artist_id).name if track.artist_id > 0 else ""
     album = db.get_album(track.album_id).name if track.album_id > 0 else ""
     key = db.get_key(track.key_id).name if track.key_id > 0 else ""
@@ -97,95 +221,139 @@ class PDBProvider:
     else:
       color_text = ""
 
-    metadata = {
-      "track_id": track.id,
-      "title": track.title,
-      "artist_id": track.artist_id,
-      "artist": artist,
-      "album_id": track.album_id,
-      "album": album,
-      "key_id": track.key_id,
-      "key": key,
-      "genre_id": track.genre_id,
-      "genre": genre,
-      "duration": track.duration,
-      "comment": track.comment,
-      "date_added": track.date_added,
-      "color": color_name,
-      "color_text": color_text,
-      "rating": track.rating,
-      "artwork_id": track.artwork_id,
-      "bpm": track.bpm_100/100
-    }
-    return metadata
-
-  def get_artwork(self, player_number, slot, artwork_id):
-    player = self.prodj.cl.getClient(player_number)
-    if player is None:
-      raise dataprovider.FatalQueryError("player {} not found in clientlist".format(player_number))
+    return Metadata(
+      track_id=track.id,
+      title=track.title,
+      artist_id=track.artist_id,
+      artist=artist,
+      album_id=track.album_id,
+      album=album,
+      key_id=track.key_id,
+      key=key,
+      genre_id=track.genre_id,
+      genre=genre,
+      duration=track.duration,
+      comment=track.comment,
+      date_added=track.date_added,
+      color=color_name,
+      color_text=color_text,
+      rating=track.rating,
+      artwork_id=track.artwork_id,
+      bpm=track.bpm_100/100)
+
+  def get_artwork(self, player_number, slot, artwork_id, cancel_token=None):
     db = self.get_db(player_number, slot)
     try:
       artwork = db.get_artwork(artwork_id)
     except KeyError as e:
       logging.warning("No artwork for {}, returning empty data".format((player_number, slot, artwork_id)))
       return None
-    return self.prodj.nfs.enqueue_buffer_download(player.ip_addr, slot, artwork.path)
+    future = self.enqueue_cached_download(player_number, slot, db, "artwork-{}".format(artwork_id), artwork.path, cancel_token)
+    return self.wait_for_download(future, cancel_token)
 
-  def get_waveform(self, player_number, slot, track_id):
-    db = self.get_anlz(player_number, slot, track_id)
+  # returns the reply of an anlz request from a loaded UsbAnlzDatabase, None if it is not available
+  def get_anlz_part(self, db, request, key):
     try:
-      return db.get_waveform()
+      if request == "waveform":
+        return db.get_waveform()
+      elif request == "preview_waveform":
+        waveform_spread = b""
+        for line in db.get_preview_waveform():
+          waveform_spread += bytes([line & 0x1f, line>>5])
+        return waveform_spread
+      elif request == "color_waveform":
+        return db.get_color_waveform()
+      elif request == "color_preview_waveform":
+        return db.get_color_preview_waveform()
+      elif request == "beatgrid":
+        return db.get_beatgrid()
     except KeyError as e:
-      logging.warning("No waveform for {}, returning empty data".format((player_number, slot, track_id)))
+      logging.warning("No {} for {}, returning empty data".format(request.replace("_", " "), key))
       return None
 
-  def get_preview_waveform(self, player_number, slot, track_id):
-    db = self.get_anlz(player_number, slot, track_id)
-    waveform_spread = b""
-    try:
-      for line in db.get_preview_waveform():
-        waveform_spread += bytes([line & 0x1f, line>>5])
-    except KeyError as e:
-      logging.warning("No preview waveform for {}, returning empty data".format((player_number, slot, track_id)))
-      return None
-    return waveform_spread
+  def get_waveform(self, player_number, slot, track_id, cancel_token=None):
+    db = self.get_anlz(player_number, slot, track_id, cancel_token)
+    return self.get_anlz_part(db, "waveform", (player_number, slot, track_id))
 
-  def get_color_waveform(self, player_number, slot, track_id):
-    db = self.get_anlz(player_number, slot, track_id)
-    try:
-      return db.get_color_waveform()
-    except KeyError as e:
-      logging.warning("No color waveform for {}, returning empty data".format((player_number, slot, track_id)))
-      return None
+  def get_preview_waveform(self, player_number, slot, track_id, cancel_token=None):
+    db = self.get_anlz(player_number, slot, track_id, cancel_token)
+    return self.get_anlz_part(db, "preview_waveform", (player_number, slot, track_id))
 
-  def get_color_preview_waveform(self, player_number, slot, track_id):
-    db = self.get_anlz(player_number, slot, track_id)
-    try:
-      return db.get_color_preview_waveform()
-    except KeyError as e:
-      logging.warning("No color preview waveform for {}, returning empty data".format((player_number, slot, track_id)))
-      return None
+  def get_color_waveform(self, player_number, slot, track_id, cancel_token=None):
+    db = self.get_anlz(player_number, slot, track_id, cancel_token)
+    return self.get_anlz_part(db, "color_waveform", (player_number, slot, track_id))
+
+  def get_color_preview_waveform(self, player_number, slot, track_id, cancel_token=None):
+    db = self.get_anlz(player_number, slot, track_id, cancel_token)
+    return self.get_anlz_part(db, "color_preview_waveform", (player_number, slot, track_id))
+
+  def get_beatgrid(self, player_number, slot, track_id, cancel_token=None):
+    db = self.get_anlz(player_number, slot, track_id, cancel_token)
+    return self.get_anlz_part(db, "beatgrid", (player_number, slot, track_id))
 
-  def get_beatgrid(self, player_number, slot, track_id):
-    db = self.get_anlz(player_number, slot, track_id)
+  # resolves the track row once and downloads the analysis files and artwork needed for parts concurrently
+  # part_callback(request, item_id, reply) is called as soon as each of the requested parts is ready:
+  # metadata first, then beatgrid and preview waveform (DAT), the EXT waveforms and finally artwork
+  def get_track_bundle(self, player_number, slot, track_id, parts, part_callback, cancel_token=None):
+    db = self.get_db(player_number, slot)
     try:
-      return db.get_beatgrid()
+      track = db.get_track(track_id)
+      metadata = self.track_metadata(db, track) if "metadata" in parts else None
     except KeyError as e:
-      logging.warning("No beatgrid for {}, returning empty data".format((player_number, slot, track_id)))
-      return None
+      raise dataprovider.NotFoundQueryError(str(e))
+    key = (player_number, slot, track_id)
+    anlz_key = self.anlz_key(player_number, slot, track)
+    cached_anlz = self.usbanlz.get(anlz_key)
+
+    # only the analysis files holding requested parts are downloaded
+    anlz_downloads = []
+    if cached_anlz is None:
+      extensions = [ext for ext, requests in anlz_requests.items() if any(part in requests for part in parts)]
+      anlz_downloads = list(zip(extensions, self.enqueue_usbanlz_downloads(player_number, slot, db, track, cancel_token, extensions)))
+    artwork_future = None
+    if "artwork" in parts and track.artwork_id != 0:
+      try:
+        artwork_path = db.get_artwork(track.artwork_id).path
+        artwork_future = self.enqueue_cached_download(player_number, slot, db, "artwork-{}".format(track.artwork_id), artwork_path, cancel_token)
+      except KeyError as e:
+        logging.warning("No artwork for {}, returning empty data".format((player_number, slot, track.artwork_id)))
+
+    if "metadata" in parts:
+      part_callback("metadata", track_id, metadata)
+
+    def deliver_anlz_parts(anlz, requests):
+      for request in requests:
+        if request in parts:
+          part_callback(request, track_id, self.get_anlz_part(anlz, request, key))
+    if len(anlz_downloads) > 0:
+      anlz = UsbAnlzDatabase()
+      for ext, download in anlz_downloads:
+        data = self.wait_for_download(download, cancel_token)
+        if data is not None:
+          if ext == "DAT":
+            anlz.load_dat_buffer(data)
+          else:
+            anlz.load_ext_buffer(data)
+        deliver_anlz_parts(anlz, anlz_requests[ext])
+      # a partially loaded database would answer later requests for the other file with None
+      if len(anlz_downloads) == len(anlz_requests):
+        self.usbanlz[anlz_key] = anlz
+    elif cached_anlz is not None:
+      deliver_anlz_parts(cached_anlz, dat_requests+ext_requests)
+
+    if artwork_future is not None:
+      part_callback("artwork", track.artwork_id, self.wait_for_download(artwork_future, cancel_token))
 
   def get_mount_info(self, player_number, slot, track_id):
     db = self.get_db(player_number, slot)
     track = db.get_track(track_id)
 
     # contains additional fields to mimic dbserver reply
-    mount_info = {
-      "track_id": track.id,
-      "duration": track.duration,
-      "bpm": track.bpm_100/100,
-      "mount_path": track.path
-    }
-    return mount_info
+    return MountInfo(
+      track_id=track.id,
+      duration=track.duration,
+      bpm=track.bpm_100/100,
+      mount_path=track.path)
 
   # returns a dummy root menu
   def get_root_menu(self):
@@ -229,14 +397,14 @@ class PDBProvider:
         col2_item = track[col2_name]
       else:
         raise dataprovider.FatalQueryError("unknown sort mode {}".format(sort_mode))
-      converted += [{
-        "title": track.title,
-        col2_name: col2_item,
-        "track_id": track.id,
-        "artist_id": track.artist_id,
-        "album_id": track.album_id,
-        "artwork_id": track.artwork_id,
-        "genre_id": track.genre_id}]
+      converted += [ListEntry(
+        title=track.title,
+        track_id=track.id,
+        artist_id=track.artist_id,
+        album_id=track.album_id,
+        artwork_id=track.artwork_id,
+        genre_id=track.genre_id,
+        **{col2_name: col2_item})]
     if sort_mode == "default":
       return converted
     else:
@@ -251,23 +419,22 @@ class PDBProvider:
     db = self.get_db(player_number, slot)
     if len(id_list) == 3: # genre, artist, album
       if id_list[1] == 0 and id_list[2] == 0: # any artist, any album
-        ff = lambda track: track.genre_id == id_list[0]
+        track_list = db.find_tracks(genre_id=id_list[0])
       elif id_list[2] == 0: # any album
-        ff = lambda track: track.genre_id == id_list[0] and track.artist_id == id_list[1]
+        track_list = db.find_tracks(genre_id=id_list[0], artist_id=id_list[1])
       elif id_list[1] == 0: # any artist
-        ff = lambda track: track.genre_id == id_list[0] and track.album_id == id_list[2]
+        track_list = db.find_tracks(genre_id=id_list[0], album_id=id_list[2])
       else:
-        ff = lambda track: track.genre_id == id_list[0] and track.artist_id == id_list[1] and track.album_id == id_list[2]
+        track_list = db.find_tracks(genre_id=id_list[0], artist_id=id_list[1], album_id=id_list[2])
     elif len(id_list) == 2: # artist, album
       if id_list[1] == 0: # any album
-        ff = lambda track: track.artist_id == id_list[0]
+        track_list = db.find_tracks(artist_id=id_list[0])
       else:
-        ff = lambda track: track.artist_id == id_list[0] and track.album_id == id_list[1]
+        track_list = db.find_tracks(artist_id=id_list[0], album_id=id_list[1])
     elif len(id_list) == 1:
-      ff = lambda track: track.album_id == id_list[0]
+      track_list = db.find_tracks(album_id=id_list[0])
     else:
-      ff = None
-    track_list = filter(ff, db["tracks"])
+      track_list = db.find_tracks()
     # on titles, fall back to "title" sort mode as we can't know the user's default choice
     if sort_mode == "default":
       sort_mode = "title"
@@ -279,13 +446,12 @@ class PDBProvider:
     logging.debug("get_artists (%d, %s, %s)", player_number, slot, str(id_list))
     db = self.get_db(player_number, slot)
     if len(id_list) == 1:
-      ff = lambda artist: any(artist.id == track.artist_id for track in db["tracks"] if track.genre_id == id_list[0])
-      prepend = [{"all": " ALL "}]
+      artist_list = db.get_facet_entries("artists", "genre_artists", id_list[0])
+      prepend = [ListEntry(all=" ALL ")]
     else:
-      ff = None
+      artist_list = db["artists"]
       prepend = []
-    artist_list = filter(ff, db["artists"])
-    artists = [{"artist": artist.name, "artist_id": artist.id} for artist in artist_list]
+    artists = [ListEntry(artist=artist.name, artist_id=artist.id) for artist in artist_list]
     return prepend+sorted(artists, key=lambda key: key["artist"])
 
   # id_list empty -> list all albums
@@ -297,25 +463,24 @@ class PDBProvider:
     db = self.get_db(player_number, slot)
     if len(id_list) == 2:
       if id_list[1] == 0:
-        ff = lambda album: any(album.id == track.album_id for track in db["tracks"] if track.genre_id == id_list[0])
+        album_list = db.get_facet_entries("albums", "genre_albums", id_list[0])
       else:
-        ff = lambda album: any(album.id == track.album_id for track in db["tracks"] if track.artist_id == id_list[1] and track.genre_id == id_list[0])
-      prepend = [{"all": " ALL "}]
+        album_list = db.get_facet_entries("albums", "genre_artist_albums", id_list[0], id_list[1])
+      prepend = [ListEntry(all=" ALL ")]
     elif len(id_list) == 1:
-      ff = lambda album: any(album.id == track.album_id for track in db["tracks"] if track.artist_id == id_list[0])
-      prepend = [{"all": " ALL "}]
+      album_list = db.get_facet_entries("albums", "artist_albums", id_list[0])
+      prepend = [ListEntry(all=" ALL ")]
     else:
-      ff = None
+      album_list = db["albums"]
       prepend = []
-    album_list = filter(ff, db["albums"])
-    albums = [{"album": album.name, "album_id": album.id} for album in album_list]
+    albums = [ListEntry(album=album.name, album_id=album.id) for album in album_list]
     return prepend+sorted(albums, key=lambda key: key["album"])
 
   # id_list empty -> list genres
   def get_genres(self, player_number, slot):
     logging.debug("get_genres (%d, %s)", player_number, slot)
     db = self.get_db(player_number, slot)
-    genres = [{"genre": genre.name, "genre_id": genre.id} for genre in db["genres"]]
+    genres = [ListEntry(genre=genre.name, genre_id=genre.id) for genre in db["genres"]]
     sorted_genres = sorted(genres, key=lambda key: key["genre"])
     return sorted(genres, key=lambda key: key["genre"])
 
@@ -325,9 +490,9 @@ class PDBProvider:
     playlists = []
     for playlist in db.get_playlists(folder_id):
       if playlist.is_folder:
-        playlists += [{"folder": playlist.name, "folder_id": playlist.id, "parend_id": playlist.folder_id}]
+        playlists += [ListEntry(folder=playlist.name, folder_id=playlist.id, parent_id=playlist.folder_id)]
       else:
-        playlists += [{"playlist": playlist.name, "playlist_id": playlist.id, "parend_id": playlist.folder_id}]
+        playlists += [ListEntry(playlist=playlist.name, playlist_id=playlist.id, parent_id=playlist.folder_id)]
     return playlists
 
   def get_playlist(self, player_number, slot, sort_mode, playlist_id):
@@ -337,8 +502,18 @@ class PDBProvider:
     return self.convert_and_sort_track_list(db, track_list, sort_mode)
     #{'title': 'The Raven', 'artwork_id': 123, 'track_id': 225, 'artist_id': 4, 'key': '09A', 'key_id': 4}
 
-  def handle_request(self, request, params):
+  def get_track_playlists(self, player_number, slot, track_id):
+    db = self.get_db(player_number, slot)
+    return db.get_playlists_by_track(track_id)
+
+  def handle_request(self, request, params, cancel_token=None):
     logging.debug("handling %s request params %s", request, str(params))
+    try:
+      return self.dispatch_request(request, params, cancel_token)
+    except KeyError as e: # track, artwork etc. not found in the database
+      raise dataprovider.NotFoundQueryError(str(e))
+
+  def dispatch_request(self, request, params, cancel_token):
     if request == "metadata":
       return self.get_metadata(*params)
     elif request == "root_menu":
@@ -368,18 +543,22 @@ class PDBProvider:
     elif request == "playlist":
       return self.get_playlist(*params)
     elif request == "artwork":
-      return self.get_artwork(*params)
+      return self.get_artwork(*params, cancel_token)
     elif request == "waveform":
-      return self.get_waveform(*params)
+      return self.get_waveform(*params, cancel_token)
     elif request == "preview_waveform":
-      return self.get_preview_waveform(*params)
+      return self.get_preview_waveform(*params, cancel_token)
     elif request == "color_waveform":
-      return self.get_color_waveform(*params)
+      return self.get_color_waveform(*params, cancel_token)
     elif request == "color_preview_waveform":
-      return self.get_color_preview_waveform(*params)
+      return self.get_color_preview_waveform(*params, cancel_token)
     elif request == "beatgrid":
-      return self.get_beatgrid(*params)
+      return self.get_beatgrid(*params, cancel_token)
     elif request == "mount_info":
       return self.get_mount_info(*params)
-    else:
-      raise dataprovider.FatalQueryError("invalid request type {}".format(request))
+    elif request == "track_playlists":
+      return self.get_track_playlists(*params)
+    elif request == "preload":
+      return self.preload(*params)
+    else: # e.g. track_info is only available from dbserver
+      raise dataprovider.NotFoundQueryError("invalid request type {}".format(request))
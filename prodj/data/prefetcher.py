@@ -0,0 +1,64 @@
+import logging
+
+from . import dataprovider
+
+# fetches data of tracks which are likely to be loaded next in the background,
+# so a load is answered from the stores instead of going to nfs or dbserver
+class Prefetcher:
+  def __init__(self, data):
+    self.data = data
+    self.enabled = True
+    self.playlist_depth = 3 # number of following playlist entries to prefetch
+    self.max_playlists = 2 # number of playlists searched if no hint is available
+    self.requests = ["metadata", "beatgrid", "preview_waveform", "waveform", "artwork"] # track bundle parts
+    self.playlist_hints = {} # (player_number, slot) -> playlist_id the last track was loaded from
+
+  # called by the browser when loading a track from a playlist
+  def set_playlist_hint(self, player_number, slot, playlist_id):
+    self.playlist_hints[player_number, slot] = playlist_id
+
+  def cleanup_hints_from_changed_media(self, player_number, slot):
+    self.playlist_hints.pop((player_number, slot), None)
+
+  # called whenever a player loads a new track
+  def track_loaded(self, player_number, slot, track_id):
+    if not self.enabled or track_id == 0:
+      return
+    playlist_id = self.playlist_hints.get((player_number, slot))
+    if playlist_id is not None:
+      self.prefetch_playlist(player_number, slot, playlist_id, track_id)
+    elif self.data.pdb_enabled: # the playlists of a track are only known from the database
+      self.data.get_track_playlists(player_number, slot, track_id,
+        lambda request, *args: self.track_playlists_callback(player_number, slot, track_id, args[-1]),
+        priority=dataprovider.PRIORITY_PREFETCH)
+    self.prefetch_idle_decks()
+
+  def track_playlists_callback(self, player_number, slot, track_id, playlist_ids):
+    for playlist_id in playlist_ids[:self.max_playlists]:
+      self.prefetch_playlist(player_number, slot, playlist_id, track_id)
+
+  def prefetch_playlist(self, player_number, slot, playlist_id, track_id):
+    logging.debug("prefetching playlist %d following track %d on player %d %s", playlist_id, track_id, player_number, slot)
+    self.data.get_playlist(player_number, slot, playlist_id, "default",
+      lambda request, *args: self.playlist_callback(player_number, slot, track_id, args[-1]),
+      priority=dataprovider.PRIORITY_PREFETCH)
+
+  def playlist_callback(self, player_number, slot, track_id, entries):
+    track_ids = [entry["track_id"] for entry in entries if "track_id" in entry]
+    if track_id not in track_ids:
+      return
+    position = track_ids.index(track_id)
+    for next_track_id in track_ids[position+1:position+1+self.playlist_depth]:
+      self.prefetch_track(player_number, slot, next_track_id)
+
+  # tracks loaded on decks which are not playing are probably the next ones on air
+  def prefetch_idle_decks(self):
+    for client in self.data.prodj.cl.clients:
+      if (client.play_state in ["cued", "paused"] and client.track_id != 0 and
+          client.loaded_slot in ["usb", "sd"] and client.track_analyze_type == "rekordbox"):
+        self.prefetch_track(client.loaded_player_number, client.loaded_slot, client.track_id)
+
+  def prefetch_track(self, player_number, slot, track_id):
+    logging.debug("prefetching track %d from player %d %s", track_id, player_number, slot)
+    self.data.get_track_bundle(player_number, slot, track_id, parts=self.requests,
+      priority=dataprovider.PRIORITY_PREFETCH)
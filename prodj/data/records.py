@@ -0,0 +1,113 @@
+from collections.abc import Mapping
+
+# compact reply records with dict-style access (record["title"], "title" in record, get, keys, items)
+# fields live in __slots__, unset fields are not reported, rare fields go to an extra dict
+class Record(Mapping):
+  __slots__ = ("_extra",)
+  fields = () # fixed fields in iteration order
+
+  def __init__(self, *args, **kwargs):
+    self._extra = None
+    self.update(*args, **kwargs)
+
+  def __getitem__(self, key):
+    if key in self.fields:
+      try:
+        return getattr(self, key)
+      except AttributeError:
+        raise KeyError(key) from None
+    if self._extra is not None and key in self._extra:
+      return self._extra[key]
+    raise KeyError(key)
+
+  def __setitem__(self, key, value):
+    if key in self.fields:
+      setattr(self, key, value)
+    else:
+      if self._extra is None:
+        self._extra = {}
+      self._extra[key] = value
+
+  def __contains__(self, key):
+    if key in self.fields:
+      return hasattr(self, key)
+    return self._extra is not None and key in self._extra
+
+  def __iter__(self):
+    for key in self.fields:
+      if hasattr(self, key):
+        yield key
+    if self._extra is not None:
+      yield from self._extra
+
+  def __len__(self):
+    return sum(1 for key in self)
+
+  def update(self, *args, **kwargs):
+    for other in args+(kwargs,):
+      for key, value in (other.items() if isinstance(other, Mapping) else other):
+        self[key] = value
+
+  def __repr__(self):
+    return "{}({})".format(type(self).__name__, dict(self))
+
+class Metadata(Record):
+  fields = ("track_id", "title", "artist_id", "artist", "album_id", "album", "key_id", "key",
+    "genre_id", "genre", "duration", "comment", "date_added", "color", "color_text", "rating",
+    "artwork_id", "bpm", "label_id", "label", "original_artist_id", "original_artist",
+    "remixer_id", "remixer", "disc", "play_count", "bitrate", "year", "mount_path")
+  __slots__ = fields
+
+class MountInfo(Record):
+  fields = ("track_id", "duration", "bpm", "mount_path")
+  __slots__ = fields
+
+# entries of title lists and menus, i.e. a title with one sort dependent second column or
+# a single named item like an artist, album or playlist
+# the first field which is not a track field becomes the column, "<column>_id" its id
+class ListEntry(Record):
+  fields = ("title", "track_id", "artist_id", "album_id", "artwork_id", "genre_id", "parent_id")
+  __slots__ = fields+("_column", "_value", "_column_id")
+
+  def __init__(self, *args, **kwargs):
+    self._column = None
+    super().__init__(*args, **kwargs)
+
+  def __getitem__(self, key):
+    if self._column is not None and key == self._column:
+      return self._value
+    if self._column is not None and key == self._column+"_id" and hasattr(self, "_column_id"):
+      return self._column_id
+    return super().__getitem__(key)
+
+  def __setitem__(self, key, value):
+    if key in self.fields:
+      setattr(self, key, value)
+    elif self._column is None and key[-3:] != "_id":
+      self._column = key
+      self._value = value
+    elif self._column is not None and key == self._column:
+      self._value = value
+    elif self._column is not None and key == self._column+"_id":
+      self._column_id = value
+    else:
+      super().__setitem__(key, value)
+
+  def __contains__(self, key):
+    if self._column is not None and key == self._column:
+      return True
+    if self._column is not None and key == self._column+"_id" and hasattr(self, "_column_id"):
+      return True
+    return super().__contains__(key)
+
+  # title first, then the column, so list views can guess their columns from the keys
+  def __iter__(self):
+    if hasattr(self, "title"):
+      yield "title"
+    if self._column is not None:
+      yield self._column
+      if hasattr(self, "_column_id"):
+        yield self._column+"_id"
+    for key in super().__iter__():
+      if key != "title":
+        yield key
@@ -0,0 +1,393 @@
+import hashlib
+import inspect
+import itertools
+import logging
+import os
+import socket
+import socketserver
+import struct
+from collections.abc import Mapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Queue
+from threading import Lock, Thread
+
+from . import dataprovider
+from .datastore import DataStore
+
+# DataProvider getters (without "get_" prefix) available to remote clients
+remote_requests = ["metadata", "root_menu", "titles", "titles_by_album", "titles_by_artist_album",
+  "titles_by_genre_artist_album", "artists", "artists_by_genre", "albums", "albums_by_artist",
+  "albums_by_genre_artist", "genres", "playlist_folder", "playlist", "artwork", "waveform",
+  "preview_waveform", "color_waveform", "color_preview_waveform", "beatgrid", "mount_info",
+  "track_info", "track_playlists"]
+
+# exceptions transported to the client by name
+remote_errors = ["TemporaryQueryError", "FatalQueryError", "NotFoundQueryError", "CancelledQueryError"]
+
+# slots requests can be made for, the slot is used in file paths and attribute names
+remote_slots = ["usb", "sd", "cd", "rekordbox"]
+
+# player number and slot followed by ids and sort modes
+def valid_params(params):
+  if not isinstance(params, list) or len(params) < 2:
+    return False
+  if type(params[0]) is not int or not 1 <= params[0] <= 4 or params[1] not in remote_slots:
+    return False
+  return all(type(param) is int or isinstance(param, str) for param in params[2:])
+
+# maximum number of positional parameters of a remote request, i.e. the ones in front of callback
+def request_arity(request):
+  parameters = list(inspect.signature(getattr(dataprovider.DataProvider, "get_"+request)).parameters)
+  return parameters.index("callback")-1 # without self
+
+# compact binary encoding of the reply types, each value starts with a type tag
+# ints are zigzag varints, lengths are unsigned varints
+TAG_NONE, TAG_FALSE, TAG_TRUE, TAG_INT, TAG_FLOAT, TAG_STR, TAG_BYTES, TAG_LIST, TAG_DICT = range(9)
+
+def encode_varint(value):
+  data = bytearray()
+  while value > 0x7f:
+    data.append(value & 0x7f | 0x80)
+    value >>= 7
+  data.append(value)
+  return bytes(data)
+
+def decode_varint(data, offset):
+  value = 0
+  shift = 0
+  while True:
+    if offset >= len(data):
+      raise ValueError("truncated varint")
+    byte = data[offset]
+    offset += 1
+    value |= (byte & 0x7f) << shift
+    shift += 7
+    if byte & 0x80 == 0:
+      return value, offset
+
+def encode(value):
+  if value is None:
+    return bytes([TAG_NONE])
+  elif value is True or value is False:
+    return bytes([TAG_TRUE if value else TAG_FALSE])
+  elif isinstance(value, int):
+    return bytes([TAG_INT]) + encode_varint(value*2 if value >= 0 else -value*2-1)
+  elif isinstance(value, float):
+    return bytes([TAG_FLOAT]) + struct.pack(">d", value)
+  elif isinstance(value, str):
+    data = value.encode("utf-8")
+    return bytes([TAG_STR]) + encode_varint(len(data)) + data
+  elif isinstance(value, (bytes, bytearray)):
+    return bytes([TAG_BYTES]) + encode_varint(len(value)) + bytes(value)
+  elif isinstance(value, Mapping): # includes records and construct containers, private fields like _io are skipped
+    items = [(k, v) for k, v in value.items() if not (isinstance(k, str) and k.startswith("_"))]
+    return bytes([TAG_DICT]) + encode_varint(len(items)) + b"".join(encode(k)+encode(v) for k, v in items)
+  elif isinstance(value, (list, tuple)):
+    return bytes([TAG_LIST]) + encode_varint(len(value)) + b"".join(encode(v) for v in value)
+  raise TypeError("unable to encode {}".format(type(value).__name__))
+
+# list of values which are already encoded
+def encode_list(encoded_values):
+  return bytes([TAG_LIST]) + encode_varint(len(encoded_values)) + b"".join(encoded_values)
+
+def decode_value(data, offset):
+  if offset >= len(data):
+    raise ValueError("truncated value")
+  tag = data[offset]
+  offset += 1
+  if tag == TAG_NONE:
+    return None, offset
+  elif tag in [TAG_FALSE, TAG_TRUE]:
+    return tag == TAG_TRUE, offset
+  elif tag == TAG_INT:
+    value, offset = decode_varint(data, offset)
+    return (value >> 1) ^ -(value & 1), offset
+  elif tag == TAG_FLOAT:
+    if offset+8 > len(data):
+      raise ValueError("truncated float")
+    return struct.unpack_from(">d", data, offset)[0], offset+8
+  elif tag in [TAG_STR, TAG_BYTES]:
+    length, offset = decode_varint(data, offset)
+    if offset+length > len(data):
+      raise ValueError("truncated string")
+    value = bytes(data[offset:offset+length])
+    return value.decode("utf-8") if tag == TAG_STR else value, offset+length
+  elif tag == TAG_LIST:
+    length, offset = decode_varint(data, offset)
+    items = []
+    for i in range(length):
+      item, offset = decode_value(data, offset)
+      items.append(item)
+    return items, offset
+  elif tag == TAG_DICT:
+    length, offset = decode_varint(data, offset)
+    items = {}
+    for i in range(length):
+      key, offset = decode_value(data, offset)
+      items[key], offset = decode_value(data, offset)
+    return items, offset
+  raise ValueError("invalid type tag {}".format(tag))
+
+def decode(data):
+  value, offset = decode_value(data, 0)
+  if offset != len(data):
+    raise ValueError("{} trailing bytes".format(len(data)-offset))
+  return value
+
+# replies are validated by the first bytes of the hash of their encoding
+def validation_token(encoded_reply):
+  return hashlib.blake2b(encoded_reply, digest_size=8).digest()
+
+# frames are prefixed by their length as uint32
+def send_frame(sock, value):
+  send_encoded_frame(sock, encode(value))
+
+def send_encoded_frame(sock, data):
+  sock.sendall(struct.pack(">I", len(data)) + data)
+
+def receive_exactly(sock, length):
+  data = b""
+  while len(data) < length:
+    chunk = sock.recv(length-len(data))
+    if not chunk:
+      return None
+    data += chunk
+  return data
+
+def receive_frame(sock, max_size=64*1024*1024):
+  header = receive_exactly(sock, 4)
+  if header is None:
+    return None
+  length = struct.unpack(">I", header)[0]
+  if length > max_size:
+    raise ValueError("frame of {} bytes too large".format(length))
+  data = receive_exactly(sock, length)
+  if data is None:
+    return None
+  return decode(data)
+
+# request frame: [request_id, request, params, validation token or None, priority]
+# reply frame: [request_id, status, callback args, reply, validation token]
+# status is "ok", "not_modified" (reply omitted, client cache is valid) or "error" (reply is [name, message])
+# requests are handled concurrently, replies are sent as soon as they are available
+# requests are received by a separate thread, replies are queued and encoded and sent by the handler thread,
+# so a slow client does not block the DataProvider callbacks
+class DataRequestHandler(socketserver.BaseRequestHandler):
+  def setup(self):
+    self.replies = Queue() # (request_id, status, callback args, reply, client validation token), None when done
+    self.connected = True
+
+  def handle(self):
+    logging.info("data client %s connected", str(self.client_address))
+    receiver = Thread(target=self.receive_requests, daemon=True)
+    receiver.start()
+    while True:
+      reply = self.replies.get()
+      if reply is None:
+        break
+      try:
+        send_encoded_frame(self.request, self.encode_reply(*reply))
+      except OSError as e:
+        logging.warning("failed to send reply to data client %s: %s", str(self.client_address), e)
+        try:
+          self.request.shutdown(socket.SHUT_RDWR) # stops the receiver
+        except OSError:
+          pass
+        break
+    self.connected = False
+    receiver.join()
+    logging.info("data client %s disconnected", str(self.client_address))
+
+  def receive_requests(self):
+    while True:
+      try:
+        frame = receive_frame(self.request)
+      except (ValueError, OSError) as e:
+        logging.warning("closing connection to data client %s: %s", str(self.client_address), e)
+        break
+      if frame is None:
+        break
+      try:
+        self.handle_frame(*frame)
+      except (TypeError, ValueError) as e:
+        logging.warning("invalid frame from data client %s: %s", str(self.client_address), e)
+        break
+    self.replies.put(None)
+
+  def handle_frame(self, request_id, request, params, token, priority):
+    if request not in remote_requests or not valid_params(params) or len(params) > request_arity(request):
+      self.send_error(request_id, dataprovider.FatalQueryError("invalid remote request {} {}".format(request, params)))
+      return
+    if type(priority) is not int:
+      self.send_error(request_id, dataprovider.FatalQueryError("invalid priority {}".format(priority)))
+      return
+    # remote clients can not preempt local requests
+    priority = min(max(priority, dataprovider.PRIORITY_DEFAULT), dataprovider.PRIORITY_PREFETCH)
+    getter = getattr(self.server.data, "get_"+request)
+    callback = lambda *args: self.send_reply(request_id, args[:-1], args[-1], token)
+    future = getter(*params, callback=callback, priority=priority)
+    future.add_done_callback(lambda f: self.request_done(request_id, f))
+
+  # successful replies are sent by the callback, which includes the full callback arguments
+  def request_done(self, request_id, future):
+    if future.cancelled():
+      self.send_error(request_id, dataprovider.CancelledQueryError("request cancelled"))
+    elif future.exception() is not None:
+      self.send_error(request_id, future.exception())
+
+  def send_reply(self, request_id, args, reply, client_token):
+    if self.connected:
+      self.replies.put((request_id, "ok", list(args), reply, client_token))
+
+  def send_error(self, request_id, error):
+    name = type(error).__name__ if type(error).__name__ in remote_errors else "FatalQueryError"
+    if self.connected:
+      self.replies.put((request_id, "error", [], [name, str(error)], None))
+
+  # the reply is encoded once, its encoding is hashed for the validation token and sent as it is
+  def encode_reply(self, request_id, status, args, reply, client_token):
+    try:
+      encoded = encode(reply)
+    except TypeError as e:
+      logging.error("unable to send %s reply to data client %s: %s", status, str(self.client_address), e)
+      status, args, encoded = "error", [], encode(["FatalQueryError", str(e)])
+    token = None
+    if status == "ok":
+      token = validation_token(encoded)
+      if token == client_token:
+        status, encoded = "not_modified", encode(None)
+    return encode_list([encode(request_id), encode(status), encode(args), encoded, encode(token)])
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+# serves the request api of a DataProvider on address, either a (host, port) tuple or a unix socket path
+class DataProviderServer(Thread):
+  def __init__(self, data, address):
+    super().__init__()
+    self.address = address
+    if isinstance(address, str):
+      if os.path.exists(address):
+        os.remove(address)
+      self.server = ThreadingUnixServer(address, DataRequestHandler)
+    else:
+      self.server = ThreadingTCPServer(address, DataRequestHandler)
+    self.server.data = data
+
+  def run(self):
+    logging.info("Serving data requests on %s", str(self.address))
+    self.server.serve_forever()
+
+  def stop(self):
+    self.server.shutdown()
+    self.server.server_close()
+    if isinstance(self.address, str) and os.path.exists(self.address):
+      os.remove(self.address)
+    self.join()
+
+# client side of DataProviderServer, offering the same get_* calls as DataProvider
+# replies are cached locally and only transferred again if the validation token changed
+class RemoteDataProvider:
+  def __init__(self, address):
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    self.sock = socket.socket(family, socket.SOCK_STREAM)
+    self.sock.connect(address)
+    self.send_lock = Lock()
+    self.request_ids = itertools.count(1)
+    self.pending = {} # request_id -> (future, callback, cache key)
+    self.cache = DataStore(size_limit=100, byte_limit=64*1024*1024) # (request, params) -> (validation token, reply)
+    self.validated_replies = 0 # number of replies answered from the cache
+    self.callback_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="RemoteDataCallback")
+    self.receiver = Thread(target=self.receive_replies, daemon=True)
+    self.receiver.start()
+
+  def stop(self):
+    self.sock.shutdown(socket.SHUT_RDWR)
+    self.sock.close()
+    self.receiver.join()
+    self.callback_executor.shutdown()
+    self.cache.stop()
+
+  def __getattr__(self, name):
+    if not name.startswith("get_") or name[4:] not in remote_requests:
+      raise AttributeError(name)
+    request = name[4:]
+    arity = request_arity(request)
+    def getter(*params, callback=None, priority=None, **options):
+      if len(params) > arity: # callback passed positionally
+        params, callback = params[:arity], params[arity]
+      return self.request(request, list(params), callback, priority)
+    return getter
+
+  # requests are pipelined, they are sent immediately without waiting for earlier replies
+  def request(self, request, params, callback=None, priority=None):
+    if priority is None:
+      priority = dataprovider.PRIORITY_DEFAULT
+    future = Future()
+    key = (request, tuple(params))
+    cached = self.cache.peek(key)
+    self.send_request(key, None if cached is None else cached[0], priority, future, callback)
+    return future
+
+  def send_request(self, key, token, priority, future, callback):
+    request_id = next(self.request_ids)
+    self.pending[request_id] = (future, callback, key, priority)
+    try:
+      with self.send_lock:
+        send_frame(self.sock, [request_id, key[0], list(key[1]), token, priority])
+    except OSError as e:
+      self.pending.pop(request_id, None)
+      dataprovider.fail_future(future, dataprovider.TemporaryQueryError("data server connection failed: {}".format(e)))
+
+  def receive_replies(self):
+    while True:
+      try:
+        frame = receive_frame(self.sock)
+      except (ValueError, OSError) as e:
+        logging.warning("data server connection failed: %s", e)
+        frame = None
+      if frame is None:
+        break
+      try:
+        self.handle_reply(*frame)
+      except (TypeError, ValueError) as e:
+        logging.warning("invalid reply from data server: %s", e)
+        try:
+          self.sock.shutdown(socket.SHUT_RDWR) # later requests fail instead of waiting for a reply
+        except OSError:
+          pass
+        break
+    for request_id in list(self.pending):
+      future, callback, key, priority = self.pending.pop(request_id)
+      dataprovider.fail_future(future, dataprovider.TemporaryQueryError("data server connection closed"))
+
+  def handle_reply(self, request_id, status, args, reply, token):
+    if request_id not in self.pending:
+      logging.warning("reply for unknown request id %s", request_id)
+      return
+    # the request stays pending until the reply is known to be valid, so it fails with the connection otherwise
+    future, callback, key, priority = self.pending[request_id]
+    if not isinstance(args, list) or status not in ["ok", "not_modified", "error"]:
+      raise ValueError("invalid reply status {}".format(status))
+    if status == "error":
+      name, message = reply
+      del self.pending[request_id]
+      dataprovider.fail_future(future, getattr(dataprovider, name if name in remote_errors else "FatalQueryError")(message))
+      return
+    del self.pending[request_id]
+    if status == "not_modified":
+      cached = self.cache.peek(key)
+      if cached is None: # evicted since the request was sent, request the full reply again
+        self.send_request(key, None, priority, future, callback)
+        return
+      reply = cached[1]
+      self.validated_replies += 1
+    else:
+      self.cache[key] = (token, reply)
+    dataprovider.resolve_future(future, reply)
+    if callback is not None:
+      self.callback_executor.submit(callback, *args, reply)
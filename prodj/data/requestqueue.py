@@ -0,0 +1,44 @@
+import heapq
+import time
+from queue import Empty
+from threading import Condition
+
+# priority queue of (priority, sequence, deadline, request) entries with a size limit
+# when it is full, expired entries are dropped first, then the entry with the lowest priority,
+# the oldest one among entries of equal priority
+class RequestQueue:
+  def __init__(self, max_size=200):
+    self.max_size = max_size
+    self.entries = []
+    self.condition = Condition()
+
+  # returns a list of (entry, reason) tuples of the entries dropped to make room
+  def put(self, entry):
+    dropped = []
+    with self.condition:
+      heapq.heappush(self.entries, entry)
+      if len(self.entries) > self.max_size:
+        now = time.time()
+        dropped += [(e, "deadline") for e in self.entries if e[2] < now]
+        self.entries = [e for e in self.entries if e[2] >= now]
+      if len(self.entries) > self.max_size:
+        victim = max(self.entries, key=lambda e: (e[0], -e[1]))
+        self.entries.remove(victim)
+        dropped += [(victim, "queue_full")]
+      heapq.heapify(self.entries)
+      self.condition.notify()
+    return dropped
+
+  def get(self, timeout=None):
+    with self.condition:
+      if not self.condition.wait_for(lambda: len(self.entries) > 0, timeout):
+        raise Empty
+      return heapq.heappop(self.entries)
+
+  # lowest priority value among the queued entries, None if the queue is empty
+  def min_priority(self):
+    with self.condition:
+      return self.entries[0][0] if len(self.entries) > 0 else None
+
+  def qsize(self):
+    return len(self.entries)
@@ -0,0 +1,49 @@
+import json
+import logging
+import time
+from threading import Lock
+
+from .datastore import estimate_size
+
+# writes one json line per answered DataProvider request:
+# {"time": unix time, "request": name, "store": name of the DataStore or null, "key": store key,
+#  "size": estimated bytes of the reply, "source": "store", "pdb" or "dbc", "latency": seconds}
+# the traces are replayed against cache policies by cache-simulator.py
+class RequestTracer:
+  def __init__(self, path):
+    self.path = path
+    self.file = open(path, "a", encoding="utf-8")
+    self.lock = Lock()
+    self.records = 0
+
+  def record(self, request, store, key, reply, source, latency):
+    line = json.dumps({
+      "time": round(time.time(), 3),
+      "request": request,
+      "store": store,
+      "key": str(key),
+      "size": estimate_size(reply),
+      "source": source,
+      "latency": round(latency, 6)
+    })
+    with self.lock:
+      if self.file is None:
+        return
+      self.file.write(line+"\n")
+      self.records += 1
+
+  def close(self):
+    with self.lock:
+      if self.file is not None:
+        self.file.close()
+        self.file = None
+    logging.info("wrote %d requests to trace %s", self.records, self.path)
+
+# yields the records of a trace file, invalid lines are skipped
+def read_trace(path):
+  with open(path, encoding="utf-8") as f:
+    for number, line in enumerate(f, 1):
+      try:
+        yield json.loads(line)
+      except ValueError:
+        logging.warning("skipping invalid line %d of trace %s", number, path)
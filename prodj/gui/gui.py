@@ -6,6 +6,7 @@ from PyQt5.QtWidgets import QFrame, QGridLayout, QLabel, QPushButton, QSizePolic
 from PyQt5.QtGui import QColor, QPainter, QPixmap
 from PyQt5.QtCore import pyqtSignal, Qt, QSize
 
+from prodj.data.dataprovider import CancelToken
 from .gui_browser import Browser, printableField
 from .waveform_gl import GLWaveformWidget
 from .preview_waveform_qt import PreviewWaveformWidget
@@ -54,6 +55,7 @@ class PlayerWidget(QFrame):
     self.time_mode_remain = False
     self.show_color_waveform = parent.show_color_waveform
     self.show_color_preview = parent.show_color_preview
+    self.cancel_token = CancelToken() # shared by all requests for the current track
 
     # metadata and player info
     self.labels["title"] = QLabel(self)
@@ -200,6 +202,12 @@ class PlayerWidget(QFrame):
     self.waveform.clear()
     self.preview_waveform.clear()
 
+  # cancels outstanding requests for the previous track
+  def renewCancelToken(self):
+    self.cancel_token.cancel()
+    self.cancel_token = CancelToken()
+    return self.cancel_token
+
   def reset(self):
     self.unload()
     self.labels["info"].setText("No player connected")
@@ -316,6 +324,10 @@ class Gui(QWidget):
 
     self.show_color_waveform = show_color_waveform
     self.show_color_preview = show_color_preview
+    self.track_bundle_parts = ["metadata", "beatgrid",
+      "color_preview_waveform" if show_color_preview else "preview_waveform",
+      "color_waveform" if show_color_waveform else "waveform", "artwork"]
+    self.prodj.data.prefetcher.requests = self.track_bundle_parts
 
     self.players = {}
     self.layout = QGridLayout(self)
@@ -443,23 +455,14 @@ class Gui(QWidget):
     # track changed -> reload metadata
     if player.track_id != c.track_id:
       player.track_id = c.track_id # remember requested track id
+      cancel_token = player.renewCancelToken()
       if c.track_id != 0:
         if c.loaded_slot in ["sd", "usb"] and c.track_analyze_type == "rekordbox":
           logging.info("track id of player %d changed to %d, requesting metadata", player_number, c.track_id)
-          self.prodj.data.get_metadata(c.loaded_player_number, c.loaded_slot, c.track_id, self.dbclient_callback)
-          if self.show_color_preview:
-            self.prodj.data.get_color_preview_waveform(c.loaded_player_number, c.loaded_slot, c.track_id, self.dbclient_callback)
-          else:
-            self.prodj.data.get_preview_waveform(c.loaded_player_number, c.loaded_slot, c.track_id, self.dbclient_callback)
-          if self.show_color_waveform:
-            self.prodj.data.get_color_waveform(c.loaded_player_number, c.loaded_slot, c.track_id, self.dbclient_callback)
-          else:
-            self.prodj.data.get_waveform(c.loaded_player_number, c.loaded_slot, c.track_id, self.dbclient_callback)
-          self.prodj.data.get_beatgrid(c.loaded_player_number, c.loaded_slot, c.track_id, self.dbclient_callback)
-          # we do not get artwork yet because we need metadata to know the artwork_id
+          self.prodj.data.get_track_bundle(c.loaded_player_number, c.loaded_slot, c.track_id, self.dbclient_callback, self.track_bundle_parts, cancel_token=cancel_token)
         elif c.track_analyze_type == "file":
           logging.info("player %d loaded bare file %d, requesting info", player_number, c.track_id)
-          self.prodj.data.get_track_info(c.loaded_player_number, c.loaded_slot, c.track_id, self.dbclient_callback)
+          self.prodj.data.get_track_info(c.loaded_player_number, c.loaded_slot, c.track_id, self.dbclient_callback, cancel_token=cancel_token)
         elif c.track_analyze_type == "cd":
           logging.info("player %d loaded cd track %d", player_number, c.track_id)
           player.setMetadata(f"Track {c.track_id}", "CD", "")
@@ -489,10 +492,8 @@ class Gui(QWidget):
           logging.warning("empty metadata received")
           continue
         player.setMetadata(reply["title"], reply["artist"], reply["album"])
-        if "artwork_id" in reply and reply["artwork_id"] != 0:
-          self.prodj.data.get_artwork(source_player_number, slot, reply["artwork_id"], self.dbclient_callback)
-        else:
-          player.setArtwork(None)
+        if "artwork_id" not in reply or reply["artwork_id"] == 0:
+          player.setArtwork(None) # otherwise, artwork is part of the track bundle
       elif request == "artwork":
         player.setArtwork(reply)
       elif request == "waveform":
@@ -383,6 +383,8 @@ class Browser(QWidget):
       return
     logging.debug("loading track (pn %d slot %s tid %d) into player %d",
       self.player_number, self.slot, self.track_id, player_number)
+    if self.menu == "playlist":
+      self.prodj.data.prefetcher.set_playlist_hint(self.player_number, self.slot, self.playlist_id)
     self.prodj.vcdj.command_load_track(player_number, self.player_number, self.slot, self.track_id)
 
   def downloadTrack(self):
@@ -9,6 +9,7 @@ from threading import Thread
 from .packets_nfs import getNfsCallStruct, getNfsResStruct, MountMntArgs, MountMntRes, MountVersion, NfsVersion, PortmapArgs, PortmapPort, PortmapVersion, PortmapRes, RpcMsg
 from .rpcreceiver import RpcReceiver
 from .nfsdownload import NfsDownload, generic_file_download_done_callback
+from .pacer import REALTIME
 
 class NfsClient:
   def __init__(self, prodj):
@@ -21,6 +22,8 @@ class NfsClient:
     self.xid = 1
     self.download_file_handle = None
     self.default_download_directory = "./downloads/"
+    self.metrics = None # set by ProDj to record transfer statistics
+    self.pacer = None # set by ProDj to limit the read bandwidth per player
     self.export_by_slot = {
       "sd": "/B/",
       "usb": "/C/"
@@ -55,6 +58,20 @@ class NfsClient:
     self.xid += 1
     return self.xid
 
+  # player number of the client with ip, or the ip itself if it is unknown
+  def playerFromIp(self, ip):
+    client = next((c for c in self.prodj.cl.clients if c.ip_addr == ip), None) if self.prodj is not None else None
+    return client.player_number if client is not None else ip
+
+  # called by NfsDownload once a download finished or failed
+  def recordDownload(self, host, transferred, duration):
+    if self.metrics is None:
+      return
+    player = self.playerFromIp(host[0])
+    self.metrics.inc("nfs_bytes_total", transferred, player=player)
+    self.metrics.inc("nfs_download_seconds_total", duration, player=player)
+    self.metrics.inc("nfs_downloads_total", player=player)
+
   def setDownloadChunkSize(self, chunk_size):
     self.download_chunk_size = chunk_size
     self.receiver.recv_size = chunk_size + 160
@@ -133,6 +150,12 @@ class NfsClient:
       mount_handle = nfsreply["fhandle"]
     return nfsreply
 
+  # returns the seconds to wait before reading size bytes from host
+  def paceRead(self, host, size, traffic_class):
+    if self.pacer is None:
+      return 0
+    return self.pacer.reserve(self.playerFromIp(host[0]), "read", size, traffic_class)
+
   async def NfsReadData(self, host, fhandle, offset, size):
     nfscall = {
       "fhandle": fhandle,
@@ -140,27 +163,37 @@ class NfsClient:
       "count": size,
       "totalcount": 0
     }
-    return await self.NfsCall(host, "read", nfscall)
+    sent_at = time.time()
+    reply = await self.NfsCall(host, "read", nfscall)
+    if self.pacer is not None:
+      self.pacer.record_response(self.playerFromIp(host[0]), time.time()-sent_at)
+    return reply
 
   # download file at src_path from player with ip from slot
   # save to dst_path if it is not empty, otherwise return a buffer
   # in both cases, return a future representing the download result
-  # if sync is true, wait for the result and return it directly (30 seconds timeout)
-  def enqueue_download(self, ip, slot, src_path, dst_path=None, sync=False):
+  # if sync is true, wait for the result and return it directly, stalled downloads fail on their own
+  # once their reads time out, paced background downloads of large files may take minutes
+  # progress_callback is called from the download loop with progress in percent, bytes done and total size
+  # once cancel_token (see DataProvider.CancelToken) is cancelled, no further reads are issued
+  # reads are paced according to the traffic class of the calling thread (see Pacer.traffic)
+  def enqueue_download(self, ip, slot, src_path, dst_path=None, sync=False, progress_callback=None, cancel_token=None):
     logging.debug("enqueueing download of %s from %s", src_path, ip)
+    traffic_class = self.pacer.traffic_class() if self.pacer is not None else REALTIME
     # future = self.executer.submit(self.handle_download, ip, slot, src_path, dst_path)
     future = asyncio.run_coroutine_threadsafe(
-      self.handle_download(ip, slot, src_path, dst_path), self.loop)
+      self.handle_download(ip, slot, src_path, dst_path, progress_callback, cancel_token, traffic_class), self.loop)
     if sync:
-      return future.result(timeout=30)
+      return future.result()
     return future
 
   # download path from player with ip after trying to mount slot
-  # this call blocks until the download is finished and returns the downloaded bytes
-  def enqueue_buffer_download(self, ip, slot, src_path):
-    future = self.enqueue_download(ip, slot, src_path)
+  # this call blocks until the download is finished and returns the downloaded bytes,
+  # like enqueue_download with sync set, there is no fixed timeout
+  def enqueue_buffer_download(self, ip, slot, src_path, cancel_token=None):
+    future = self.enqueue_download(ip, slot, src_path, cancel_token=cancel_token)
     try:
-      return future.result(timeout=30)
+      return future.result()
     except RuntimeError as e:
       logging.warning("returning empty buffer because: %s", e)
       return None
@@ -180,7 +213,7 @@ class NfsClient:
     future.add_done_callback(generic_file_download_done_callback)
     return future
 
-  async def handle_download(self, ip, slot, src_path, dst_path):
+  async def handle_download(self, ip, slot, src_path, dst_path, progress_callback=None, cancel_token=None, traffic_class=REALTIME):
     logging.info("handling download of %s@%s:%s to %s",
       ip, slot, src_path, dst_path)
     if slot not in self.export_by_slot:
@@ -194,9 +227,11 @@ class NfsClient:
     logging.debug("nfs port of player %s: %d", ip, nfs_port)
 
     mount_handle = await self.MountMnt((ip, mount_port), export)
-    download = NfsDownload(self, (ip, nfs_port), mount_handle, src_path)
+    download = NfsDownload(self, (ip, nfs_port), mount_handle, src_path, traffic_class)
     if dst_path is not None:
       download.setFilename(dst_path)
+    download.progress_callback = progress_callback
+    download.cancel_token = cancel_token
 
     # TODO: NFS UMNT
     return await download.start()
@@ -6,13 +6,15 @@ import time
 from concurrent.futures import Future
 from enum import Enum
 
+from .pacer import REALTIME
+
 class NfsDownloadType(Enum):
   buffer = 1,
   file = 2,
   failed = 3
 
 class NfsDownload:
-  def __init__(self, nfsclient, host, mount_handle, src_path):
+  def __init__(self, nfsclient, host, mount_handle, src_path, traffic_class=REALTIME):
     self.nfsclient = nfsclient
     self.host = host # tuple of (ip, port)
     self.mount_handle = mount_handle
@@ -24,6 +26,10 @@ class NfsDownload:
     self.last_write_at = None
     self.speed = 0
     self.future = Future()
+    self.progress_callback = None # called with progress in percent, bytes done and total size
+    self.cancel_token = None # no more reads are sent once cancel_token.cancelled() is true
+    self.traffic_class = traffic_class # pacer budget used for the reads, taken from the enqueueing thread
+    self.pacing = False # true while waiting for the pacer to allow the next read
 
     self.max_in_flight = 4 # values > 4 did not increase read speed in my tests
     self.in_flight = 0
@@ -74,6 +80,9 @@ class NfsDownload:
     return chunk
 
   def sendReadRequests(self):
+    if self.cancel_token is not None and self.cancel_token.cancelled():
+      self.fail_download("download of {} cancelled".format(self.src_path))
+      return
     if self.last_write_at is not None and self.last_write_at + self.single_request_timeout < time.time():
       if self.read_retries > self.max_read_retries:
         self.fail_download("read requests timed out %d times, aborting download", self.max_read_retries)
@@ -83,12 +92,28 @@ class NfsDownload:
         self.sendReadRequest(self.write_offset)
         self.read_retries += 1
 
-    while self.in_flight < self.max_in_flight and self.read_offset < self.size:
+    while self.in_flight < self.max_in_flight and self.read_offset < self.size and not self.pacing:
+      chunk = min(self.nfsclient.download_chunk_size, self.size-self.read_offset)
+      delay = self.nfsclient.paceRead(self.host, chunk, self.traffic_class)
+      if delay > 0:
+        self.pacing = True
+        asyncio.get_running_loop().call_later(delay, self.sendPacedReadRequest)
+        break
       self.read_offset += self.sendReadRequest(self.read_offset)
 
+  # sends the read the pacer delayed, its bandwidth is already reserved
+  def sendPacedReadRequest(self):
+    self.pacing = False
+    if self.type == NfsDownloadType.failed:
+      return
+    self.read_offset += self.sendReadRequest(self.read_offset)
+    self.sendReadRequests()
+
   def readCallback(self, offset, task):
     # logging.debug("readCallback @ %d/%d [%d in flight]", offset, self.size, self.in_flight)
     self.in_flight = max(0, self.in_flight-1)
+    if self.type == NfsDownloadType.failed:
+      return # late reply of a failed or cancelled download
     if self.write_offset <= offset:
       try:
         reply = task.result()
@@ -115,6 +140,8 @@ class NfsDownload:
       self.speed = offset/(time.time()-self.started_at)/1024/1024
       logging.info("download progress %d%% (%d/%d Bytes, %.2f MiB/s)",
         self.progress, offset, self.size, self.speed)
+      if self.progress_callback is not None:
+        self.progress_callback(self.progress, offset, self.size)
 
   def writeBlocks(self):
     # logging.debug("writing %d blocks @ %d [%d in flight]",
@@ -148,6 +175,7 @@ class NfsDownload:
       self.src_path, self.dst_path, self.write_offset, self.speed)
     if self.in_flight > 0:
       logging.error("BUG: finishing download of %s but packets are still in flight", self.src_path)
+    self.nfsclient.recordDownload(self.host, self.write_offset, time.time()-self.started_at)
     if self.type == NfsDownloadType.buffer:
       self.future.set_result(self.download_buffer)
     elif self.type == NfsDownloadType.file:
@@ -155,6 +183,12 @@ class NfsDownload:
       self.future.set_result(self.dst_path)
 
   def fail_download(self, message="Unknown error"):
+    if self.type == NfsDownloadType.failed:
+      return
+    if self.type == NfsDownloadType.file:
+      self.download_file_handle.close()
+    if self.started_at > 0:
+      self.nfsclient.recordDownload(self.host, self.write_offset, time.time()-self.started_at)
     self.type = NfsDownloadType.failed
     self.future.set_exception(RuntimeError(message))
 
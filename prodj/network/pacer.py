@@ -0,0 +1,112 @@
+import logging
+import time
+from contextlib import contextmanager
+from threading import Lock, local
+
+REALTIME = "realtime" # requests a user or the decks are waiting for
+BACKGROUND = "background" # preloading, prefetching and other bulk transfers
+
+class TokenBucket:
+  def __init__(self, rate, burst):
+    self.rate = rate
+    self.burst = burst
+    self.tokens = burst
+    self.updated_at = time.time()
+
+  # takes amount tokens, returns the seconds to wait until they are actually available
+  # the bucket may go into debt, so callers are served in the order of their reservations
+  def reserve(self, amount):
+    now = time.time()
+    self.tokens = min(self.burst, self.tokens+(now-self.updated_at)*self.rate)
+    self.updated_at = now
+    self.tokens -= amount
+    return max(0, -self.tokens/self.rate)
+
+# limits dbserver queries and nfs read bandwidth per player, the players are slow embedded
+# devices and heavy querying may disturb them while playing
+# realtime and background traffic have separate budgets, background budgets shrink when the
+# response times of a player rise above its usual level and recover slowly afterwards
+class Pacer:
+  def __init__(self):
+    # per player limits, None disables the limit
+    self.query_rates = {REALTIME: 20, BACKGROUND: 5} # dbserver queries per second
+    self.read_rates = {REALTIME: 4*1024*1024, BACKGROUND: 1024*1024} # nfs bytes per second
+    self.backoff_threshold = 2 # back off if responses take this many times the usual time
+    self.min_backoff = 0.1 # lowest factor applied to background rates
+    self.metrics = None # set by DataProvider
+    # set by DataProvider, returns true while realtime requests wait for background traffic to finish,
+    # which then uses the realtime budget
+    self.realtime_waiting = None
+
+    self.lock = Lock()
+    self.local = local()
+    self.buckets = {} # (player, kind, traffic_class) -> TokenBucket
+    self.response_times = {} # player -> [usual response time, recent average]
+    self.backoff = {} # player -> factor applied to background rates
+
+  # traffic class of requests issued by the current thread
+  def traffic_class(self):
+    return getattr(self.local, "traffic_class", REALTIME)
+
+  @contextmanager
+  def traffic(self, traffic_class):
+    previous = self.traffic_class()
+    self.local.traffic_class = traffic_class
+    try:
+      yield
+    finally:
+      self.local.traffic_class = previous
+
+  def rate(self, player, kind, traffic_class):
+    rate = (self.query_rates if kind == "query" else self.read_rates).get(traffic_class)
+    if rate is not None and traffic_class == BACKGROUND:
+      rate *= self.backoff.get(player, 1)
+    return rate
+
+  # returns the seconds to wait before sending amount units of kind ("query" or "read") to player
+  def reserve(self, player, kind, amount=1, traffic_class=None):
+    if traffic_class is None:
+      traffic_class = self.traffic_class()
+    if traffic_class == BACKGROUND and self.realtime_waiting is not None and self.realtime_waiting():
+      traffic_class = REALTIME
+    rate = self.rate(player, kind, traffic_class)
+    if rate is None:
+      return 0
+    with self.lock:
+      key = (player, kind, traffic_class)
+      if key not in self.buckets:
+        self.buckets[key] = TokenBucket(rate, rate) # allow bursts of one second
+      bucket = self.buckets[key]
+      bucket.rate = rate
+      delay = bucket.reserve(amount)
+    if delay > 0 and self.metrics is not None:
+      self.metrics.inc("pacer_wait_seconds_total", delay, player=player, kind=kind, traffic=traffic_class)
+    return delay
+
+  # blocks until a dbserver query to player is allowed
+  def pace_query(self, player):
+    delay = self.reserve(player, "query")
+    if delay > 0:
+      time.sleep(delay)
+
+  def record_response(self, player, duration):
+    with self.lock:
+      if player not in self.response_times:
+        self.response_times[player] = [duration, duration]
+        return
+      times = self.response_times[player]
+      times[1] = 0.8*times[1]+0.2*duration
+      # the usual response time follows decreases immediately and increases slowly
+      times[0] = min(times[1], times[0]+0.01*(times[1]-times[0]))
+      factor = self.backoff.get(player, 1)
+      if times[1] > self.backoff_threshold*times[0]:
+        new_factor = max(self.min_backoff, factor/2)
+      else:
+        new_factor = min(1, factor*1.1)
+      if new_factor == factor:
+        return
+      if new_factor < factor and factor == 1:
+        logging.info("player %s responds slowly (%.3fs instead of %.3fs), reducing background traffic", str(player), times[1], times[0])
+      self.backoff[player] = new_factor
+    if self.metrics is not None:
+      self.metrics.set("pacer_backoff", new_factor, player=player)
@@ -0,0 +1,161 @@
+import struct
+
+from construct import Container, ListContainer
+
+from .pagetype import PageTypeEnum
+
+# decodes pdb pages with struct instead of the construct definitions in page.py
+# it yields the same values as AlignedPage but only decodes enabled rows and the
+# requested string fields, offsets like entry_start are relative to the page start
+
+page_size = 4096
+page_header = struct.Struct("<4xIIII4xBBBBHHHHHH") # 40 bytes, see PageHeader
+u8 = struct.Struct("<B")
+u16 = struct.Struct("<H")
+
+def decode_page_header(page):
+  (index, page_type, next_index, u1, entry_count_small, u3, u4, u5, free_size, payload_size,
+    overridden_entries, entry_count_large, u9, u10) = page_header.unpack_from(page)
+  header = Container(index=index, page_type=PageTypeEnum.decmapping.get(page_type, page_type), next_index=next_index,
+    u1=u1, entry_count_small=entry_count_small, u3=u3, u4=u4, u5=u5, free_size=free_size, payload_size=payload_size,
+    overridden_entries=overridden_entries, entry_count_large=entry_count_large, u9=u9, u10=u10)
+  header.is_strange_page = index != 0 and u5 & 0x40
+  header.is_empty_page = index == 0 and u9 == 0
+  if entry_count_small < entry_count_large and not header.is_strange_page and not header.is_empty_page and entry_count_large != 8191:
+    header.entry_count = entry_count_large
+  else:
+    header.entry_count = entry_count_small
+  return header
+
+# (row offset relative to the page start, enabled) of all rows, in the order of PDBDatabase.load_table
+# the reverse index at the page end holds groups of 16 rows, each 16 row offsets (stored backwards)
+# followed by the enabled and enabled_override bitmasks
+def row_offsets(page, entry_count):
+  rows = []
+  for group in range(entry_count//16+1):
+    group_end = page_size-36*group
+    enabled = u16.unpack_from(page, group_end-4)[0]
+    for row in range(min(16, entry_count-16*group)):
+      rows += [(page_header.size+u16.unpack_from(page, group_end-6-2*row)[0], bool(enabled >> row & 1))]
+  return rows
+
+def decode_string(page, offset):
+  padded_length = page[offset]
+  if padded_length == 0x40: # longer than 127 bytes
+    length = u16.unpack_from(page, offset+1)[0]-4
+    return bytes(page[offset+4:offset+4+length]).rstrip(b"\x00").decode("ascii")
+  if padded_length == 0x90: # utf-16
+    length = u16.unpack_from(page, offset+1)[0]-4
+    text = bytes(page[offset+3:offset+3+length])
+    while len(text) >= 2 and text[-2:] == b"\x00\x00":
+      text = text[:-2]
+    return text.decode("utf-16-be")
+  length = (padded_length-1)//2-1
+  return bytes(page[offset+1:offset+1+length]).rstrip(b"\x00").decode("ascii")
+
+track_row = struct.Struct("<HHIIIIIHHIIIIIIIIIIIIHHHHHHBBHH21H")
+track_fields = ["magic", "index_shift", "bitmask", "sample_rate", "composer_index", "file_size", "u1", "u2", "u3",
+  "artwork_id", "key_id", "original_artist_id", "label_id", "remixer_id", "bitrate", "track_number", "bpm_100",
+  "genre_id", "album_id", "artist_id", "id", "disc_number", "play_count", "year", "sample_depth", "duration", "u4",
+  "color_id", "rating", "u5", "u6"]
+# in the order of Track.str_idx
+track_strings = ["str_u1", "texter", "str_u2", "str_u3", "str_u4", "message", "kuvo_public", "autoload_hotcues",
+  "str_u5", "str_u6", "date_added", "release_date", "mix_name", "str_u7", "analyze_path", "analyze_date", "comment",
+  "title", "str_u8", "filename", "path"]
+
+def decode_track(page, start, strings=None):
+  values = track_row.unpack_from(page, start)
+  if values[0] != 0x24:
+    raise ValueError("invalid track row magic {} at {}".format(values[0], start))
+  row = Container(entry_start=start, **dict(zip(track_fields, values)))
+  row.str_idx = ListContainer(values[len(track_fields):])
+  for name, index in zip(track_strings, row.str_idx):
+    if strings is None or name in strings:
+      row[name] = decode_string(page, start+index)
+  return row
+
+artist_row = struct.Struct("<HHI")
+
+def decode_artist(page, start, strings=None):
+  magic, index_shift, entry_id = artist_row.unpack_from(page, start)
+  if magic == 0x60:
+    unknown, name_idx = struct.unpack_from("<BB", page, start+8)
+  elif magic == 0x64:
+    unknown, name_idx = struct.unpack_from("<HH", page, start+8)
+  else:
+    raise ValueError("invalid artist row magic {} at {}".format(magic, start))
+  row = Container(entry_start=start, magic=magic, index_shift=index_shift, id=entry_id, unknown=unknown, name_idx=name_idx)
+  if strings is None or "name" in strings:
+    row.name = decode_string(page, start+name_idx)
+  return row
+
+album_row = struct.Struct("<HH4xII4xBB")
+
+def decode_album(page, start, strings=None):
+  magic, index_shift, album_artist_id, entry_id, unknown, name_idx = album_row.unpack_from(page, start)
+  if magic != 0x80:
+    raise ValueError("invalid album row magic {} at {}".format(magic, start))
+  row = Container(entry_start=start, magic=magic, index_shift=index_shift, album_artist_id=album_artist_id,
+    id=entry_id, unknown=unknown, name_idx=name_idx)
+  if strings is None or "name" in strings:
+    row.name = decode_string(page, start+name_idx)
+  return row
+
+playlist_row = struct.Struct("<I4xIII")
+
+def decode_playlist(page, start, strings=None):
+  folder_id, sort_order, entry_id, is_folder = playlist_row.unpack_from(page, start)
+  row = Container(folder_id=folder_id, sort_order=sort_order, id=entry_id, is_folder=is_folder)
+  if strings is None or "name" in strings:
+    row.name = decode_string(page, start+playlist_row.size)
+  return row
+
+playlist_map_row = struct.Struct("<III")
+
+def decode_playlist_map(page, start, strings=None):
+  return Container(zip(["entry_index", "track_id", "playlist_id"], playlist_map_row.unpack_from(page, start)))
+
+def decode_color(page, start, strings=None):
+  row = Container(id=struct.unpack_from(">H", page, start+4)[0])
+  if strings is None or "name" in strings:
+    row.name = decode_string(page, start+8)
+  return row
+
+def decode_key(page, start, strings=None):
+  entry_id, id2 = struct.unpack_from("<II", page, start)
+  row = Container(id=entry_id, id2=id2)
+  if strings is None or "name" in strings:
+    row.name = decode_string(page, start+8)
+  return row
+
+# rows of an id followed by a single string: genres, labels and artwork
+def id_string_decoder(string_name):
+  def decode(page, start, strings=None):
+    row = Container(id=struct.unpack_from("<I", page, start)[0])
+    if strings is None or string_name in strings:
+      row[string_name] = decode_string(page, start+4)
+    return row
+  return decode
+
+row_decoders = {
+  "block_tracks": decode_track,
+  "block_artists": decode_artist,
+  "block_albums": decode_album,
+  "block_playlists": decode_playlist,
+  "block_playlist_map": decode_playlist_map,
+  "block_artwork": id_string_decoder("path"),
+  "block_colors": decode_color,
+  "block_genres": id_string_decoder("name"),
+  "block_keys": decode_key,
+  "block_labels": id_string_decoder("name")
+}
+
+# returns the enabled rows of a data page, strings is a collection of the string fields to
+# decode, None for all of them
+def decode_rows(page, strings=None, header=None):
+  if header is None:
+    header = decode_page_header(page)
+  decode = row_decoders.get(header.page_type)
+  if decode is None or header.is_strange_page or header.is_empty_page:
+    return []
+  return [decode(page, offset, strings) for offset, enabled in row_offsets(page, header.entry_count) if enabled]
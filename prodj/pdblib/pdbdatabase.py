@@ -1,103 +1,275 @@
-import os
 import logging
+import sys
+from threading import RLock
 
-from .pdbfile import PDBFile
+from .fileheader import FileHeader
+from .pagedecoder import decode_page_header, decode_rows
+
+# page type of the pages of every table
+tables = {
+  "tracks": "block_tracks",
+  "artists": "block_artists",
+  "albums": "block_albums",
+  "playlists": "block_playlists",
+  "playlist_map": "block_playlist_map",
+  "artwork": "block_artwork",
+  "colors": "block_colors",
+  "genres": "block_genres",
+  "key_names": "block_keys",
+  "labels": "block_labels"
+}
+# tables loaded by load_file, all others are loaded on first access
+eager_tables = ["tracks", "artists", "albums"]
+# string fields decoded for every track, the other ones are skipped
+default_track_strings = ["title", "comment", "date_added", "mix_name", "analyze_path", "filename", "path"]
+# tables with entries identified by id
+id_tables = ["tracks", "artists", "albums", "playlists", "artwork", "colors", "genres", "labels", "key_names"]
+# track fields with an index of the tracks referencing each id
+track_indexes = ["artist_id", "album_id", "genre_id", "label_id", "key_id"]
+# facets of the tracks for drill-down menus: name -> (key fields, counted field)
+facets = {
+  "genre_artists": (("genre_id",), "artist_id"),
+  "genre_albums": (("genre_id",), "album_id"),
+  "artist_albums": (("artist_id",), "album_id"),
+  "genre_artist_albums": (("genre_id", "artist_id"), "album_id")
+}
+
+# size of value and the plain dicts, lists and sets in it, entries (construct containers) are not included
+# long containers are extrapolated from their first sample_size items
+def container_size(value, sample_size=64):
+  size = sys.getsizeof(value)
+  items = list(value.values()) if type(value) is dict else value
+  if type(value) not in [dict, list, set] or len(items) == 0:
+    return size
+  sample = [item for item, _ in zip(items, range(sample_size))]
+  return size + sum(container_size(item, sample_size) for item in sample)*len(items)//len(sample)
+
+# size of the entries of a table including their fields, extrapolated from the first sample_size entries
+def table_size(entries, sample_size=64):
+  if len(entries) == 0:
+    return sys.getsizeof(entries)
+  sample = entries[:sample_size]
+  entry_size = sum(sys.getsizeof(entry)+sum(sys.getsizeof(value) for value in entry.values()) for entry in sample)
+  return sys.getsizeof(entries) + entry_size*len(entries)//len(sample)
 
 class PDBDatabase(dict):
   def __init__(self):
+    self.pending = set() # tables not loaded yet
     super().__init__(self, tracks=[], artists=[], albums=[], playlists=[], playlist_map=[], artwork=[], colors=[], genres=[], labels=[], key_names=[])
-    self.parsed = None
+    self.parsed = None # file header
+    self.pages = {} # table name -> [(page header, page)] of the tables not loaded yet
+    self.track_strings = default_track_strings # None to decode all strings of tracks
+    self.lock = RLock()
+    self.indexes = {} # table name -> {id: entry}, track field -> {id: [tracks]}
+    self.load_callback = None # called with the database after a table was loaded on access
+
+  # rough estimate of the memory used in bytes, including the pages of pending tables and the indexes
+  # the database changes its size when tables are loaded, see load_callback
+  def estimate_size(self):
+    size = sum(len(page) for pages in list(self.pages.values()) for header, page in pages)
+    for target in list(tables):
+      if target not in self.pending:
+        size += table_size(super().__getitem__(target))
+    return size + sum(container_size(index) for index in list(self.indexes.values()))
+
+  def __getitem__(self, target):
+    if target in self.pending:
+      self.load_table(target)
+    return super().__getitem__(target)
+
+  # id -> entry of table target, built by load_file or on first access
+  def ids(self, target):
+    index = self.indexes.get(target)
+    if index is None:
+      index = {}
+      for entry in self[target]:
+        index.setdefault(entry.id, entry)
+      self.indexes[target] = index
+    return index
+
+  # tracks with field (one of track_indexes) equal to value, in database order
+  def get_tracks_by(self, field, value):
+    index = self.indexes.get(field)
+    if index is None:
+      index = {}
+      for track in self["tracks"]:
+        index.setdefault(track[field], []).append(track)
+      self.indexes[field] = index
+    return index.get(value, [])
+
+  # tracks matching all criteria (field=value, fields of track_indexes), in database order
+  # only the tracks of the most selective index are checked, album drill-downs without any
+  # matching tracks are answered by the facets
+  def find_tracks(self, **criteria):
+    if len(criteria) == 0:
+      return self["tracks"]
+    if "album_id" in criteria and ("genre_id" in criteria or "artist_id" in criteria):
+      if "genre_id" not in criteria:
+        albums = self.get_facet("artist_albums", criteria["artist_id"])
+      elif "artist_id" not in criteria:
+        albums = self.get_facet("genre_albums", criteria["genre_id"])
+      else:
+        albums = self.get_facet("genre_artist_albums", criteria["genre_id"], criteria["artist_id"])
+      if criteria["album_id"] not in albums:
+        return []
+    candidates = min((self.get_tracks_by(field, value) for field, value in criteria.items()), key=len)
+    return [track for track in candidates if all(track[field] == value for field, value in criteria.items())]
+
+  # {id: number of tracks} of facet name for key, e.g. the artists of a genre:
+  # get_facet("genre_artists", genre_id) -> {artist_id: number of tracks of the artist in the genre}
+  def get_facet(self, name, *key):
+    facet = self.indexes.get(name)
+    if facet is None:
+      fields, counted_field = facets[name]
+      facet = {}
+      for track in self["tracks"]:
+        counts = facet.setdefault(tuple(track[field] for field in fields), {})
+        counts[track[counted_field]] = counts.get(track[counted_field], 0)+1
+      self.indexes[name] = facet
+    return facet.get(key, {})
+
+  # entries of table target with an id in facet name for key, ordered by id
+  def get_facet_entries(self, target, name, *key):
+    index = self.ids(target)
+    return [index[entry_id] for entry_id in sorted(self.get_facet(name, *key)) if entry_id in index]
+
+  # playlist tree and playlist contents:
+  # "playlist_children": folder_id -> playlists and folders sorted by sort_order
+  # "playlist_tracks": playlist_id -> track ids sorted by entry_index
+  # "track_playlists": track_id -> sorted ids of the playlists containing it
+  def playlist_index(self, name):
+    if name not in self.indexes:
+      children = {}
+      for playlist in self["playlists"]:
+        children.setdefault(playlist.folder_id, []).append(playlist)
+      for folder in children.values():
+        folder.sort(key=lambda playlist: playlist.sort_order)
+      entries = {}
+      track_playlists = {}
+      for pm in self["playlist_map"]:
+        entries.setdefault(pm.playlist_id, []).append((pm.entry_index, pm.track_id))
+        track_playlists.setdefault(pm.track_id, set()).add(pm.playlist_id)
+      self.indexes["playlist_children"] = children
+      self.indexes["playlist_tracks"] = {playlist_id: [track_id for entry_index, track_id in sorted(playlist)] for playlist_id, playlist in entries.items()}
+      self.indexes["track_playlists"] = {track_id: sorted(playlists) for track_id, playlists in track_playlists.items()}
+    return self.indexes[name]
+
+  def build_indexes(self):
+    self.indexes = {}
+    for target in id_tables:
+      if target not in self.pending:
+        self.ids(target)
+    for field in track_indexes:
+      self.get_tracks_by(field, 0)
+    for name in facets:
+      self.get_facet(name)
+
+  def get_entry(self, target, entry_id, name):
+    try:
+      return self.ids(target)[entry_id]
+    except KeyError:
+      raise KeyError("PDBDatabase: {} {} not found".format(name, entry_id))
 
   def get_track(self, track_id):
-    for track in self["tracks"]:
-      if track.id == track_id:
-        return track
-    raise KeyError("PDBDatabase: track {} not found".format(track_id))
+    return self.get_entry("tracks", track_id, "track")
 
   def get_artist(self, artist_id):
-    for artist in self["artists"]:
-      if artist.id == artist_id:
-        return artist
-    raise KeyError("PDBDatabase: artist {} not found".format(artist_id))
+    return self.get_entry("artists", artist_id, "artist")
 
   def get_album(self, album_id):
-    for album in self["albums"]:
-      if album.id == album_id:
-        return album
-    raise KeyError("PDBDatabase: album {} not found".format(album_id))
+    return self.get_entry("albums", album_id, "album")
 
   def get_key(self, key_id):
-    for key in self["key_names"]:
-      if key.id == key_id:
-        return key
-    raise KeyError("PDBDatabase: key {} not found".format(key_id))
+    return self.get_entry("key_names", key_id, "key")
 
   def get_genre(self, genre_id):
-    for genre in self["genres"]:
-      if genre.id == genre_id:
-        return genre
-    raise KeyError("PDBDatabase: genre {} not found".format(genre_id))
+    return self.get_entry("genres", genre_id, "genre")
 
   def get_label(self, label_id):
-    for label in self["labels"]:
-      if label.id == label_id:
-        return label
-    raise KeyError("PDBDatabase: label {} not found".format(genre_id))
+    return self.get_entry("labels", label_id, "label")
 
   def get_color(self, color_id):
-    for color in self["colors"]:
-      if color.id == color_id:
-        return color
-    raise KeyError("PDBDatabase: color {} not found".format(color_id))
+    return self.get_entry("colors", color_id, "color")
 
   def get_artwork(self, artwork_id):
-    for artwork in self["artwork"]:
-      if artwork.id == artwork_id:
-        return artwork
-    raise KeyError("PDBDatabase: artwork {} not found".format(artwork_id))
+    return self.get_entry("artwork", artwork_id, "artwork")
 
   # returns all playlists in folder "folder_id", sorted by the user-defined sort order
   def get_playlists(self, folder_id):
-    ff = lambda pl: pl.folder_id == folder_id
-    sf = lambda pl: pl.sort_order
-    return sorted(filter(ff, self["playlists"]), key=sf)
+    return list(self.playlist_index("playlist_children").get(folder_id, []))
 
   # returns all tracks in playlist "playlist_id", sorted by the user-defined sort order
   def get_playlist(self, playlist_id):
-    pms = filter(lambda pm: pm.playlist_id == playlist_id, self["playlist_map"])
-    sorted_pms = sorted(pms, key=lambda pm: pm.entry_index)
-    tracks = filter(lambda t: any(t.id == pm.track_id for pm in sorted_pms), self["tracks"])
-    return list(tracks)
-
-  def collect_entries(self, page_type, target):
-    for page in filter(lambda x: x.page_type == page_type, self.parsed.pages):
-      #logging.debug("parsing page %s %d", page.page_type, page.index)
-      for entry_block in page.entry_list:
-        for entry,enabled in zip(reversed(entry_block.entries), reversed(entry_block.entry_enabled)):
-          if not enabled:
-            continue
-          self[target] += [entry]
-    logging.debug("done collecting {}".format(target))
+    tracks = self.ids("tracks")
+    return [tracks[track_id] for track_id in self.playlist_index("playlist_tracks").get(playlist_id, []) if track_id in tracks]
+
+  # returns the ids of all playlists containing track "track_id"
+  def get_playlists_by_track(self, track_id):
+    return list(self.playlist_index("track_playlists").get(track_id, []))
+
+  # yields (header, page) of the data pages of page_type in data by following the page chain from the
+  # file header, strange and empty pages are skipped, as well as pages of other types linked by mistake
+  def table_pages(self, data, page_type):
+    chain = next((entry for entry in self.parsed.entries if entry.page_type == page_type), None)
+    if chain is None:
+      return
+    page_size = self.parsed.page_size
+    index = chain.first_page
+    visited = set()
+    while 0 < index < len(data)//page_size and index not in visited:
+      visited.add(index)
+      page = data[index*page_size:(index+1)*page_size]
+      header = decode_page_header(page)
+      if header.is_empty_page:
+        break
+      if header.page_type != page_type:
+        logging.debug("skipping page %d of type %s in %s chain", index, header.page_type, page_type)
+      elif not header.is_strange_page:
+        yield header, page
+      if index == chain.last_page:
+        break
+      index = header.next_index
 
+  def load_table(self, target):
+    with self.lock:
+      if target not in self.pending:
+        return
+      strings = self.track_strings if target == "tracks" else None
+      entries = []
+      for header, page in self.pages.pop(target, []):
+        entries += decode_rows(page, strings, header)
+      super().__setitem__(target, entries)
+      self.pending.discard(target)
+      logging.debug("loaded %d %s", len(entries), target)
+    # outside of the lock, the callback may evaluate the size of other databases
+    if self.load_callback is not None:
+      self.load_callback(self)
+
+  def load_tables(self):
+    for target in tables:
+      self.load_table(target)
+
+  # only the file header and the eager tables are parsed, the pages of each other table
+  # are parsed when it is accessed first. the pages of these tables are copied, so the file
+  # contents are released after loading the eager tables
   def load_file(self, filename):
     logging.info("Loading database \"%s\"", filename)
-    stat = os.stat(filename)
-    fh = PDBFile
     with open(filename, "rb") as f:
-      self.parsed = fh.parse_stream(f);
-
-    if stat.st_size != self.parsed["file_size"]:
-      raise RuntimeError("failed to parse the complete file ({}/{} bytes parsed)".format(self.parsed["file_size"], stat.st_size))
-
-    self.collect_entries("block_tracks", "tracks")
-    self.collect_entries("block_artists", "artists")
-    self.collect_entries("block_albums", "albums")
-    self.collect_entries("block_playlists", "playlists")
-    self.collect_entries("block_playlist_map", "playlist_map")
-    self.collect_entries("block_artwork", "artwork")
-    self.collect_entries("block_colors", "colors")
-    self.collect_entries("block_genres", "genres")
-    self.collect_entries("block_keys", "key_names")
-    self.collect_entries("block_labels", "labels")
-
-    logging.info("Loaded %d pages, %d tracks, %d playlists", len(self.parsed.pages), len(self["tracks"]), len(self["playlists"]))
+      data = f.read()
+    # parsed from a copy of the first page, the container keeps a reference to the parsed buffer
+    header = FileHeader.parse(data[:4096])
+    if len(data) % header.page_size != 0:
+      raise RuntimeError("incomplete file ({} bytes are no multiple of the page size)".format(len(data)))
+
+    with self.lock:
+      self.parsed = header
+      self.pending = set(tables)
+      view = memoryview(data)
+      for target, page_type in tables.items():
+        pages = self.table_pages(view, page_type)
+        self.pages[target] = list(pages) if target in eager_tables else [(page_header, bytes(page)) for page_header, page in pages]
+    for target in eager_tables:
+      self.load_table(target)
+    self.build_indexes()
+
+    logging.info("Loaded %d tracks, %d artists and %d albums of %d pages", len(self["tracks"]), len(self["artists"]), len(self["albums"]), len(data)//header.page_size)
@@ -0,0 +1,66 @@
+import os
+import socket
+import tempfile
+import time
+import unittest
+
+from prodj.data import remote
+from prodj.data.cachepeer import CachePeer
+from prodj.data.diskcache import DiskCache
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class CachePeerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = [tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()]
+        self.caches = [DiskCache(tmp.name) for tmp in self.tmp]
+        ports = [free_port(), free_port()]
+        self.peers = [CachePeer(self.caches[0], ports[0], [("127.0.0.1", ports[1])], broadcast=False),
+            CachePeer(self.caches[1], ports[1], [("127.0.0.1", ports[0])], broadcast=False)]
+
+    def tearDown(self):
+        for peer in self.peers:
+            peer.stop()
+        for tmp in self.tmp:
+            tmp.cleanup()
+
+    def wait_for_announcement(self, peer, fingerprint):
+        for i in range(50):
+            if len(peer.peers_holding(fingerprint)) > 0:
+                return
+            time.sleep(0.1)
+        self.fail("no announcement of {} received".format(fingerprint))
+
+    def test_fetch_from_peer(self):
+        self.caches[0].put("media", "track-1.DAT", b"PMAI")
+        for peer in self.peers:
+            peer.start()
+        self.wait_for_announcement(self.peers[1], "media")
+        self.assertEqual(self.peers[1].fetch("media", "track-1.DAT"), b"PMAI")
+        self.assertEqual(self.peers[0].served, 1)
+        # the item is now held locally
+        self.assertEqual(self.caches[1].get("media", "track-1.DAT"), b"PMAI")
+        self.assertIsNone(self.peers[1].fetch("media", "track-2.DAT"))
+        self.assertIsNone(self.peers[1].fetch("other", "track-1.DAT"))
+
+    def test_invalid_messages_are_ignored(self):
+        self.caches[0].put("media", "track-1.DAT", b"PMAI")
+        for peer in self.peers:
+            peer.start()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for announcement in [["announce", b"peer", "port", ["media"]], ["announce", b"peer", 1, 5],
+                    ["announce", b"peer", 1, [["unhashable"]]]]:
+                sock.sendto(remote.encode(announcement), ("127.0.0.1", self.peers[1].port))
+        self.wait_for_announcement(self.peers[1], "media")
+        self.assertEqual(len(self.peers[1].peers), 1)
+        # fingerprints and names are not used as paths unless they are plain file names
+        with socket.create_connection(("127.0.0.1", self.peers[0].port), timeout=2) as sock:
+            remote.send_frame(sock, ["get", "../" + os.path.basename(self.tmp[0].name), "media"])
+            self.assertIsNone(remote.receive_frame(sock))
+        with socket.create_connection(("127.0.0.1", self.peers[0].port), timeout=2) as sock:
+            remote.send_frame(sock, ["get", ["media"], "track-1.DAT"])
+            self.assertIsNone(remote.receive_frame(sock))
+        self.assertEqual(self.peers[1].fetch("media", "track-1.DAT"), b"PMAI")
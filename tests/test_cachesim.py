@@ -0,0 +1,59 @@
+import unittest
+
+from prodj.data.cachesim import ARCPolicy, CachePolicy, LFUPolicy, LRUPolicy, SizeAwarePolicy, simulate
+
+def record(key, size=10, source="pdb", latency=0.1):
+    return {"time": 0, "request": "metadata", "store": "metadata", "key": key, "size": size, "source": source, "latency": latency}
+
+class CacheSimulatorTestCase(unittest.TestCase):
+    def replay(self, policy, keys, size=10):
+        return [policy.access(key, size, 0.1) for key in keys]
+
+    def test_lru(self):
+        policy = LRUPolicy(20)
+        self.assertEqual(self.replay(policy, ["a", "b", "a", "c", "a", "b"]), [False, False, True, False, True, False])
+        self.assertLessEqual(policy.bytes, 20)
+
+    def test_lfu_keeps_frequent_entries(self):
+        policy = LFUPolicy(20)
+        self.assertEqual(self.replay(policy, ["a", "a", "b", "c", "a"]), [False, True, False, False, True])
+
+    def test_heaps_are_compacted(self):
+        for policy in [LFUPolicy(20), SizeAwarePolicy(20)]:
+            self.replay(policy, ["a", "b"]*100)
+            self.assertLessEqual(len(policy.heap), 2*len(policy.entries)+1)
+            self.assertEqual(self.replay(policy, ["c", "a"]), [False, True])
+
+    def test_abstract_policy(self):
+        with self.assertRaises(TypeError):
+            CachePolicy(20)
+
+    def test_arc_resists_scans(self):
+        policy = ARCPolicy(30)
+        self.replay(policy, ["a", "a", "b", "b"])
+        self.replay(policy, ["scan{}".format(i) for i in range(10)])
+        self.assertEqual(self.replay(policy, ["a", "b"]), [True, True])
+        self.assertLessEqual(policy.bytes, 30)
+
+    def test_size_aware_prefers_small_entries(self):
+        policy = SizeAwarePolicy(100)
+        policy.access("large", 90, 0.1)
+        policy.access("small", 10, 0.1)
+        policy.access("other", 10, 0.1)
+        self.assertTrue(policy.access("small", 10, 0.1))
+        self.assertFalse(policy.access("large", 90, 0.1))
+
+    def test_oversized_entries_are_not_cached(self):
+        for policy in [LRUPolicy(5), LFUPolicy(5), ARCPolicy(5), SizeAwarePolicy(5)]:
+            self.assertEqual(self.replay(policy, ["a", "a"]), [False, False])
+            self.assertEqual(policy.bytes, 0)
+
+    def test_simulate(self):
+        records = [record("a"), record("a", source="store", latency=0.001), record("b", latency=0.3), {**record("c"), "store": None}]
+        result = simulate(records, LRUPolicy(100))
+        self.assertEqual(result["requests"], 3)
+        self.assertEqual(result["hits"], 1)
+        self.assertEqual(result["bytes_fetched"], 20)
+        self.assertAlmostEqual(result["expected_latency"], (0.1+0.001+0.3)/3)
+        # store replies of the trace become fetches with the mean latency of the request if they miss
+        self.assertAlmostEqual(simulate(records, LRUPolicy(0))["expected_latency"], (0.1+0.2+0.3)/3)
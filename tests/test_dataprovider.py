@@ -0,0 +1,292 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import CancelledError, Future
+from threading import Event
+from unittest.mock import Mock
+
+from construct import Container
+
+from prodj.data.dataprovider import CancelToken, DataProvider, FatalQueryError, NotFoundQueryError, PRIORITY_PREFETCH, TemporaryQueryError, gather, resolve_future
+from prodj.data.trace import read_trace
+
+class DataProviderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.prodj = Mock()
+        self.dp = DataProvider(self.prodj)
+        self.dp.dbc_enabled = False
+        self.dp.pdb.handle_request = Mock(side_effect=self.pdb_reply)
+        self.dp.start()
+
+    def tearDown(self):
+        self.dp.stop()
+
+    def pdb_reply(self, request, params, cancel_token=None):
+        if request == "metadata" and params[2] == 404:
+            raise FatalQueryError("track not found")
+        if request == "artwork" and params[2] == 404:
+            return None
+        if params[0] == 3:
+            raise FatalQueryError("database download failed")
+        return {"request": request, "params": params}
+
+    def test_getter_returns_future(self):
+        future = self.dp.get_metadata(1, "usb", 42)
+        reply = future.result(timeout=5)
+        self.assertEqual(reply["params"], (1, "usb", 42))
+        self.prodj.cl.storeMetadataByLoadedTrack.assert_called_with(1, "usb", 42, reply)
+
+    def test_callback_and_future(self):
+        callback = Mock()
+        reply = self.dp.get_beatgrid(2, "sd", 7, callback).result(timeout=5)
+        self.dp.callback_executor.submit(lambda: None).result(timeout=5)
+        callback.assert_called_once_with("beatgrid", 2, "sd", 7, reply)
+
+    def test_slow_callback_does_not_block_requests(self):
+        release = Event()
+        blocked = self.dp.get_metadata(1, "usb", 1, lambda *args: release.wait(5))
+        self.dp.get_metadata(1, "usb", 2).result(timeout=2)
+        self.assertTrue(blocked.done())
+        release.set()
+
+    def test_trace_requests(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace.jsonl")
+            self.dp.start_trace(path)
+            self.dp.get_metadata(1, "usb", 42).result(timeout=5)
+            self.dp.get_metadata(1, "usb", 42).result(timeout=5)
+            self.dp.stop_trace()
+            records = list(read_trace(path))
+        self.assertEqual([record["source"] for record in records], ["pdb", "store"])
+        self.assertEqual(records[0]["key"], records[1]["key"])
+        self.assertEqual(records[0]["store"], "metadata")
+        self.assertGreater(records[0]["size"], 0)
+
+    def test_failed_request_sets_exception(self):
+        future = self.dp.get_metadata(1, "usb", 404)
+        with self.assertRaises(FatalQueryError):
+            future.result(timeout=5)
+
+    def test_unexpected_error_keeps_worker_running(self):
+        self.dp.pdb.handle_request = Mock(side_effect=[TypeError("bug in source"), {"request": "metadata"}])
+        with self.assertRaises(FatalQueryError):
+            self.dp.get_metadata(1, "usb", 1).result(timeout=5)
+        self.assertEqual(self.dp.get_metadata(1, "usb", 2).result(timeout=5), {"request": "metadata"})
+
+    def test_invalid_player_number(self):
+        future = self.dp.get_metadata(5, "usb", 1)
+        self.assertTrue(future.done())
+        self.assertIsInstance(future.exception(), FatalQueryError)
+
+    def test_priority_order(self):
+        self.dp.stop()
+        self.dp = DataProvider(self.prodj)
+        self.dp.dbc_enabled = False
+        self.dp.pdb.handle_request = Mock(side_effect=self.pdb_reply)
+        prefetch = self.dp.get_waveform(1, "usb", 1, priority=PRIORITY_PREFETCH)
+        default = self.dp.get_waveform(1, "usb", 2)
+        self.dp.start()
+        gather([prefetch, default], timeout=5)
+        calls = [call[0][1][2] for call in self.dp.pdb.handle_request.call_args_list]
+        self.assertEqual(calls, [2, 1])
+
+    def test_cancelled_requests_are_dropped(self):
+        self.dp.stop()
+        self.dp = DataProvider(self.prodj)
+        self.dp.pdb.handle_request = Mock(side_effect=self.pdb_reply)
+        token = CancelToken()
+        cancelled = self.dp.get_waveform(1, "usb", 1, cancel_token=token)
+        kept = self.dp.get_waveform(1, "usb", 2)
+        token.cancel()
+        self.dp.start()
+        kept.result(timeout=5)
+        self.assertTrue(cancelled.cancelled())
+        self.assertEqual(self.dp.pdb.handle_request.call_count, 1)
+
+    def test_load_shedding(self):
+        self.dp.stop()
+        self.dp = DataProvider(self.prodj)
+        self.dp.dbc_enabled = False
+        self.dp.pdb.handle_request = Mock(side_effect=self.pdb_reply)
+        self.dp.queue.max_size = 2
+        prefetch = self.dp.get_waveform(1, "usb", 1, priority=PRIORITY_PREFETCH)
+        kept = [self.dp.get_waveform(1, "usb", 2), self.dp.get_waveform(1, "usb", 3)]
+        self.assertIsInstance(prefetch.exception(timeout=0), TemporaryQueryError)
+        self.dp.queue.max_size = 10
+        expired = self.dp.get_waveform(1, "usb", 4, deadline=-1)
+        self.dp.start()
+        gather(kept, timeout=5)
+        self.assertIsInstance(expired.exception(timeout=5), TemporaryQueryError)
+        self.assertEqual(self.dp.pdb.handle_request.call_count, 2)
+        self.assertEqual(self.dp.stats()["requests"]["waveform"]["shed"], 2)
+        self.assertIn('prodj_requests_shed_total{reason="deadline",request="waveform"} 1', self.dp.prometheus_metrics())
+
+    def test_background_traffic_yields_to_waiting_requests(self):
+        self.dp.stop()
+        self.dp = DataProvider(self.prodj)
+        self.assertFalse(self.dp.pacer.realtime_waiting())
+        self.dp.get_waveform(1, "usb", 1, priority=PRIORITY_PREFETCH)
+        self.assertFalse(self.dp.pacer.realtime_waiting())
+        self.dp.get_waveform(1, "usb", 2)
+        self.assertTrue(self.dp.pacer.realtime_waiting())
+        self.dp.start()
+
+    def test_gather(self):
+        results = gather([
+            self.dp.get_metadata(1, "usb", 1),
+            self.dp.get_metadata(1, "usb", 404),
+            self.dp.get_artwork(1, "usb", 3)
+        ], timeout=5, return_exceptions=True)
+        self.assertEqual(results[0]["params"], (1, "usb", 1))
+        self.assertIsInstance(results[1], FatalQueryError)
+        self.assertEqual(results[2]["request"], "artwork")
+
+    def test_gather_cancelled(self):
+        token = CancelToken()
+        token.cancel()
+        cancelled = self.dp.get_metadata(1, "usb", 5, cancel_token=token)
+        results = gather([cancelled, self.dp.get_metadata(1, "usb", 6)], timeout=5, return_exceptions=True)
+        self.assertIsInstance(results[0], CancelledError)
+        self.assertEqual(results[1]["params"], (1, "usb", 6))
+        with self.assertRaises(CancelledError):
+            gather([cancelled], timeout=5)
+        # a reply arriving after the consumer cancelled is dropped
+        future = Future()
+        future.cancel()
+        resolve_future(future, {})
+
+    def test_stats(self):
+        gather([self.dp.get_metadata(1, "usb", 1), self.dp.get_metadata(1, "usb", 404)], timeout=5, return_exceptions=True)
+        self.dp.get_metadata(1, "usb", 1).result(timeout=5)
+        stats = self.dp.stats()["requests"]["metadata"]
+        self.assertEqual(stats["answered"], {"pdb": 1, "store": 1})
+        self.assertEqual(stats["fatal"], 1)
+        self.assertIn('prodj_requests_answered_total{request="metadata",source="store"} 1', self.dp.prometheus_metrics())
+
+    def test_hedged_request(self):
+        release = Event()
+        def dbc_reply(request, params):
+            release.wait(5)
+            return {"request": request, "params": params}
+        self.dp.adaptive = True
+        self.dp.dbc_enabled = True
+        self.dp.hedge_delay = 0.05
+        self.dp.dbc.handle_request = Mock(side_effect=dbc_reply)
+        # no database loaded yet, so dbc is asked first and pdb answers the hedged request
+        self.dp.get_metadata(1, "usb", 1).result(timeout=2)
+        release.set()
+        self.assertEqual(self.dp.stats()["requests"]["metadata"]["answered"], {"pdb": 1})
+        self.dp.dbc.handle_request.assert_called_once_with("metadata", (1, "usb", 1))
+
+    def test_negative_cache(self):
+        with self.assertRaises(NotFoundQueryError):
+            self.dp.get_artwork(1, "usb", 404).result(timeout=5)
+        with self.assertRaises(NotFoundQueryError):
+            self.dp.get_artwork(1, "usb", 404).result(timeout=5)
+        self.assertEqual(self.dp.pdb.handle_request.call_count, 1)
+        self.dp.cleanup_stores_from_changed_media(1, "usb")
+        with self.assertRaises(NotFoundQueryError):
+            self.dp.get_artwork(1, "usb", 404).result(timeout=5)
+        self.assertEqual(self.dp.pdb.handle_request.call_count, 2)
+
+    def test_circuit_breaker(self):
+        for track_id in range(5):
+            with self.assertRaises(FatalQueryError):
+                self.dp.get_metadata(3, "usb", track_id).result(timeout=5)
+        self.assertEqual(self.dp.pdb.handle_request.call_count, self.dp.breaker.failure_threshold)
+        self.assertTrue(self.dp.breaker.is_open((3, "usb", "pdb")))
+        self.dp.get_metadata(1, "usb", 1).result(timeout=5)
+
+    def test_pdb_only_requests_skip_dbc(self):
+        self.dp.dbc_enabled = True
+        self.dp.dbc.handle_request = Mock(return_value={"title": "from dbc"})
+        with self.assertRaises(FatalQueryError):
+            self.dp.preload_media(3, "usb").result(timeout=5)
+        for track_id in range(2): # as requested by the prefetcher
+            with self.assertRaises(FatalQueryError):
+                self.dp.get_track_playlists(3, "usb", track_id, priority=PRIORITY_PREFETCH).result(timeout=5)
+        self.assertFalse(self.dp.breaker.is_open((3, "usb", "dbc")))
+        self.assertEqual(self.dp.get_metadata(3, "usb", 1).result(timeout=5), {"title": "from dbc"})
+        self.dp.dbc.handle_request.assert_called_once_with("metadata", (3, "usb", 1))
+
+    def test_prefetcher_without_pdb(self):
+        self.dp.pdb_enabled = False
+        self.dp.get_track_playlists = Mock()
+        self.dp.prefetcher.prefetch_idle_decks = Mock()
+        self.dp.prefetcher.track_loaded(1, "usb", 1)
+        self.dp.get_track_playlists.assert_not_called()
+
+    def test_track_bundle(self):
+        def bundle_reply(player_number, slot, track_id, parts, part_callback, cancel_token=None):
+            part_callback("metadata", track_id, {"artwork_id": 5})
+            part_callback("beatgrid", track_id, ["beat"])
+            part_callback("waveform", track_id, None) # missing in pdb, requested separately
+            part_callback("artwork", 5, b"jpeg")
+        self.dp.pdb.get_track_bundle = Mock(side_effect=bundle_reply)
+        callback = Mock()
+        bundle = self.dp.get_track_bundle(1, "usb", 9, callback, ["metadata", "beatgrid", "waveform", "artwork"]).result(timeout=5)
+        self.dp.callback_executor.submit(lambda: None).result(timeout=5)
+        self.assertEqual(bundle["artwork"], b"jpeg")
+        self.assertEqual(bundle["waveform"]["request"], "waveform")
+        self.assertEqual([call[0][0] for call in callback.call_args_list], ["metadata", "beatgrid", "artwork", "waveform"])
+        self.assertEqual(self.dp.artwork_store[1, "usb", 5], b"jpeg")
+        self.dp.pdb.handle_request.assert_called_once_with("waveform", (1, "usb", 9), None)
+
+    def test_track_bundle_temporary_error(self):
+        def bundle_reply(player_number, slot, track_id, parts, part_callback, cancel_token=None):
+            part_callback("metadata", track_id, {"artwork_id": 0})
+            raise TemporaryQueryError("download timed out")
+        self.dp.pdb.get_track_bundle = Mock(side_effect=bundle_reply)
+        callback = Mock()
+        bundle = self.dp.get_track_bundle(1, "usb", 9, callback, ["metadata", "beatgrid"]).result(timeout=5)
+        self.dp.callback_executor.submit(lambda: None).result(timeout=5)
+        self.assertEqual(bundle["beatgrid"]["request"], "beatgrid")
+        self.assertEqual([call[0][0] for call in callback.call_args_list], ["metadata", "beatgrid"])
+        self.assertEqual(self.dp.pdb.get_track_bundle.call_count, 1)
+
+    def test_track_bundle_downloads_needed_files(self):
+        track = Container(id=9, artwork_id=0, analyze_path="/PIONEER/USBANLZ/P000/0000/ANLZ0000.DAT")
+        self.dp.pdb.get_db = Mock(return_value=Mock(get_track=Mock(return_value=track)))
+        download = Future()
+        download.set_result(None)
+        self.prodj.nfs.enqueue_download = Mock(return_value=download)
+        parts = []
+        self.dp.pdb.get_track_bundle(1, "usb", 9, ["beatgrid"], lambda request, item_id, reply: parts.append(request))
+        self.assertEqual(parts, ["beatgrid"])
+        self.assertEqual([call[0][2] for call in self.prodj.nfs.enqueue_download.call_args_list], [track.analyze_path])
+
+    def test_list_store(self):
+        first = self.dp.get_titles_by_album(1, "usb", 3).result(timeout=5)
+        self.dp.get_playlist_folder(1, "usb", 3).result(timeout=5)
+        self.assertEqual(self.dp.get_titles_by_album(1, "usb", 3).result(timeout=5), first)
+        self.dp.get_titles_by_album(1, "usb", 3, "bpm").result(timeout=5)
+        self.assertEqual(self.dp.pdb.handle_request.call_count, 3)
+        self.dp.cleanup_stores_from_changed_media(1, "usb")
+        self.dp.get_titles_by_album(1, "usb", 3).result(timeout=5)
+        self.assertEqual(self.dp.pdb.handle_request.call_count, 4)
+
+    def test_media_identity(self):
+        info = {"name": "USB", "track_count": 10, "playlist_count": 1, "bytes_total": 1000, "bytes_free": 10, "date": "2026-10-19"}
+        self.prodj.cl.getClient = lambda player_number: Mock(usb_info=info if player_number in [1, 2] else {})
+        reply = self.dp.get_metadata(1, "usb", 1).result(timeout=5)
+        self.dp.get_genres(1, "usb").result(timeout=5)
+        # the media moved to player 2, the free space reported by the players differs
+        self.dp.cleanup_stores_from_changed_media(1, "usb")
+        info["bytes_free"] = 20
+        self.assertIs(self.dp.get_metadata(2, "usb", 1).result(timeout=5), reply)
+        self.assertEqual(self.dp.stored_reply("metadata", 2, "usb", 1), reply)
+        self.assertIsNone(self.dp.stored_reply("metadata", 3, "usb", 1))
+        self.assertEqual(self.dp.pdb.handle_request.call_count, 2)
+        # lists of a changed media are requested again
+        self.dp.get_genres(2, "usb").result(timeout=5)
+        self.assertEqual(self.dp.pdb.handle_request.call_count, 3)
+
+    def test_loaded_tracks_are_pinned(self):
+        self.dp.get_beatgrid(1, "usb", 1).result(timeout=5)
+        self.dp.pin_loaded_track(2, 1, "usb", 1)
+        self.dp.governor.budget = 0
+        self.dp.get_waveform(1, "usb", 1).result(timeout=5)
+        self.dp.get_beatgrid(1, "usb", 2).result(timeout=5)
+        self.assertIsNotNone(self.dp.stored_reply("beatgrid", 1, "usb", 1))
+        self.assertIsNone(self.dp.stored_reply("beatgrid", 1, "usb", 2))
+        self.assertGreater(self.dp.stats()["memory"]["stores"]["beatgrid"], 0)
@@ -0,0 +1,40 @@
+import unittest
+
+from prodj.data.datastore import DataStore, janitor
+
+class DataStoreTestCase(unittest.TestCase):
+    def tearDown(self):
+        self.store.stop()
+
+    def test_least_recently_used(self):
+        self.store = DataStore(size_limit=2)
+        self.store[1, "usb", 1] = "a"
+        self.store[1, "usb", 2] = "b"
+        self.store[1, "usb", 1]
+        self.store[1, "usb", 3] = "c"
+        self.assertEqual(list(self.store), [(1, "usb", 1), (1, "usb", 3)])
+
+    def test_byte_limit(self):
+        self.store = DataStore(size_limit=10, byte_limit=1000, sizeof=len)
+        self.store[1, "usb", 1] = b"x"*400
+        self.store[1, "usb", 2] = b"x"*400
+        self.store[1, "usb", 3] = b"x"*400
+        self.assertEqual(list(self.store), [(1, "usb", 2), (1, "usb", 3)])
+        self.assertEqual(self.store.bytes, 800)
+        self.store[1, "usb", 4] = b"x"*2000 # larger than the limit, kept alone
+        self.assertEqual(list(self.store), [(1, "usb", 4)])
+
+    def test_remove_by_player_slot(self):
+        self.store = DataStore(byte_limit=1000)
+        self.store[1, "usb", 1] = [{"title": "a"}]
+        self.store[2, "usb", 1] = [{"title": "b"}]
+        self.store.removeByPlayerSlot(1, "usb")
+        self.assertEqual(list(self.store), [(2, "usb", 1)])
+        self.assertEqual(self.store.bytes, self.store.sizeof([{"title": "b"}]))
+
+    def test_max_age(self):
+        self.store = DataStore(max_age=0)
+        self.store[1, "usb", 1] = "a"
+        self.assertIn(self.store, janitor.stores)
+        self.store.gc()
+        self.assertEqual(len(self.store), 0)
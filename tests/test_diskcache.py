@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+
+from prodj.data.diskcache import DiskCache, media_fingerprint
+from prodj.data.media import media_identity
+
+class DiskCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = DiskCache(self.tmp.name, size_limit=1000)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get("media", "track-1.DAT"))
+        self.cache.put("media", "track-1.DAT", b"PMAI")
+        self.assertEqual(self.cache.get("media", "track-1.DAT"), b"PMAI")
+        # a new instance finds the files of the previous one
+        self.assertEqual(DiskCache(self.tmp.name).get("media", "track-1.DAT"), b"PMAI")
+
+    def test_corrupted_file(self):
+        self.cache.put("media", "artwork-1", b"jpeg data")
+        path = self.cache.path("media", "artwork-1")
+        with open(path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"X")
+        self.assertIsNone(self.cache.get("media", "artwork-1"))
+        self.assertFalse(os.path.exists(path))
+
+    def test_size_limit(self):
+        for track_id in range(3):
+            self.cache.put("media", "track-{}.EXT".format(track_id), b"x"*300)
+        self.cache.get("media", "track-0.EXT")
+        self.cache.put("media", "track-3.EXT", b"x"*300)
+        self.assertIsNotNone(self.cache.get("media", "track-0.EXT"))
+        self.assertIsNone(self.cache.get("media", "track-1.EXT"))
+        self.assertLessEqual(self.cache.bytes, 1000)
+
+    def test_media_fingerprint(self):
+        info = {"name": "USB", "date": "2026-10-19", "bytes_total": 16000000000, "bytes_free": 1000}
+        fingerprint = media_fingerprint(info, 42)
+        self.assertEqual(fingerprint, media_fingerprint(dict(info, bytes_free=500), 42))
+        self.assertNotEqual(fingerprint, media_fingerprint(info, 43))
+        self.assertIsNone(media_fingerprint({}, 42))
+        # the media identity is based on the same fields
+        self.assertEqual(media_identity(info), media_identity(dict(info, bytes_free=500)))
+        self.assertNotEqual(media_identity(info), media_identity(dict(info, bytes_total=1)))
@@ -0,0 +1,52 @@
+import unittest
+from unittest.mock import Mock
+
+from prodj.data.datastore import DataStore
+from prodj.data.governor import MemoryGovernor
+
+class MemoryGovernorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.governor = MemoryGovernor(budget=1000)
+        self.waveforms = DataStore(size_limit=100, sizeof=len)
+        self.beatgrids = DataStore(size_limit=100, sizeof=len)
+        self.governor.register("waveform", self.waveforms, 1)
+        self.governor.register("beatgrid", self.beatgrids, 4)
+
+    def tearDown(self):
+        self.waveforms.stop()
+        self.beatgrids.stop()
+
+    def test_budget(self):
+        self.beatgrids[1, "usb", 1] = b"x"*400
+        self.waveforms[1, "usb", 1] = b"x"*400
+        self.waveforms[1, "usb", 2] = b"x"*400
+        # the cheaper waveform is evicted although the beatgrid is older
+        self.assertEqual(list(self.waveforms), [(1, "usb", 2)])
+        self.assertEqual(list(self.beatgrids), [(1, "usb", 1)])
+        self.assertEqual(self.governor.usage(), {"waveform": 400, "beatgrid": 400})
+
+    def test_pinned(self):
+        self.waveforms.pinned = lambda: {(1, "usb", 1)}
+        self.waveforms[1, "usb", 1] = b"x"*600
+        self.waveforms[1, "usb", 2] = b"x"*600
+        self.assertEqual(list(self.waveforms), [(1, "usb", 1)])
+        self.waveforms[1, "usb", 3] = b"x"*100
+        self.assertEqual(self.governor.used(), 700)
+
+    def test_pinned_once_per_pass(self):
+        pinned = Mock(return_value=set())
+        self.waveforms.pinned = pinned
+        for track_id in range(4):
+            self.waveforms[1, "usb", track_id] = b"x"*300
+        pinned.reset_mock()
+        self.beatgrids[1, "usb", 1] = b"x"*900
+        self.assertEqual(len(self.waveforms), 0)
+        self.assertEqual(pinned.call_count, 1)
+
+    def test_update_size(self):
+        value = bytearray(100)
+        self.waveforms[1, "usb", 1] = b"x"*400
+        self.beatgrids[1, "usb", 1] = value
+        value.extend(bytes(700))
+        self.beatgrids.update_size(value)
+        self.assertEqual(self.governor.usage(), {"waveform": 0, "beatgrid": 800})
@@ -0,0 +1,33 @@
+import unittest
+
+from prodj.network.pacer import BACKGROUND, REALTIME, Pacer
+
+class PacerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pacer = Pacer()
+        self.pacer.query_rates = {REALTIME: None, BACKGROUND: 10}
+
+    def test_budgets(self):
+        with self.pacer.traffic(BACKGROUND):
+            delays = [self.pacer.reserve(1, "query") for i in range(12)]
+        self.assertEqual(delays[:10], [0]*10)
+        self.assertAlmostEqual(delays[11], 0.2, places=2)
+        # realtime traffic and other players are not affected
+        self.assertEqual(self.pacer.reserve(1, "query"), 0)
+        self.assertEqual(self.pacer.reserve(2, "query", traffic_class=BACKGROUND), 0)
+
+    def test_realtime_waiting(self):
+        self.pacer.realtime_waiting = lambda: True
+        delays = [self.pacer.reserve(1, "query", traffic_class=BACKGROUND) for i in range(12)]
+        self.assertEqual(delays, [0]*12)
+
+    def test_backoff(self):
+        for i in range(5):
+            self.pacer.record_response(1, 0.01)
+        for i in range(10):
+            self.pacer.record_response(1, 0.5)
+        self.assertEqual(self.pacer.rate(1, "query", BACKGROUND), 10*self.pacer.min_backoff)
+        self.assertEqual(self.pacer.rate(2, "query", BACKGROUND), 10)
+        for i in range(100):
+            self.pacer.record_response(1, 0.01)
+        self.assertEqual(self.pacer.rate(1, "query", BACKGROUND), 10)
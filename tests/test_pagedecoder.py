@@ -0,0 +1,51 @@
+import unittest
+
+from prodj.pdblib.page import AlignedPage, PageHeader
+from prodj.pdblib.pagedecoder import decode_page_header, decode_rows, decode_track, track_row, track_strings
+from prodj.pdblib.track import Track
+
+def construct_rows(page):
+    return [entry for block in AlignedPage.parse(page).entry_list
+        for entry, enabled in zip(reversed(block.entries), reversed(block.entry_enabled)) if enabled]
+
+def fields(container):
+    return {key: value for key, value in container.items() if not key.startswith("_")}
+
+def short_string(text):
+    data = text.encode("ascii")
+    return bytes([(len(data)+1)*2+1])+data
+
+class PageDecoderTestCase(unittest.TestCase):
+    blobs = ["tests/blobs/pdb_artists_common.bin", "tests/blobs/pdb_artists_strange_string.bin"]
+
+    def test_equivalence_with_construct(self):
+        for blob in self.blobs:
+            with open(blob, "rb") as f:
+                page = f.read()
+            self.assertEqual(fields(decode_page_header(memoryview(page))), fields(PageHeader.parse(page)))
+            expected = construct_rows(page)
+            rows = decode_rows(memoryview(page))
+            self.assertEqual(len(rows), len(expected))
+            for row, entry in zip(rows, expected):
+                self.assertEqual(fields(row), fields(entry))
+
+    def test_selected_strings(self):
+        with open(self.blobs[0], "rb") as f:
+            page = f.read()
+        row = decode_rows(page, strings=[])[0]
+        self.assertNotIn("name", row)
+        self.assertEqual(row.id, construct_rows(page)[0].id)
+
+    def test_track_row(self):
+        values = [0x24, 0x20, 0x700, 44100, 0, 1234567, 5, 19048, 30967, 12, 3, 0, 4, 0, 320, 7, 12800,
+            2, 9, 8, 42, 1, 3, 2019, 16, 245, 41, 5, 4, 1, 2]
+        strings = [short_string("Test Track" if name == "title" else name) for name in track_strings]
+        offsets = []
+        position = track_row.size
+        for string in strings:
+            offsets += [position]
+            position += len(string)
+        row = track_row.pack(*values, *offsets)+b"".join(strings)
+        self.assertEqual(fields(decode_track(row, 0)), fields(Track.parse(row)))
+        self.assertEqual(decode_track(row, 0, strings=["title"]).title, "Test Track")
+        self.assertNotIn("path", decode_track(row, 0, strings=["title"]))
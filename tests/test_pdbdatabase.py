@@ -0,0 +1,138 @@
+import gc
+import os
+import struct
+import tempfile
+import tracemalloc
+import unittest
+from unittest.mock import Mock
+
+from construct import Container
+
+from prodj.data.dataprovider import DataProvider
+from prodj.pdblib.fileheader import FileHeader
+from prodj.pdblib.page import AlignedPage
+from prodj.pdblib.pdbdatabase import PDBDatabase
+
+def track(track_id, artist_id, album_id, genre_id, title):
+    return Container(id=track_id, artist_id=artist_id, album_id=album_id, genre_id=genre_id, label_id=0, key_id=0,
+        title=title, artwork_id=0, original_artist_id=0, remixer_id=0, bpm_100=12800)
+
+class PDBDatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = PDBDatabase()
+        self.db["tracks"] += [track(1, 1, 1, 1, "One"), track(2, 2, 1, 2, "Two"), track(3, 1, 2, 1, "Three"), track(4, 1, 2, 2, "Four")]
+        self.db["artists"] += [Container(id=1, name="Artist A"), Container(id=2, name="Artist B")]
+        self.db["albums"] += [Container(id=1, name="Album A"), Container(id=2, name="Album B")]
+        self.db["genres"] += [Container(id=1, name="House"), Container(id=2, name="Techno")]
+        self.db["playlists"] += [Container(id=10, folder_id=0, sort_order=2, is_folder=0, name="Warmup"),
+            Container(id=11, folder_id=0, sort_order=1, is_folder=1, name="Sets"),
+            Container(id=12, folder_id=11, sort_order=1, is_folder=0, name="Peak")]
+        self.db["playlist_map"] += [Container(entry_index=2, track_id=1, playlist_id=10),
+            Container(entry_index=1, track_id=4, playlist_id=10), Container(entry_index=1, track_id=1, playlist_id=12)]
+        self.db.build_indexes()
+
+    def test_get_by_id(self):
+        self.assertEqual(self.db.get_track(3).title, "Three")
+        self.assertEqual(self.db.get_artist(2).name, "Artist B")
+        with self.assertRaisesRegex(KeyError, "label 5"):
+            self.db.get_label(5)
+
+    def test_find_tracks(self):
+        self.assertEqual([t.id for t in self.db.find_tracks(artist_id=1)], [1, 3, 4])
+        self.assertEqual([t.id for t in self.db.find_tracks(artist_id=1, genre_id=2)], [4])
+        self.assertEqual(self.db.find_tracks(album_id=3), [])
+        self.assertEqual(len(self.db.find_tracks()), 4)
+
+    def test_facets(self):
+        self.assertEqual(self.db.get_facet("genre_artists", 1), {1: 2})
+        self.assertEqual(self.db.get_facet("artist_albums", 1), {1: 1, 2: 2})
+        self.assertEqual(self.db.get_facet("genre_artist_albums", 2, 1), {2: 1})
+        self.assertEqual([album.name for album in self.db.get_facet_entries("albums", "genre_albums", 2)], ["Album A", "Album B"])
+        self.assertEqual(self.db.get_facet_entries("albums", "genre_albums", 3), [])
+        self.assertEqual(self.db.find_tracks(genre_id=2, artist_id=1, album_id=1), [])
+
+    def test_playlists(self):
+        self.assertEqual([p.name for p in self.db.get_playlists(0)], ["Sets", "Warmup"])
+        self.assertEqual([p.name for p in self.db.get_playlists(11)], ["Peak"])
+        self.assertEqual(self.db.get_playlists(12), [])
+        # tracks in entry_index order, not in table order
+        self.assertEqual([t.id for t in self.db.get_playlist(10)], [4, 1])
+        self.assertEqual(self.db.get_playlist(13), [])
+        self.assertEqual(self.db.get_playlists_by_track(1), [10, 12])
+
+    def test_provider_lists(self):
+        pdb = DataProvider(Mock()).pdb
+        pdb.get_db = Mock(return_value=self.db)
+        titles = pdb.get_titles(1, "usb", "title", [1, 0])
+        self.assertEqual([entry["title"] for entry in titles], ["Four", "One", "Three"])
+        artists = pdb.get_artists(1, "usb", [2])
+        self.assertEqual([entry["artist"] for entry in artists[1:]], ["Artist A", "Artist B"])
+        albums = pdb.get_albums(1, "usb", [1, 1])
+        self.assertEqual([entry["album"] for entry in albums[1:]], ["Album A", "Album B"])
+
+def enabled_entries(page):
+    return sum(sum(enabled for entry, enabled in zip(reversed(block.entries), reversed(block.entry_enabled))) for block in page.entry_list)
+
+class PDBFileLoadingTestCase(unittest.TestCase):
+    def setUp(self):
+        with open("tests/blobs/pdb_artists_common.bin", "rb") as f:
+            self.first_page = f.read()
+        with open("tests/blobs/pdb_artists_strange_string.bin", "rb") as f:
+            self.second_page = f.read()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, "export.pdb")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_pdb(self, artists_chain):
+        header = FileHeader.build(dict(page_entries=1, next_unused_page=4, unknown1=1, sequence=5,
+            entries=[dict(page_type="block_artists", empty_candidate=0, first_page=1, last_page=artists_chain[-1])]))
+        # the first artist page links to the page after it in the chain, page 2 is not part of any table
+        first_page = self.first_page[:12]+struct.pack("<I", artists_chain[1] if len(artists_chain) > 1 else 0)+self.first_page[16:]
+        with open(self.filename, "wb") as f:
+            f.write(header+first_page+bytes(4096)+self.second_page)
+
+    def test_page_chain(self):
+        self.write_pdb([1, 3])
+        db = PDBDatabase()
+        db.load_file(self.filename)
+        expected = enabled_entries(AlignedPage.parse(self.first_page))+enabled_entries(AlignedPage.parse(self.second_page))
+        self.assertEqual(len(db["artists"]), expected)
+        self.assertEqual(db.get_artist(768).name, "Gerwin ft. LaMeduza")
+        self.assertEqual(db.get_artist(1446).id, 1446)
+        self.assertEqual(db.parsed.sequence, 5)
+
+    def test_lazy_tables(self):
+        self.write_pdb([1])
+        db = PDBDatabase()
+        db.load_file(self.filename)
+        self.assertIn("playlists", db.pending)
+        self.assertNotIn("artists", db.pending)
+        db.load_callback = Mock()
+        self.assertEqual(db.get_playlists(0), [])
+        self.assertNotIn("playlists", db.pending)
+        db.load_callback.assert_called_with(db)
+        self.assertEqual(list(db.pages), ["artwork", "colors", "genres", "key_names", "labels"])
+        db.load_tables()
+        self.assertEqual(db.pages, {})
+
+    def test_file_contents_are_released(self):
+        self.write_pdb([1, 3])
+        with open(self.filename, "ab") as f:
+            f.write(bytes(256*4096)) # unused pages
+        tracemalloc.start()
+        db = PDBDatabase()
+        db.load_file(self.filename)
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        self.assertLess(retained, 128*4096)
+        self.assertEqual(db.parsed.sequence, 5)
+
+    def test_incomplete_file(self):
+        self.write_pdb([1])
+        with open(self.filename, "r+b") as f:
+            f.truncate(3*4096-100)
+        with self.assertRaises(RuntimeError):
+            PDBDatabase().load_file(self.filename)
@@ -0,0 +1,30 @@
+import unittest
+
+from prodj.data.records import ListEntry, Metadata
+
+class RecordsTestCase(unittest.TestCase):
+    def test_metadata(self):
+        md = Metadata(title="Song", artwork_id=0)
+        md.update({"bpm": 128.0, "unknown1": 5})
+        self.assertEqual(md["title"], "Song")
+        self.assertEqual(md.get("artist", ""), "")
+        self.assertIn("unknown1", md)
+        self.assertNotIn("artist", md)
+        self.assertEqual(md, {"title": "Song", "artwork_id": 0, "bpm": 128.0, "unknown1": 5})
+        with self.assertRaises(KeyError):
+            md["album"]
+
+    def test_list_entry_columns(self):
+        entry = ListEntry(title="Song", track_id=1, artist_id=2, key="09A", key_id=4)
+        self.assertEqual(list(entry), ["title", "key", "key_id", "track_id", "artist_id"])
+        self.assertEqual({**entry}["key"], "09A")
+        self.assertEqual(sorted([ListEntry(artist="b"), ListEntry(artist="a")], key=lambda e: e["artist"])[0]["artist"], "a")
+        self.assertEqual(dict(ListEntry(all=" ALL ")), {"all": " ALL "})
+
+    def test_list_entry_contains_iterated_keys(self):
+        for entry in [ListEntry(artist="A", artist_id=3), ListEntry(title="Song", track_id=1, artist_id=2, key="09A", key_id=4),
+                ListEntry(playlist="Set", playlist_id=5, parent_id=0), ListEntry(all=" ALL ")]:
+            for key in entry:
+                self.assertIn(key, entry)
+            self.assertNotIn("genre_id", entry)
+        self.assertEqual(ListEntry(artist="A", artist_id=3).get("artist_id"), 3)
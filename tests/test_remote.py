@@ -0,0 +1,98 @@
+import os
+import socket
+import tempfile
+import unittest
+from threading import Event
+from unittest.mock import Mock
+
+from prodj.data.dataprovider import DataProvider, FatalQueryError, NotFoundQueryError, TemporaryQueryError
+from prodj.data.remote import RemoteDataProvider, decode, encode, receive_frame, send_frame
+
+class RemoteDataProviderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dp = DataProvider(Mock())
+        self.dp.dbc_enabled = False
+        self.dp.pdb.handle_request = Mock(side_effect=self.pdb_reply)
+        self.dp.start()
+        self.release = Event()
+        self.release.set()
+        self.address = os.path.join(tempfile.mkdtemp(), "data.sock")
+        self.dp.start_remote_server(self.address)
+        self.client = RemoteDataProvider(self.address)
+
+    def tearDown(self):
+        self.client.stop()
+        self.dp.stop()
+
+    def pdb_reply(self, request, params, cancel_token=None):
+        if request == "metadata" and params[2] == 2:
+            self.release.wait(5)
+        if request == "artwork" and params[2] == 404:
+            return None
+        return {"request": request, "params": list(params), "data": b"\x00\x01"}
+
+    def test_encoding(self):
+        value = {"title": "Ä", "id": -300, "bpm": 128.5, "blob": b"\xff", "list": [None, True, False, 2**40]}
+        self.assertEqual(decode(encode(value)), value)
+        with self.assertRaises(ValueError):
+            decode(encode(value)[:-1])
+
+    def test_pipelined_requests(self):
+        callback = Mock()
+        futures = [self.client.get_waveform(1, "usb", track_id) for track_id in range(10)]
+        futures += [self.client.get_titles(1, "usb", "default", callback)]
+        replies = [future.result(timeout=5) for future in futures]
+        self.assertEqual([reply["params"][2] for reply in replies[:10]], list(range(10)))
+        self.client.callback_executor.submit(lambda: None).result(timeout=5)
+        callback.assert_called_once_with("title", 1, "usb", "default", replies[10])
+
+    def test_validation_token(self):
+        first = self.client.get_metadata(1, "usb", 1).result(timeout=5)
+        second = self.client.get_metadata(1, "usb", 1).result(timeout=5)
+        self.assertEqual(first, second)
+        self.assertEqual(self.client.validated_replies, 1)
+
+    def test_error(self):
+        with self.assertRaises(NotFoundQueryError):
+            self.client.get_artwork(1, "usb", 404).result(timeout=5)
+
+    def test_invalid_requests(self):
+        with self.assertRaises(FatalQueryError):
+            self.client.request("metadata", [1, "usb", 1], priority="x").result(timeout=5)
+        with self.assertRaises(FatalQueryError):
+            self.client.request("metadata", [1, "usb", 1.5]).result(timeout=5)
+        for params in [[1, "../usb", 1], [1, 3, 1], [0, "usb", 1], [5, "usb", 1]]:
+            with self.assertRaises(FatalQueryError):
+                self.client.request("metadata", params).result(timeout=5)
+        self.dp.pdb.handle_request.assert_not_called()
+        # the server keeps handling requests, out of range priorities are clamped
+        self.assertEqual(self.client.request("metadata", [1, "usb", 1], priority=-5).result(timeout=5)["params"], [1, "usb", 1])
+
+    def test_validated_reply_evicted(self):
+        first = self.client.get_metadata(1, "usb", 2).result(timeout=5)
+        self.dp.metadata_store.discard((1, "usb", 2))
+        self.release.clear()
+        future = self.client.get_metadata(1, "usb", 2)
+        self.client.cache.discard(("metadata", (1, "usb", 2)))
+        self.release.set()
+        self.assertEqual(future.result(timeout=5), first)
+        self.assertEqual(self.client.validated_replies, 0)
+
+    def test_invalid_reply(self):
+        address = os.path.join(tempfile.mkdtemp(), "invalid.sock")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(address)
+            server.listen(1)
+            client = RemoteDataProvider(address)
+            conn, _ = server.accept()
+            with conn:
+                future = client.get_metadata(1, "usb", 1)
+                request_id = receive_frame(conn)[0]
+                send_frame(conn, [request_id, "error", [], "not a pair", None])
+                with self.assertRaises(TemporaryQueryError):
+                    future.result(timeout=5)
+                client.receiver.join(5)
+                self.assertFalse(client.receiver.is_alive())
+                with self.assertRaises(TemporaryQueryError):
+                    client.get_metadata(1, "usb", 2).result(timeout=5)
+            client.stop()